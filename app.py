@@ -1,15 +1,26 @@
+import time
+STARTED_AT = time.perf_counter()
+
 import os
+import json
 import shutil
+import asyncio
+import hashlib
+import threading
 import gradio as gr
-import chromadb
 from dotenv import load_dotenv
 
-from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
-from langchain.prompts import PromptTemplate
-from langchain.chains import RetrievalQA
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
+from langchain_core.prompts import PromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from shared.embedding_cache import CachedEmbeddings
+from shared.rate_limited_embeddings import RateLimitedEmbeddings
+from shared.ingestion_pipeline import iter_ingestion_pipeline, describe_progress
+from shared.answer_cache import AnswerCache
+from shared.concurrency import ReadWriteLock, iterate_in_thread, iterate_async
+from shared.hybrid_retrieval import HybridRetriever, KeywordIndex, backfill_keyword_index
+from shared.context_packing import pack_context, estimate_tokens
+from shared.metrics import RequestTrace, record_llm_call, configure_trace_log, start_metrics_server
+from shared.snapshot import Snapshot, SnapshotVectorStore, export_snapshot, import_snapshot, current_snapshot_id
 
 # --- PROJECT SETUP ---
 load_dotenv()
@@ -24,115 +35,422 @@ if not API_KEY or API_KEY == "YOUR_API_KEY_HERE":
 PDFS_DIR = "PDFs"
 VECTOR_STORE_DIR = "vector_store"
 COLLECTION_NAME = "ask_my_docs_collection"
+MANIFEST_PATH = os.path.join(VECTOR_STORE_DIR, "manifest.json")
+KEYWORD_INDEX_PATH = os.path.join(VECTOR_STORE_DIR, "keywords.sqlite3")
+CACHE_DIR = "cache"
+EMBEDDING_CACHE_PATH = os.path.join(CACHE_DIR, "embeddings.sqlite3")
+INGEST_BATCH_SIZE = 64
+INGEST_EMBED_WORKERS = 4
+EMBED_REQUESTS_PER_MINUTE = 1500
+EMBED_TOKENS_PER_MINUTE = 1_000_000
+EMBED_MAX_BATCH_SIZE = 100
+ANSWER_CACHE_MAX_ENTRIES = 256
+ANSWER_CACHE_TTL_SECONDS = 3600
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0")) # e.g. 0.95 also reuses answers of similar questions
+QUERY_CONCURRENCY_LIMIT = 16
+QUEUE_MAX_SIZE = 256
+RETRIEVAL_TOP_K = 5
+RETRIEVAL_CANDIDATES = 30
+CONTEXT_TOKEN_BUDGET = 3000
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464")) # 0 disables the /metrics endpoint
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH") # JSON-lines log of per-request stage timings
+# Snapshots: the writer publishes the knowledge base after every change; replicas serve the latest one read-only
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+SNAPSHOT_EXPORT_ON_WRITE = os.getenv("SNAPSHOT_EXPORT_ON_WRITE", "false").lower() in ("1", "true", "yes")
+SERVE_SNAPSHOT = os.getenv("SERVE_SNAPSHOT", "false").lower() in ("1", "true", "yes")
+SNAPSHOT_POLL_SECONDS = int(os.getenv("SNAPSHOT_POLL_SECONDS", "10"))
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", "3"))
+READ_ONLY_STATUS = "Status: This instance serves a read-only snapshot. Make changes on the writer instance."
 os.makedirs(PDFS_DIR, exist_ok=True)
 os.makedirs(VECTOR_STORE_DIR, exist_ok=True)
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+# --- GLOBAL INSTANCES (Initialized once, on first use) ---
+# The Google clients, Chroma and the answer cache are created lazily so the UI can be
+# served before the heavy imports and client construction; warm_up() preloads them.
+models = {"llm": None, "embeddings": None, "answer_cache": None}
+models_lock = threading.Lock()
+
+def get_embeddings():
+    """Returns the shared (cached) embeddings client, creating it on first use."""
+    with models_lock:
+        if models["embeddings"] is None:
+            try:
+                from langchain_google_genai import GoogleGenerativeAIEmbeddings
+                models["embeddings"] = CachedEmbeddings(
+                    RateLimitedEmbeddings(
+                        GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key=API_KEY),
+                        requests_per_minute=EMBED_REQUESTS_PER_MINUTE,
+                        tokens_per_minute=EMBED_TOKENS_PER_MINUTE,
+                        max_batch_size=EMBED_MAX_BATCH_SIZE,
+                    ),
+                    EMBEDDING_CACHE_PATH,
+                    checkpoint_size=EMBED_MAX_BATCH_SIZE,
+                )
+            except Exception as e:
+                raise RuntimeError(f"Failed to initialize Google AI models. Check your API key and network connection. Error: {e}")
+        return models["embeddings"]
+
+def get_llm():
+    """Returns the shared chat model, creating it on first use."""
+    with models_lock:
+        if models["llm"] is None:
+            try:
+                from langchain_google_genai import ChatGoogleGenerativeAI
+                models["llm"] = ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0.7, google_api_key=API_KEY)
+            except Exception as e:
+                raise RuntimeError(f"Failed to initialize Google AI models. Check your API key and network connection. Error: {e}")
+        return models["llm"]
 
-# --- GLOBAL INSTANCES (Initialized once) ---
-try:
-    embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key=API_KEY)
-    llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0.7, google_api_key=API_KEY)
-except Exception as e:
-    raise RuntimeError(f"Failed to initialize Google AI models. Check your API key and network connection. Error: {e}")
+def get_answer_cache():
+    """Returns the answer cache, creating it on first use."""
+    embeddings = get_embeddings()
+    with models_lock:
+        if models["answer_cache"] is None:
+            models["answer_cache"] = AnswerCache(
+                max_entries=ANSWER_CACHE_MAX_ENTRIES, ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+                embeddings=embeddings, similarity_threshold=ANSWER_CACHE_SIMILARITY,
+            )
+        return models["answer_cache"]
+
+def open_vector_store():
+    """Opens the persistent Chroma collection (Chroma is imported here, not at startup)."""
+    import chromadb
+    from langchain_community.vectorstores import Chroma
+    return Chroma(
+        client=chromadb.PersistentClient(path=VECTOR_STORE_DIR),
+        collection_name=COLLECTION_NAME,
+        embedding_function=get_embeddings(),
+    )
 
 vector_store_instance = None
+# BM25 index over the same chunks as the collection, for exact-token matches
+# (replicas build theirs in memory from the served snapshot)
+keyword_index = KeywordIndex(":memory:" if SERVE_SNAPSHOT else KEYWORD_INDEX_PATH)
+serving_snapshot = None
+snapshot_lock = threading.Lock()
+
+# The retriever is built once per vector store generation and shared across requests
+store_generation = 0
+retriever_cache = {"generation": None, "retriever": None}
+retriever_lock = threading.Lock()
+
+# Queries hold the read side while they search; mutations take the write side
+# only for the duration of a single batch, delete or clear.
+store_lock = ReadWriteLock()
 
 # --- CORE LOGIC ---
 
+def bump_store_generation():
+    """Marks the knowledge base as changed so the cached retriever is rebuilt."""
+    global store_generation
+    store_generation += 1
+
+def file_sha256(path):
+    """Returns the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_manifest():
+    """Loads the {filename: {"hash", "chunk_ids"}} manifest of indexed PDFs."""
+    if not os.path.exists(MANIFEST_PATH):
+        return {}
+    try:
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Could not read manifest, a full rebuild will be done: {e}")
+        return {}
+
+def save_manifest(manifest):
+    """Atomically writes the manifest next to the vector store."""
+    tmp_path = MANIFEST_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+# --- SNAPSHOTS ---
+
+def export_knowledge_base_snapshot():
+    """
+    Publishes every chunk with its vector and the PDF manifest as a new snapshot.
+    Queries keep running meanwhile; writers wait. Returns the snapshot ID, or None.
+    """
+    try:
+        store = vector_store_instance or open_vector_store()
+        with store_lock.read():
+            return export_snapshot(store._collection, SNAPSHOT_DIR, extras={"pdf_manifest": load_manifest()},
+                                   keep=SNAPSHOT_KEEP)
+    except Exception as e:
+        print(f"Could not export a snapshot of the knowledge base: {e}")
+        return None
+
+def restore_from_snapshot(collection):
+    """
+    Fills an empty collection from the published snapshot without re-embedding and
+    restores its manifest, so a new instance only embeds the PDFs changed since the
+    export. Returns the restored manifest, or None if there is no usable snapshot.
+    """
+    snapshot_id = current_snapshot_id(SNAPSHOT_DIR)
+    if snapshot_id is None:
+        return None
+    try:
+        snapshot = Snapshot(os.path.join(SNAPSHOT_DIR, snapshot_id))
+        with store_lock.write():
+            import_snapshot(snapshot, collection)
+            keyword_index.clear()
+        manifest = snapshot.extra("pdf_manifest", {})
+        save_manifest(manifest)
+        return manifest
+    except Exception as e:
+        print(f"Could not restore from snapshot {snapshot_id}: {e}")
+        return None
+
+def refresh_serving_snapshot():
+    """
+    Swaps in the snapshot that CURRENT points to if it is not the one being served.
+    It is verified and its keyword index built before the swap, so queries only
+    wait for the swap itself. Returns True on a swap.
+    """
+    global vector_store_instance, keyword_index, serving_snapshot
+    with snapshot_lock:
+        snapshot_id = current_snapshot_id(SNAPSHOT_DIR)
+        if snapshot_id is None or (serving_snapshot is not None and serving_snapshot.snapshot_id == snapshot_id):
+            return False
+        started = time.perf_counter()
+        try:
+            snapshot = Snapshot(os.path.join(SNAPSHOT_DIR, snapshot_id))
+            store = SnapshotVectorStore(snapshot, get_embeddings())
+            keywords = KeywordIndex(":memory:")
+            backfill_keyword_index(keywords, store._collection)
+        except Exception as e:
+            print(f"Could not open snapshot {snapshot_id}, keeping the current one: {e}")
+            return False
+        with store_lock.write():
+            vector_store_instance, keyword_index, serving_snapshot = store, keywords, snapshot
+            bump_store_generation()
+        print(f"Serving snapshot {snapshot_id} ({snapshot.rows} chunk(s), loaded in {time.perf_counter() - started:.2f}s).")
+        return True
+
+def start_snapshot_sync():
+    """
+    On a replica, starts a daemon thread that polls for newly published snapshots.
+    On a writer that exports snapshots, publishes a first one if none exists yet.
+    """
+    if SERVE_SNAPSHOT:
+        def poll():
+            while True:
+                refresh_serving_snapshot()
+                time.sleep(SNAPSHOT_POLL_SECONDS)
+        threading.Thread(target=poll, name="snapshot-watcher", daemon=True).start()
+    elif SNAPSHOT_EXPORT_ON_WRITE and current_snapshot_id(SNAPSHOT_DIR) is None:
+        threading.Thread(target=export_knowledge_base_snapshot, name="snapshot-export", daemon=True).start()
+
 def rebuild_vector_store(files):
-    """Rebuilds the vector store from ALL PDFs in the PDFs directory."""
+    """
+    Brings the vector store in line with the PDFs directory.
+    Only new or modified files are re-embedded; chunks of removed files are deleted.
+    Uploads with the same bytes as an indexed PDF under another name are skipped.
+    An empty collection is first restored from the published snapshot, if any.
+    Yields status updates as batches are indexed.
+    """
     global vector_store_instance
+    if SERVE_SNAPSHOT:
+        yield READ_ONLY_STATUS
+        return
+    duplicates = []
     if files:
+        known_hashes = {entry["hash"]: pdf_file for pdf_file, entry in load_manifest().items()}
         for file in files:
-            shutil.copy(file.name, os.path.join(PDFS_DIR, os.path.basename(file.name)))
+            file_name = os.path.basename(file.name)
+            file_hash = file_sha256(file.name)
+            if known_hashes.get(file_hash, file_name) != file_name:
+                duplicates.append(f"{file_name} (same file as {known_hashes[file_hash]})")
+                continue
+            known_hashes[file_hash] = file_name
+            shutil.copy(file.name, os.path.join(PDFS_DIR, file_name))
 
     pdf_files = [f for f in os.listdir(PDFS_DIR) if f.endswith(".pdf")]
     if not pdf_files:
-        return "Status: No PDF files found. Please upload at least one."
+        yield "Status: No PDF files found. Please upload at least one."
+        return
 
-    print("Rebuilding knowledge base...")
-    documents = []
-    for pdf_file in pdf_files:
-        try:
-            loader = PyPDFLoader(os.path.join(PDFS_DIR, pdf_file))
-            documents.extend(loader.load())
-        except Exception as e:
-            print(f"Error loading {pdf_file}: {e}")
-    
-    if not documents:
-        return "Status: Could not extract text from any PDFs."
+    print("Updating knowledge base...")
+    trace = RequestTrace("ingest", files=len(pdf_files))
+    vector_store_instance = open_vector_store()
 
-    texts = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200).split_documents(documents)
-    
-    client = chromadb.PersistentClient(path=VECTOR_STORE_DIR)
-    try:
-        client.delete_collection(name=COLLECTION_NAME)
-    except Exception as e:
-        print(f"Collection deletion failed (might not exist): {e}")
+    manifest = load_manifest()
+    if vector_store_instance._collection.count() == 0:
+        manifest = restore_from_snapshot(vector_store_instance._collection) or manifest
+    if manifest and vector_store_instance._collection.count() == 0:
+        print("Manifest found but the collection is empty; re-indexing everything.")
+        manifest = {}
+        keyword_index.clear()
+    backfill_keyword_index(keyword_index, vector_store_instance._collection)
+
+    current_hashes = {pdf_file: file_sha256(os.path.join(PDFS_DIR, pdf_file)) for pdf_file in pdf_files}
+    removed = [f for f in manifest if f not in current_hashes]
+    changed = [f for f, h in current_hashes.items() if manifest.get(f, {}).get("hash") != h]
 
-    vector_store_instance = Chroma.from_documents(
-        documents=texts, embedding=embeddings, client=client,
-        collection_name=COLLECTION_NAME, persist_directory=VECTOR_STORE_DIR
+    # 1. Drop chunks of removed or modified files
+    stale_ids = []
+    for pdf_file in removed + [f for f in changed if f in manifest]:
+        stale_ids.extend(manifest.pop(pdf_file)["chunk_ids"])
+    if stale_ids:
+        with store_lock.write():
+            vector_store_instance._collection.delete(ids=stale_ids)
+            keyword_index.delete(stale_ids)
+        print(f"Removed {len(stale_ids)} stale chunk(s).")
+
+    # 2. Stream only new or modified files through the ingestion pipeline
+    with trace.span("pipeline"):
+        for result in iter_ingestion_pipeline(
+            [os.path.join(PDFS_DIR, pdf_file) for pdf_file in changed],
+            vector_store_instance,
+            get_embeddings(),
+            # The file name keeps the IDs of identical PDFs saved under different names apart
+            chunk_id_prefix=lambda pdf_path: f"{current_hashes[os.path.basename(pdf_path)]}-{os.path.basename(pdf_path)}",
+            batch_size=INGEST_BATCH_SIZE,
+            embed_workers=INGEST_EMBED_WORKERS,
+            write_lock=store_lock.write,
+            keyword_index=keyword_index,
+        ):
+            if not result["done"]:
+                yield describe_progress(result)
+    for pdf_path, ids in result["chunk_ids"].items():
+        pdf_file = os.path.basename(pdf_path)
+        manifest[pdf_file] = {"hash": current_hashes[pdf_file], "chunk_ids": ids}
+    failed_files = [os.path.basename(pdf_path) for pdf_path in result["failed"]]
+
+    save_manifest(manifest)
+    bump_store_generation()
+    trace.finish("ok" if not failed_files else "partial", indexed=len(result["chunk_ids"]),
+                 failed=len(failed_files), chunks=result["chunks_indexed"])
+    if SNAPSHOT_EXPORT_ON_WRITE:
+        export_knowledge_base_snapshot()
+
+    if not vector_store_instance._collection.count():
+        yield "Status: Could not extract text from any PDFs."
+        return
+
+    status = (
+        f"Status: Knowledge base contains {len(manifest)} PDF(s) "
+        f"({len(changed) - len(failed_files)} indexed, {len(removed)} removed, "
+        f"{len(pdf_files) - len(changed)} unchanged). Ready for questions."
     )
-    return f"Status: Knowledge base created from {len(pdf_files)} PDF(s). Ready for questions."
+    if failed_files:
+        status += f" Failed to process: {', '.join(failed_files)}."
+    if duplicates:
+        status += f" Skipped {len(duplicates)} duplicate(s): {', '.join(duplicates)}."
+    yield status
 
-def get_answer(question):
-    """Handles the question asking logic."""
-    if not question:
-        return "Please enter a question.", ""
-    
-    qa_chain = get_qa_chain()
-    if qa_chain is None:
-        return "The knowledge base has not been created yet. Please process your PDFs first.", ""
+def format_sources(docs):
+    """Lists the source file and page of each retrieved document."""
+    return "\n".join(
+        [f"- {os.path.basename(doc.metadata.get('source', 'Unknown'))}, page {doc.metadata.get('page', 'N/A')}"
+         for doc in docs]
+    )
 
-    try:
-        result = qa_chain.invoke({"query": question})
-        answer = result.get("result", "No answer found.")
-        sources = "\n".join(
-            [f"- {os.path.basename(doc.metadata.get('source', 'Unknown'))}, page {doc.metadata.get('page', 'N/A')}"
-             for doc in result.get("source_documents", [])]
-        )
-        return answer, sources
-    except Exception as e:
-        print(f"Error during Q&A: {e}")
-        return "An error occurred while generating the answer.", ""
+def get_answer(question):
+    """Synchronous get_answer_async (used by scripts and the benchmarks), so both run the same code."""
+    yield from iterate_async(get_answer_async(question))
 
 def clear_all_data():
     """Clears the vector store collection and all PDFs."""
     global vector_store_instance
-    vector_store_instance = None
-    
-    try:
-        client = chromadb.PersistentClient(path=VECTOR_STORE_DIR)
-        client.delete_collection(name=COLLECTION_NAME)
-    except Exception as e:
-        print(f"Could not clear collection (it might not exist): {e}")
+    if SERVE_SNAPSHOT:
+        return READ_ONLY_STATUS
+    with store_lock.write():
+        vector_store_instance = None
+        bump_store_generation()
+
+        try:
+            import chromadb
+            client = chromadb.PersistentClient(path=VECTOR_STORE_DIR)
+            client.delete_collection(name=COLLECTION_NAME)
+        except Exception as e:
+            print(f"Could not clear collection (it might not exist): {e}")
+
+        keyword_index.clear()
+        if os.path.exists(MANIFEST_PATH):
+            os.remove(MANIFEST_PATH)
 
     if os.path.exists(PDFS_DIR):
         shutil.rmtree(PDFS_DIR)
     os.makedirs(PDFS_DIR)
+    if SNAPSHOT_EXPORT_ON_WRITE:
+        export_knowledge_base_snapshot()
     
     return "Status: All documents and knowledge base have been cleared."
 
-# --- LANGCHAIN SETUP ---
+# --- ASYNC HANDLERS ---
+# Blocking work runs in worker threads so the Gradio event loop stays free to serve queries.
 
-def get_qa_chain():
-    """Builds and returns a RetrievalQA chain using the vector store."""
-    global vector_store_instance
-    if vector_store_instance is None:
-        if not os.listdir(VECTOR_STORE_DIR): return None
-        try:
-            vector_store_instance = Chroma(
-                client=chromadb.PersistentClient(path=VECTOR_STORE_DIR),
-                collection_name=COLLECTION_NAME,
-                embedding_function=embeddings,
-            )
-        except Exception as e:
-            print(f"Failed to load vector store from disk: {e}")
-            return None
+async def rebuild_vector_store_async(files):
+    async for status in iterate_in_thread(rebuild_vector_store(files)):
+        yield status
 
-    retriever = vector_store_instance.as_retriever(search_kwargs={"k": 5})
-    
-    prompt_template = """
+async def get_answer_async(question):
+    """
+    Handles the question asking logic with the async LangChain APIs.
+    Yields the sources as soon as retrieval finishes, then the answer as it streams in.
+    """
+    if not question:
+        yield "Please enter a question.", ""
+        return
+
+    retriever = await asyncio.to_thread(get_retriever)
+    if retriever is None:
+        yield "The knowledge base has not been created yet. Please process your PDFs first.", ""
+        return
+
+    trace = RequestTrace("question")
+    generation = store_generation
+    answer_cache = await asyncio.to_thread(get_answer_cache)
+    cached = await asyncio.to_thread(answer_cache.get, question, generation)
+    if cached is not None:
+        trace.finish("cache_hit")
+        yield cached
+        return
+
+    try:
+        async with store_lock.read_async():
+            with trace.span("search"):
+                docs = await retriever.ainvoke(question)
+        with trace.span("context_packing"):
+            context, docs, _ = pack_context(docs, max_tokens=CONTEXT_TOKEN_BUDGET)
+            prompt_tokens = estimate_tokens(QA_PROMPT.format(context=context, question=question))
+        print(f"Prompt: ~{prompt_tokens} tokens sent to the LLM.")
+        sources = format_sources(docs)
+        yield "*Generating answer...*", sources
+
+        answer = ""
+        answer_chain = await asyncio.to_thread(get_answer_chain)
+        with trace.span("generation"):
+            async for token in answer_chain.astream({"context": context, "question": question}):
+                answer += token
+                yield answer, sources
+        record_llm_call("answer", prompt_tokens, estimate_tokens(answer))
+        if not answer:
+            trace.finish("empty", prompt_tokens=prompt_tokens)
+            yield "No answer found.", sources
+            return
+        await asyncio.to_thread(answer_cache.put, question, generation, answer, sources)
+        trace.finish(prompt_tokens=prompt_tokens, documents=len(docs))
+    except Exception as e:
+        print(f"Error during Q&A: {e}")
+        trace.finish("error", error=str(e))
+        yield "An error occurred while generating the answer.", ""
+
+async def clear_all_data_async():
+    return await asyncio.to_thread(clear_all_data)
+
+# --- LANGCHAIN SETUP ---
+
+QA_PROMPT_TEMPLATE = """
     Use the following pieces of context from the uploaded documents to answer the question at the end.
     If you don't know the answer based on the provided context, just say that you don't know. Do not make up an answer.
     Keep the answer concise and helpful.
@@ -144,14 +462,70 @@ def get_qa_chain():
 
     Helpful Answer:
     """
-    QA_PROMPT = PromptTemplate(template=prompt_template, input_variables=["context", "question"])
+QA_PROMPT = PromptTemplate(template=QA_PROMPT_TEMPLATE, input_variables=["context", "question"])
 
-    return RetrievalQA.from_chain_type(
-        llm, retriever=retriever, chain_type_kwargs={"prompt": QA_PROMPT}, return_source_documents=True
-    )
+answer_chain = None
+
+def get_answer_chain():
+    """Takes pre-retrieved context so the answer can be streamed token by token."""
+    global answer_chain
+    if answer_chain is None:
+        answer_chain = QA_PROMPT | get_llm() | StrOutputParser()
+    return answer_chain
+
+def get_retriever():
+    """Returns the cached retriever, rebuilding it only after the vector store changed."""
+    global vector_store_instance
+    with retriever_lock:
+        if retriever_cache["generation"] == store_generation and retriever_cache["retriever"] is not None:
+            return retriever_cache["retriever"]
+
+        if vector_store_instance is None and SERVE_SNAPSHOT:
+            refresh_serving_snapshot()
+            if vector_store_instance is None: return None
+        if vector_store_instance is None:
+            try:
+                vector_store_instance = open_vector_store()
+            except Exception as e:
+                print(f"Failed to load vector store from disk: {e}")
+                return None
+        # The keyword index creates its file in VECTOR_STORE_DIR at import, so an empty
+        # knowledge base is recognized by its collection rather than by the directory
+        if vector_store_instance._collection.count() == 0:
+            return None
+
+        # Dense and BM25 candidates are fused and reranked locally; only the top few reach the prompt
+        backfill_keyword_index(keyword_index, vector_store_instance._collection)
+        retriever = HybridRetriever(
+            collection=vector_store_instance._collection,
+            keyword_index=keyword_index,
+            embeddings=get_embeddings(),
+            top_k=RETRIEVAL_TOP_K,
+            candidates=RETRIEVAL_CANDIDATES,
+        )
+        retriever_cache.update(generation=store_generation, retriever=retriever)
+        return retriever
+
+def warm_up():
+    """Loads the models and the vector store in the background ahead of the first question."""
+    try:
+        get_answer_chain()
+        get_answer_cache()
+        get_retriever()
+        print("Warm-up complete.")
+    except Exception as e:
+        print(f"Warm-up failed, components will be loaded on first use: {e}")
 
 # --- GRADIO UI SETUP ---
 
+first_page_served = threading.Event()
+
+def log_first_page():
+    """Logs the time from process start to the first page served."""
+    if not first_page_served.is_set():
+        first_page_served.set()
+        print(f"Time to first page: {time.perf_counter() - STARTED_AT:.2f}s")
+
 def setup_gradio_ui():
     """Sets up and launches the Gradio web interface."""
     with gr.Blocks(theme=gr.themes.Soft(), title="Ask My Docs") as app:
@@ -176,14 +550,27 @@ def setup_gradio_ui():
                 gr.Markdown("### Sources")
                 sources_output = gr.Markdown("Source documents will be listed here...")
 
-        # Link UI components to the core logic functions
-        process_button.click(rebuild_vector_store, inputs=[file_uploader], outputs=[processing_status])
-        ask_button.click(get_answer, inputs=[question_input], outputs=[answer_output, sources_output])
-        clear_button.click(clear_all_data, inputs=[], outputs=[processing_status])
+        # Link UI components to the core logic functions.
+        # Store mutations share one "ingest" slot; questions run concurrently up to their own limit.
+        process_button.click(rebuild_vector_store_async, inputs=[file_uploader], outputs=[processing_status],
+                             concurrency_limit=1, concurrency_id="ingest")
+        ask_button.click(get_answer_async, inputs=[question_input], outputs=[answer_output, sources_output],
+                         concurrency_limit=QUERY_CONCURRENCY_LIMIT, concurrency_id="query")
+        clear_button.click(clear_all_data_async, inputs=[], outputs=[processing_status],
+                           concurrency_limit=1, concurrency_id="ingest")
+        app.load(log_first_page)
 
+    app.queue(max_size=QUEUE_MAX_SIZE)
     return app
 
 # --- MAIN EXECUTION ---
 if __name__ == "__main__":
+    configure_trace_log(TRACE_LOG_PATH)
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+    start_snapshot_sync()
     gradio_app = setup_gradio_ui()
+    print(f"UI built in {time.perf_counter() - STARTED_AT:.2f}s")
+    # Models and the vector store load in the background while the first page is served
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
     gradio_app.launch(share=True, debug=True)
\ No newline at end of file
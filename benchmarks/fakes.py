@@ -0,0 +1,132 @@
+import re
+import json
+import math
+import time
+import random
+import hashlib
+import threading
+from typing import Any, List, Optional
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+
+def _digest(text):
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic local stand-in for the Gemini embeddings: every token is hashed
+    into one of `size` dimensions (feature hashing) and the vector is normalized,
+    so texts sharing words are close. latency_seconds simulates one API call per batch.
+    """
+
+    def __init__(self, size=256, latency_seconds=0.0):
+        self.size = size
+        self.latency_seconds = latency_seconds
+        self.model = f"fake-embedding-{size}"
+
+    def _embed(self, text):
+        vector = [0.0] * self.size
+        for token in re.findall(r"\w+", text.lower()):
+            digest = _digest(token)
+            vector[int.from_bytes(digest[:4], "big") % self.size] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+    def embed_documents(self, texts):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        return self._embed(text)
+
+class FakeRateLimitError(Exception):
+    """Mimics the 429 the Gemini API returns when the quota is exhausted."""
+
+class ThrottlingEmbeddings(Embeddings):
+    """
+    Wraps embeddings and injects throttling errors: a seeded fraction
+    (throttle_rate) of calls fails, and so does every batch larger than
+    max_batch_size. Counts calls and throttles so retry behaviour can be checked.
+    """
+
+    def __init__(self, underlying, throttle_rate=0.2, max_batch_size=None, seed=0):
+        self.underlying = underlying
+        self.model = getattr(underlying, "model", "fake-embedding")
+        self.throttle_rate = throttle_rate
+        self.max_batch_size = max_batch_size
+        self.calls = 0
+        self.throttled = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _check(self, size):
+        with self._lock:
+            self.calls += 1
+            if (self.max_batch_size and size > self.max_batch_size) or self._rng.random() < self.throttle_rate:
+                self.throttled += 1
+                raise FakeRateLimitError("429 Resource has been exhausted (e.g. check quota).")
+
+    def embed_documents(self, texts):
+        self._check(len(texts))
+        return self.underlying.embed_documents(texts)
+
+    def embed_query(self, text):
+        self._check(1)
+        return self.underlying.embed_query(text)
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic local stand-in for the Gemini chat model. It answers the
+    self-query constructor prompt with a structured request (an invoice_number
+    filter when the question names an invoice), structured-output calls with
+    invoice details derived from the prompt hash, and QA prompts with a fixed-size
+    answer that streams word by word. latency_seconds is added to every call.
+    """
+
+    model: str = "fake-chat"
+    latency_seconds: float = 0.0
+    answer_words: int = 40
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _respond(self, prompt):
+        if "Structured Request" in prompt:
+            query = prompt.rsplit("User Query:", 1)[-1].split("Structured Request:", 1)[0].strip()
+            match = re.search(r"\bINV[-\w]*\d\b", query)
+            query_filter = f'eq("invoice_number", "{match.group(0)}")' if match else "NO_FILTER"
+            return "```json\n" + json.dumps({"query": query, "filter": query_filter}) + "\n```"
+        words = [f"w{b}" for b in _digest(prompt)] * (self.answer_words // 32 + 1)
+        return "Based on the provided context: " + " ".join(words[:self.answer_words])
+
+    def _generate(self, messages, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs) -> ChatResult:
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        text = self._respond(messages[-1].content)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _stream(self, messages, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        for token in re.findall(r"\S+\s*", self._respond(messages[-1].content)):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    def with_structured_output(self, schema, **kwargs):
+        def extract(prompt):
+            if self.latency_seconds:
+                time.sleep(self.latency_seconds)
+            digest = _digest(str(prompt))
+            return schema(
+                invoice_date=f"2025-{digest[0] % 12 + 1:02d}-{digest[1] % 28 + 1:02d}",
+                invoice_number=f"INV{int.from_bytes(digest[2:5], 'big') % 100000:05d}",
+                total_value=float(int.from_bytes(digest[5:8], 'big') % 500000) + 1.0,
+                vendor_name=f"Vendor {digest[8] % 20}",
+            )
+        return RunnableLambda(extract)
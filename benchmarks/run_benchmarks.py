@@ -0,0 +1,344 @@
+"""
+Offline benchmarks for the ingestion and query paths of app.py and version_2.
+
+Every (app, size) run happens in a fresh subprocess and working directory, with
+the Gemini LLM and embeddings replaced by the deterministic fakes in fakes.py and
+a synthetic invoice corpus generated from the bundled invoice layout, so results
+only depend on the code and the machine. Results are written as JSON and can be
+compared across runs:
+
+    python benchmarks/run_benchmarks.py --sizes 10 1000 10000
+    python benchmarks/run_benchmarks.py --compare results/old.json results/new.json
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from types import SimpleNamespace
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+VERSION_2_DIR = os.path.join(REPO_DIR, "version_2")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+APPS = ["app", "version_2"]
+
+# --- MEASUREMENT HELPERS ---
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[index]
+
+def summarize(operation, latencies, items):
+    """Turns per-call latencies (seconds) into throughput and latency percentiles."""
+    total = sum(latencies)
+    return {
+        "operation": operation,
+        "calls": len(latencies),
+        "items": items,
+        "total_seconds": round(total, 4),
+        "throughput_per_second": round(items / total, 3) if total else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3) if latencies else None,
+        "max_ms": round(max(latencies) * 1000, 3) if latencies else None,
+    }
+
+def peak_memory_mb():
+    """Peak resident memory of this process and of its (parse pool) children, in MB."""
+    if resource is None:
+        return {"self": None, "children": None}
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024 # ru_maxrss is bytes on macOS, KB on Linux
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1),
+    }
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+def drain(generator):
+    """Runs a streaming handler to completion and returns its last update."""
+    last = None
+    for last in generator:
+        pass
+    return last
+
+def build_questions(records, count, seed):
+    """Deterministic lookup questions (one per sampled invoice) and aggregate questions."""
+    from synthetic_corpus import VENDORS
+    sample = random.Random(seed).sample(records, min(count, len(records)))
+    lookups = [f"Who was billed on invoice {record['invoice_number']}?" for record in sample]
+    aggregates = [f"What is the average invoice value for {vendor}?" for vendor in VENDORS]
+    return lookups, aggregates
+
+def bench_answers(get_answer, answer_cache, questions, name):
+    """Times get_answer with the answer cache disabled, then again with every answer cached."""
+    max_entries = answer_cache.max_entries
+    answer_cache.max_entries = 0
+    results = [summarize(name, [timed(lambda q=q: drain(get_answer(q))) for q in questions], len(questions))]
+    answer_cache.max_entries = max_entries
+    for question in questions:
+        drain(get_answer(question))
+    results.append(summarize(f"{name}_cached", [timed(lambda q=q: drain(get_answer(q))) for q in questions], len(questions)))
+    return results
+
+def directory_mb(path):
+    total = 0
+    for root, _, names in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in names)
+    return round(total / (1024 * 1024), 2)
+
+def vector_recall(collection, embeddings, questions, k=10):
+    """Mean recall@k of the collection's vector search against an exact brute-force search."""
+    import numpy as np
+    stored = collection.get(include=["documents"])
+    vectors = np.asarray(embeddings.embed_documents(stored["documents"]), dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    k = min(k, len(stored["ids"]))
+    recalls = []
+    for question in questions:
+        query = np.asarray(embeddings.embed_query(question), dtype=np.float32)
+        exact = {stored["ids"][i] for i in np.argsort(-(vectors @ query), kind="stable")[:k]}
+        found = collection.query(query_embeddings=[query.tolist()], n_results=k, include=[])["ids"][0]
+        recalls.append(len(exact & set(found)) / k)
+    return round(sum(recalls) / len(recalls), 4) if recalls else None
+
+def install_fakes(models, embedding_cache_path, options):
+    from fakes import FakeChatModel, FakeEmbeddings, ThrottlingEmbeddings
+    from shared.embedding_cache import CachedEmbeddings
+    from shared.rate_limited_embeddings import RateLimitedEmbeddings
+    models["llm"] = FakeChatModel(latency_seconds=options.llm_latency_ms / 1000.0)
+    embeddings = FakeEmbeddings(latency_seconds=options.embed_latency_ms / 1000.0)
+    if options.throttle_rate:
+        embeddings = RateLimitedEmbeddings(
+            ThrottlingEmbeddings(embeddings, throttle_rate=options.throttle_rate, seed=options.seed),
+            max_retries=20, base_delay=0.01, max_delay=0.1,
+        )
+    models["embeddings"] = CachedEmbeddings(embeddings, embedding_cache_path)
+
+# --- BENCHMARKS ---
+
+def bench_app(options):
+    """app.py: full, unchanged and incremental rebuild_vector_store, then get_answer."""
+    from synthetic_corpus import generate_corpus
+    os.environ["GEMINI_API_KEY"] = "benchmark"
+    import app
+    install_fakes(app.models, app.EMBEDDING_CACHE_PATH, options)
+
+    records = generate_corpus(os.path.join(options.workdir, "corpus"), options.size, seed=options.seed)
+    files = [SimpleNamespace(name=record["path"]) for record in records]
+    results = [
+        summarize("rebuild_vector_store_full", [timed(lambda: drain(app.rebuild_vector_store(files)))], len(files)),
+        summarize("rebuild_vector_store_unchanged", [timed(lambda: drain(app.rebuild_vector_store(None)))], len(files)),
+    ]
+
+    # Overwrite 1% of the indexed files with different invoices of the same name
+    changed = generate_corpus(os.path.join(options.workdir, "changed"), max(1, options.size // 100), seed=options.seed + 1)
+    for record in changed:
+        shutil.copy(record["path"], os.path.join(app.PDFS_DIR, os.path.basename(record["path"])))
+    results.append(summarize(
+        "rebuild_vector_store_incremental", [timed(lambda: drain(app.rebuild_vector_store(None)))], len(changed)
+    ))
+
+    lookups, _ = build_questions(records, options.queries, options.seed)
+    results += bench_answers(app.get_answer, app.get_answer_cache(), lookups, "get_answer")
+    return results
+
+def bench_version_2(options):
+    """version_2: add_to_vector_store in upload batches, get_answer, then remove_selected_pdf."""
+    from synthetic_corpus import generate_corpus
+    os.environ["GOOGLE_API_KEY"] = "benchmark"
+    os.environ["WARM_UP_ON_START"] = "false"
+    os.environ["VECTOR_BACKEND"] = options.vector_backend
+    sys.path.insert(0, VERSION_2_DIR)
+    import llm_utils
+    from config import EMBEDDING_CACHE_PATH
+    install_fakes(llm_utils._models, EMBEDDING_CACHE_PATH, options)
+    import vector_store_manager
+    import qa_chain_builder
+
+    records = generate_corpus(os.path.join(options.workdir, "corpus"), options.size, seed=options.seed)
+    latencies = []
+    for start in range(0, len(records), options.upload_batch):
+        files = [SimpleNamespace(name=record["path"]) for record in records[start:start + options.upload_batch]]
+        latencies.append(timed(lambda: drain(vector_store_manager.add_to_vector_store(files))))
+    results = [summarize("add_to_vector_store", latencies, len(records))]
+
+    lookups, aggregates = build_questions(records, options.queries, options.seed)
+    answer_cache = qa_chain_builder.get_answer_cache()
+    results += bench_answers(qa_chain_builder.get_answer, answer_cache, lookups, "get_answer")
+    results += bench_answers(qa_chain_builder.get_answer, answer_cache, aggregates, "get_answer_aggregate")
+    options.extra["vector_recall_at_10"] = vector_recall(
+        vector_store_manager.get_vector_store_instance()._collection, llm_utils.get_embeddings(), lookups
+    )
+    options.extra["vector_store_mb"] = directory_mb("vector_store")
+
+    names = [os.path.basename(record["path"]) for record in records[:min(options.queries, len(records))]]
+    results.append(summarize(
+        "remove_selected_pdf",
+        [timed(lambda name=name: vector_store_manager.remove_selected_pdf([name])) for name in names],
+        len(names),
+    ))
+    return results
+
+def run_worker(options):
+    """Runs one (app, size) benchmark inside options.workdir and writes its JSON result."""
+    sys.path[:0] = [BENCH_DIR, REPO_DIR]
+    os.chdir(options.workdir)
+    started = time.perf_counter()
+    options.extra = {}
+    operations = bench_app(options) if options.app == "app" else bench_version_2(options)
+    result = {
+        "app": options.app,
+        "size": options.size,
+        "wall_seconds": round(time.perf_counter() - started, 3),
+        "peak_memory_mb": peak_memory_mb(),
+        "operations": operations,
+        **options.extra,
+    }
+    if options.app == "version_2":
+        result["vector_backend"] = options.vector_backend
+    with open(options.result_file, "w", encoding="utf-8") as f:
+        json.dump(result, f)
+
+# --- ORCHESTRATION ---
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def run_all(options):
+    runs = []
+    for app_name in options.apps:
+        for size in options.sizes:
+            workdir = tempfile.mkdtemp(prefix=f"ask-my-docs-bench-{app_name}-{size}-")
+            result_file = os.path.join(workdir, "result.json")
+            log_path = os.path.join(workdir, "benchmark.log")
+            command = [
+                sys.executable, os.path.abspath(__file__), "--worker", "--app", app_name, "--size", str(size),
+                "--workdir", workdir, "--result-file", result_file, "--queries", str(options.queries),
+                "--upload-batch", str(options.upload_batch), "--seed", str(options.seed),
+                "--llm-latency-ms", str(options.llm_latency_ms), "--embed-latency-ms", str(options.embed_latency_ms),
+                "--throttle-rate", str(options.throttle_rate), "--vector-backend", options.vector_backend,
+            ]
+            print(f"Running {app_name} with {size} document(s)...")
+            with open(log_path, "w", encoding="utf-8") as log:
+                completed = subprocess.run(command, stdout=log, stderr=subprocess.STDOUT)
+            if completed.returncode != 0 or not os.path.exists(result_file):
+                with open(log_path, encoding="utf-8") as log:
+                    print(f"  failed (exit code {completed.returncode}), last log lines:\n" + "".join(log.readlines()[-20:]))
+                runs.append({"app": app_name, "size": size, "error": f"exit code {completed.returncode}"})
+            else:
+                with open(result_file, encoding="utf-8") as f:
+                    runs.append(json.load(f))
+                print_run(runs[-1])
+            if not options.keep:
+                shutil.rmtree(workdir, ignore_errors=True)
+    return runs
+
+def print_run(run):
+    memory = run["peak_memory_mb"]
+    print(f"  {run['app']} @ {run['size']} docs: {run['wall_seconds']}s wall, "
+          f"peak RSS {memory['self']} MB (parse workers {memory['children']} MB)")
+    if "vector_store_mb" in run:
+        print(f"    {run['vector_backend']} vector store: {run['vector_store_mb']} MB on disk, "
+              f"recall@10 vs exact search {run['vector_recall_at_10']}")
+    for op in run["operations"]:
+        print(f"    {op['operation']:<34} {op['calls']:>6} call(s) {op['throughput_per_second'] or 0:>10.2f}/s "
+              f"p50 {op['p50_ms']:>10.2f} ms  p95 {op['p95_ms']:>10.2f} ms")
+
+def compare(old_path, new_path):
+    """Prints the relative change in throughput and latency between two result files."""
+    def index(path):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return {(run["app"], run["size"], op["operation"]): op
+                for run in data["runs"] if "operations" in run for op in run["operations"]}
+
+    def change(old, new):
+        return f"{(new - old) / old * 100:+7.1f}%" if old and new is not None else "    n/a"
+
+    old, new = index(old_path), index(new_path)
+    print(f"{'app':<10} {'size':>6} {'operation':<34} {'throughput':>10} {'p50':>8} {'p95':>8}")
+    for key in sorted(set(old) & set(new), key=lambda k: (k[0], k[1], k[2])):
+        o, n = old[key], new[key]
+        print(f"{key[0]:<10} {key[1]:>6} {key[2]:<34} {change(o['throughput_per_second'], n['throughput_per_second']):>10} "
+              f"{change(o['p50_ms'], n['p50_ms']):>8} {change(o['p95_ms'], n['p95_ms']):>8}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline ingestion and query benchmarks with local model fakes.")
+    parser.add_argument("--apps", nargs="+", choices=APPS, default=APPS)
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10, 1000, 10000])
+    parser.add_argument("--queries", type=int, default=50, help="questions (and removals) per run")
+    parser.add_argument("--upload-batch", type=int, default=100, help="files per add_to_vector_store call")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="simulated latency per LLM call")
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0, help="simulated latency per embedding call")
+    parser.add_argument("--throttle-rate", type=float, default=0.0,
+                        help="fraction of embedding calls that fail with a simulated 429 (retried with backoff)")
+    parser.add_argument("--vector-backend", choices=["chroma", "compact"], default="chroma",
+                        help="VECTOR_BACKEND for version_2 runs")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/<timestamp>-<commit>.json)")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary working directories")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    # Internal: a single (app, size) run inside a subprocess
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--app", choices=APPS, help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    options = parse_args(argv)
+    if options.worker:
+        run_worker(options)
+        return
+    if options.compare:
+        compare(*options.compare)
+        return
+
+    commit = git_commit()
+    created_at = datetime.now(timezone.utc)
+    runs = run_all(options)
+    output = options.output or os.path.join(
+        RESULTS_DIR, f"{created_at.strftime('%Y%m%dT%H%M%SZ')}-{commit or 'nogit'}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "schema_version": 1,
+            "created_at": created_at.isoformat(),
+            "git_commit": commit,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "settings": {key: getattr(options, key) for key in
+                         ("sizes", "queries", "upload_batch", "seed", "llm_latency_ms", "embed_latency_ms")},
+            "runs": runs,
+        }, f, indent=2)
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
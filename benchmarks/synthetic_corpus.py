@@ -0,0 +1,110 @@
+import os
+import re
+import glob
+import random
+from datetime import date, timedelta
+
+INVOICES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "version_2", "invoices")
+
+# Layout of the bundled invoices, used when they cannot be read (e.g. pypdf is missing)
+DEFAULT_HEADER = [
+    "TAX INVOICE",
+    "Invoice No: INV001         Date: 2025-07-20",
+    "Supplier: HereandnowAI",
+    "Address: Chennai, Tamil Nadu",
+    "GSTIN: 33HNAI0000X1Z5",
+    "Bill To: TechNova Solutions",
+    "Address: Bangalore, Karnataka",
+    "GSTIN: 29ABCDE1234F1Z5",
+    "Description Qty Rate Amount CGST SGST",
+]
+
+VENDORS = ["HereandnowAI", "Acme Supplies", "Globex Traders", "Initech Systems", "Umbrella Retail",
+           "Stark Components", "Wayne Hardware", "Soylent Foods", "Hooli Cloud", "Vandelay Imports"]
+CUSTOMERS = ["TechNova Solutions", "DigitalSpark Pvt Ltd", "BlueOrbit Labs", "Quantum Leap Ltd", "Nimbus Data"]
+ITEMS = [("Desktop Computer", 35000), ("Laptop", 55000), ("Wireless Mouse", 700), ("Keyboard", 1200),
+         ("Monitor 24 inch", 8000), ("Printer", 15000), ("Router", 4500), ("External SSD 1TB", 9000),
+         ("Webcam", 2500), ("Office Chair", 7000)]
+GST_RATE = 0.09
+
+def load_layout(invoices_dir=INVOICES_DIR):
+    """Reads the header layout (every line up to the item table) from a bundled invoice."""
+    try:
+        from pypdf import PdfReader
+        template = sorted(glob.glob(os.path.join(invoices_dir, "*.pdf")))[0]
+        lines = PdfReader(template).pages[0].extract_text().splitlines()
+        end = next(i for i, line in enumerate(lines) if line.startswith("Description"))
+        return lines[:end + 1]
+    except Exception as e:
+        print(f"Using the built-in invoice layout: {e}")
+        return list(DEFAULT_HEADER)
+
+def render_invoice(layout, invoice_number, invoice_date, vendor, customer, items):
+    """Returns the text lines of one invoice in the bundled layout with the given values."""
+    lines = []
+    for line in layout:
+        line = re.sub(r"Invoice No:\s*\S+", f"Invoice No: {invoice_number}", line)
+        line = re.sub(r"Date:\s*\S+", f"Date: {invoice_date}", line)
+        line = re.sub(r"^Supplier:.*", f"Supplier: {vendor}", line)
+        line = re.sub(r"^Bill To:.*", f"Bill To: {customer}", line)
+        lines.append(line)
+    subtotal = 0.0
+    for name, qty, rate in items:
+        amount = qty * rate
+        subtotal += amount
+        gst = amount * GST_RATE
+        lines.append(f"{name} {qty} {rate} {amount:.2f} {gst:.2f} {gst:.2f}")
+    gst_total = subtotal * GST_RATE
+    lines += [
+        f"Total CGST: Rs.{gst_total:.2f}",
+        f"Total SGST: Rs.{gst_total:.2f}",
+        f"Grand Total: Rs.{subtotal + 2 * gst_total:.2f}",
+    ]
+    return lines
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def write_text_pdf(path, lines):
+    """Writes a one-page PDF with the given text lines (Helvetica, no external dependencies)."""
+    content = "BT /F1 10 Tf 14 TL 50 800 Td " + " ".join(f"({_escape(line)}) Tj T*" for line in lines) + " ET"
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+        f"<< /Length {len(content)} >>\nstream\n{content}\nendstream",
+    ]
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    with open(path, "wb") as f:
+        f.write(out)
+
+def generate_corpus(output_dir, count, seed=42, layout=None):
+    """
+    Writes `count` synthetic invoices (invoice_00000.pdf, ...) into output_dir.
+    The same seed always produces the same files. Returns a list of
+    {"path", "invoice_number", "invoice_date", "vendor_name"} records.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    layout = layout or load_layout()
+    rng = random.Random(seed)
+    start = date(2024, 1, 1)
+    records = []
+    for i in range(count):
+        invoice_number = f"INV{i:05d}"
+        invoice_date = (start + timedelta(days=rng.randrange(730))).isoformat()
+        vendor = rng.choice(VENDORS)
+        items = [(name, rng.randint(1, 5), rate) for name, rate in rng.sample(ITEMS, rng.randint(2, 6))]
+        path = os.path.join(output_dir, f"invoice_{i:05d}.pdf")
+        write_text_pdf(path, render_invoice(layout, invoice_number, invoice_date, vendor, rng.choice(CUSTOMERS), items))
+        records.append({"path": path, "invoice_number": invoice_number, "invoice_date": invoice_date,
+                        "vendor_name": vendor})
+    return records
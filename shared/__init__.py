@@ -0,0 +1 @@
+"""Modules used by both app.py and version_2 (caches, retrieval, ingestion, snapshots and metrics)."""
@@ -0,0 +1,134 @@
+import re
+import math
+import time
+import threading
+from collections import OrderedDict
+from .metrics import record_cache_lookup
+
+def normalize_question(question):
+    """Lowercases and collapses whitespace and trailing punctuation."""
+    return re.sub(r"\s+", " ", question.lower()).strip().rstrip("?.! ")
+
+def _guard_tokens(question):
+    """
+    Numbers (invoice numbers, amounts, dates) and capitalized words other than the
+    first (vendor and other names) of a question. A semantic match must share all of them.
+    """
+    words = re.findall(r"[A-Za-z][\w&'-]*", question)
+    names = {word.lower() for word in words[1:] if word[0].isupper() and word != "I"}
+    return sorted(re.findall(r"\d+(?:[.,]\d+)*", question)), sorted(names)
+
+def _unit_vector(vector):
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+class AnswerCache:
+    """
+    In-memory LRU cache of (answer, sources) per question with a TTL.
+    Lookups match the normalized question exactly. Semantic matching is opt-in:
+    when similarity_threshold and an embeddings object are given, a lookup falls
+    back to the most similar cached question above the threshold whose numbers
+    and capitalized names are identical (so "total for Acme" never returns the
+    answer for "total for Globex"). Names typed in lowercase are not recognized.
+    Every entry belongs to a knowledge base generation (a counter that only goes
+    up); a lookup or store with a newer generation drops all older entries, and
+    answers computed against an older generation are never stored.
+    """
+
+    def __init__(self, max_entries=256, ttl_seconds=3600, embeddings=None, similarity_threshold=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.embeddings = embeddings if similarity_threshold else None
+        self.similarity_threshold = similarity_threshold
+        self.generation = None
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _sync_generation(self, generation):
+        """Drops entries of older generations. Returns False if generation is stale."""
+        if self.generation is None or generation > self.generation:
+            self._entries.clear()
+            self.generation = generation
+        return generation == self.generation
+
+    def _embed(self, question):
+        if self.embeddings is None:
+            return None
+        try:
+            return _unit_vector(self.embeddings.embed_query(question))
+        except Exception as e:
+            print(f"Answer cache could not embed the question: {e}")
+            return None
+
+    def get(self, question, generation):
+        """Returns the cached (answer, sources) for question, or None."""
+        key = normalize_question(question)
+        now = time.time()
+        with self._lock:
+            if not self._sync_generation(generation):
+                self.misses += 1
+                record_cache_lookup("answer", False)
+                return None
+            for cached_key in [k for k, entry in self._entries.items() if entry["expires"] < now]:
+                del self._entries[cached_key]
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                record_cache_lookup("answer", True)
+                return entry["value"]
+            candidates = [(k, entry) for k, entry in self._entries.items() if entry["vector"] is not None]
+
+        vector = self._embed(question) if candidates else None
+        if vector is not None:
+            guard = _guard_tokens(question)
+            best_key, best_score = None, self.similarity_threshold
+            for cached_key, entry in candidates:
+                if entry["guard"] != guard:
+                    continue
+                score = sum(a * b for a, b in zip(vector, entry["vector"]))
+                if score >= best_score:
+                    best_key, best_score = cached_key, score
+            with self._lock:
+                if best_key is not None and best_key in self._entries and self.generation == generation:
+                    self._entries.move_to_end(best_key)
+                    self.hits += 1
+                    self.semantic_hits += 1
+                    record_cache_lookup("answer", True)
+                    return self._entries[best_key]["value"]
+
+        with self._lock:
+            self.misses += 1
+        record_cache_lookup("answer", False)
+        return None
+
+    def put(self, question, generation, answer, sources):
+        key = normalize_question(question)
+        vector = self._embed(question)
+        with self._lock:
+            if not self._sync_generation(generation):
+                return
+            self._entries[key] = {
+                "value": (answer, sources),
+                "vector": vector,
+                "guard": _guard_tokens(question),
+                "expires": time.time() + self.ttl_seconds,
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        """Returns hit/miss counters and the hit rate."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+            }
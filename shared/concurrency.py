@@ -0,0 +1,94 @@
+import asyncio
+import threading
+from contextlib import contextmanager, asynccontextmanager
+
+class ReadWriteLock:
+    """
+    Many readers or one writer. Waiting writers block new readers so a steady
+    stream of queries cannot starve an ingest; writers should only hold the lock
+    for short mutations (one upsert batch, one delete) so queries keep flowing
+    while a long ingest is running.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            try:
+                while self._writer or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+    @asynccontextmanager
+    async def read_async(self):
+        """Read lock for coroutines; waiting happens off the event loop."""
+        await asyncio.to_thread(self.acquire_read)
+        try:
+            yield
+        finally:
+            self.release_read()
+
+async def iterate_in_thread(generator):
+    """Drives a blocking generator from a worker thread, yielding its items asynchronously."""
+    done = object()
+    while True:
+        item = await asyncio.to_thread(next, generator, done)
+        if item is done:
+            return
+        yield item
+
+def iterate_async(async_iterable):
+    """Drives an async iterator from synchronous code on a private event loop, yielding its items."""
+    loop = asyncio.new_event_loop()
+    iterator = async_iterable.__aiter__()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(iterator.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        if hasattr(iterator, "aclose"):
+            loop.run_until_complete(iterator.aclose())
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
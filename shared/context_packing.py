@@ -0,0 +1,87 @@
+import os
+import re
+
+INVOICE_FIELDS = ["invoice_number", "vendor_name", "invoice_date", "total_value"]
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token), without calling the model."""
+    return (len(text) + 3) // 4
+
+def _normalize(text):
+    return re.sub(r"\s+", " ", text).strip()
+
+def _merge_overlap(first, second, min_overlap=20):
+    """Returns first + second with their overlapping text joined once, or None if they do not overlap."""
+    for size in range(min(len(first), len(second)), min_overlap - 1, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return None
+
+def _merge_blocks(blocks):
+    """Merges the text blocks of one page that contain or overlap each other."""
+    merged = []
+    for block in blocks:
+        for existing in merged:
+            if block["text"] in existing["text"]:
+                joined = existing["text"]
+            elif existing["text"] in block["text"]:
+                joined = block["text"]
+            else:
+                joined = _merge_overlap(existing["text"], block["text"]) or _merge_overlap(block["text"], existing["text"])
+            if joined is not None:
+                existing["text"] = joined
+                existing["rank"] = min(existing["rank"], block["rank"])
+                existing["docs"].extend(block["docs"])
+                break
+        else:
+            merged.append(block)
+    # A merge can make a block overlap one it was compared to earlier
+    return merged if len(merged) == len(blocks) else _merge_blocks(merged)
+
+def _header(doc, seen_sources):
+    """Labels a block with its file and page, plus the invoice details the first time a file appears."""
+    source = doc.metadata.get("source", "Unknown")
+    header = f"[{os.path.basename(source)}, page {doc.metadata.get('page', 'N/A')}"
+    details = [f"{field}: {doc.metadata[field]}" for field in INVOICE_FIELDS if field in doc.metadata]
+    if details and source not in seen_sources:
+        header += " | " + ", ".join(details)
+    seen_sources.add(source)
+    return header + "]"
+
+def pack_context(docs, max_tokens=3000):
+    """
+    Builds the prompt context from relevance-ordered documents: exact duplicates
+    and chunks contained in others are dropped, overlapping chunks of the same page
+    are merged back together, blocks are ordered by their best rank and added
+    until max_tokens is reached (the last block is cut at a word boundary).
+    Returns (context, used_docs, stats) where used_docs are the documents whose
+    whole text made it into the context (a chunk cut off by the budget is left
+    out) and stats has "chunks", "blocks" and "tokens".
+    """
+    pages = {}
+    for rank, doc in enumerate(docs):
+        key = (doc.metadata.get("source"), doc.metadata.get("page"))
+        pages.setdefault(key, []).append({"text": _normalize(doc.page_content), "rank": rank, "docs": [doc]})
+    blocks = sorted((block for page in pages.values() for block in _merge_blocks(page)), key=lambda b: b["rank"])
+
+    parts, used_docs, tokens, seen_sources = [], [], 0, set()
+    for block in blocks:
+        if not block["text"]:
+            continue
+        text = f"{_header(block['docs'][0], seen_sources)}\n{block['text']}"
+        remaining = max_tokens - tokens
+        block_docs = block["docs"]
+        if estimate_tokens(text) > remaining:
+            if remaining < 50:
+                break
+            text = text[:remaining * 4].rsplit(" ", 1)[0] + " ..."
+            block_docs = [doc for doc in block_docs if _normalize(doc.page_content) in text]
+        parts.append(text)
+        used_docs.extend(block_docs)
+        tokens += estimate_tokens(text)
+        if tokens >= max_tokens:
+            break
+
+    stats = {"chunks": len(docs), "blocks": len(parts), "tokens": tokens}
+    print(f"Packed {stats['chunks']} chunk(s) into {stats['blocks']} block(s), ~{tokens} context tokens (budget {max_tokens}).")
+    return "\n\n".join(parts), used_docs, stats
@@ -0,0 +1,112 @@
+import re
+import array
+import sqlite3
+import hashlib
+import threading
+import time
+from langchain_core.embeddings import Embeddings
+from .metrics import record_embedding_call, record_cache_lookup
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embeddings object with a persistent SQLite cache.
+    Vectors are keyed by (model name, document/query, hash of the normalized text),
+    and the least recently used entries are evicted once max_entries is exceeded.
+    Any object exposing embed_documents/embed_query can be wrapped, so the cache
+    can be exercised offline with e.g. langchain_core's DeterministicFakeEmbedding.
+    Missing texts are embedded checkpoint_size at a time and each batch is stored
+    as soon as it returns, so an interrupted ingest resumes without re-embedding them.
+    """
+
+    def __init__(self, underlying, cache_path, model_name=None, max_entries=200_000, checkpoint_size=100):
+        self.underlying = underlying
+        self.model_name = model_name or getattr(underlying, "model", type(underlying).__name__)
+        self.max_entries = max_entries
+        self.checkpoint_size = checkpoint_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings (last_used)")
+        self._conn.commit()
+
+    def _key(self, text, kind):
+        normalized = re.sub(r"\s+", " ", text).strip()
+        text_hash = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+        return f"{self.model_name}:{kind}:{text_hash}"
+
+    def _embed(self, texts, kind, embed_fn):
+        keys = [self._key(text, kind) for text in texts]
+        now = time.time()
+        with self._lock:
+            cached = {}
+            unique_keys = list(dict.fromkeys(keys))
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                cached.update({key: array.array("d", blob).tolist() for key, blob in rows})
+            if cached:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in cached]
+                )
+                self._conn.commit()
+
+        # Embed each distinct missing text once, even if it repeats within the batch
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        missing_keys = list(missing)
+        for start in range(0, len(missing_keys), self.checkpoint_size):
+            batch = missing_keys[start:start + self.checkpoint_size]
+            vectors = embed_fn([missing[key] for key in batch])
+            record_embedding_call(len(batch))
+            new_entries = dict(zip(batch, vectors))
+            with self._lock:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                    [(key, array.array("d", vector).tobytes(), now) for key, vector in new_entries.items()],
+                )
+                self._evict()
+                self._conn.commit()
+            cached.update(new_entries)
+
+        record_cache_lookup("embedding", True, len(keys) - len(missing))
+        record_cache_lookup("embedding", False, len(missing))
+        with self._lock:
+            self.misses += len(missing)
+            self.hits += len(keys) - len(missing)
+        return [list(cached[key]) for key in keys]
+
+    def _evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN ("
+                " SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def embed_documents(self, texts):
+        return self._embed(texts, "document", self.underlying.embed_documents)
+
+    def embed_query(self, text):
+        return self._embed([text], "query", lambda texts: [self.underlying.embed_query(texts[0])])[0]
+
+    def stats(self):
+        """Returns hit/miss counters and the current number of cached vectors."""
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": size,
+            }
@@ -0,0 +1,174 @@
+import re
+import json
+import math
+import sqlite3
+import threading
+from typing import Any, List
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "did", "do", "does", "for", "from", "how", "i", "in", "is",
+    "it", "me", "much", "my", "of", "on", "or", "show", "tell", "that", "the", "this", "to", "was", "we",
+    "were", "what", "when", "which", "who", "with", "you",
+}
+
+def tokenize(text):
+    """Lowercased word tokens without stop words, the same units the FTS5 tokenizer produces."""
+    return [token for token in re.findall(r"[^\W_]+", text.lower()) if token not in STOP_WORDS]
+
+class KeywordIndex:
+    """
+    On-disk BM25 index of the chunk texts (SQLite FTS5), kept next to the Chroma
+    collection and updated with the same chunk IDs, so exact tokens such as
+    invoice numbers can be matched even when the embeddings miss them.
+    """
+
+    def __init__(self, db_path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5("
+            " chunk_id UNINDEXED, source UNINDEXED, metadata UNINDEXED, content)"
+        )
+        self._conn.commit()
+
+    def upsert(self, ids, documents, metadatas, replace=True):
+        """replace=False skips removing older rows with the same IDs (e.g. when filling an empty index)."""
+        with self._lock:
+            if replace:
+                self._conn.executemany("DELETE FROM chunks WHERE chunk_id = ?", [(chunk_id,) for chunk_id in ids])
+            self._conn.executemany(
+                "INSERT INTO chunks (chunk_id, source, metadata, content) VALUES (?, ?, ?, ?)",
+                [
+                    (chunk_id, (meta or {}).get("source"), json.dumps(meta or {}), text)
+                    for chunk_id, text, meta in zip(ids, documents, metadatas)
+                ],
+            )
+            self._conn.commit()
+
+    def delete(self, ids):
+        with self._lock:
+            self._conn.executemany("DELETE FROM chunks WHERE chunk_id = ?", [(chunk_id,) for chunk_id in ids])
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.commit()
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def search(self, query, k=30, sources=None):
+        """
+        Returns up to k (chunk_id, text, metadata) tuples ranked by BM25.
+        sources, if given, restricts the search to chunks of those files.
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens or (sources is not None and not sources):
+            return []
+        sql = "SELECT chunk_id, content, metadata FROM chunks WHERE chunks MATCH ?"
+        params = [" OR ".join(f'"{token}"' for token in tokens)]
+        if sources is not None:
+            sql += f" AND source IN ({', '.join('?' * len(sources))})"
+            params.extend(sources)
+        sql += " ORDER BY rank LIMIT ?"
+        with self._lock:
+            rows = self._conn.execute(sql, params + [k]).fetchall()
+        return [(chunk_id, text, json.loads(meta)) for chunk_id, text, meta in rows]
+
+def backfill_keyword_index(keyword_index, collection, batch_size=500):
+    """Fills an empty keyword index from the chunks already stored in the collection."""
+    if keyword_index.count() > 0:
+        return 0
+    total = collection.count()
+    for offset in range(0, total, batch_size):
+        batch = collection.get(limit=batch_size, offset=offset, include=["documents", "metadatas"])
+        keyword_index.upsert(batch["ids"], batch["documents"], batch["metadatas"], replace=False)
+    if total:
+        print(f"Backfilled keyword index with {total} chunk(s).")
+    return total
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuses several ranked ID lists into one, best first (Reciprocal Rank Fusion)."""
+    scores = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+def _cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+def _term_coverage(query_tokens, text):
+    """Weighted share of the query terms found in text; tokens with digits (IDs, amounts) count double."""
+    if not query_tokens:
+        return 0.0
+    text_tokens = set(tokenize(text))
+    weights = {token: 2.0 if any(c.isdigit() for c in token) else 1.0 for token in query_tokens}
+    return sum(w for token, w in weights.items() if token in text_tokens) / sum(weights.values())
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retrieves `candidates` chunks from the vector collection and from the BM25
+    keyword index, fuses both rankings with RRF and reranks the fused candidates
+    locally (cosine similarity of the stored chunk vectors plus query term
+    coverage), returning only the best top_k chunks. No extra model calls are made
+    beyond embedding the query.
+    """
+
+    collection: Any
+    keyword_index: Any
+    embeddings: Any
+    top_k: int = 6
+    candidates: int = 30
+    lexical_weight: float = 0.3
+
+    def search(self, query, where=None, sources=None):
+        """
+        Hybrid search with an optional Chroma where filter for the vector side and
+        the matching list of source paths for the keyword side.
+        """
+        total = self.collection.count()
+        if total == 0:
+            return []
+        query_vector = self.embeddings.embed_query(query)
+        n_results = min(self.candidates, total)
+        vector_hits = self.collection.query(
+            query_embeddings=[query_vector], n_results=n_results, where=where or None,
+            include=["documents", "metadatas", "embeddings"],
+        )
+        chunks = {}
+        vector_ranking = list(vector_hits["ids"][0])
+        for i, chunk_id in enumerate(vector_ranking):
+            chunks[chunk_id] = (vector_hits["documents"][0][i], vector_hits["metadatas"][0][i],
+                                vector_hits["embeddings"][0][i])
+
+        keyword_hits = self.keyword_index.search(query, n_results, sources)
+        missing = [chunk_id for chunk_id, _, _ in keyword_hits if chunk_id not in chunks]
+        if missing:
+            # Vectors of keyword-only hits come from the collection; IDs it no longer has are dropped
+            stored = self.collection.get(ids=missing, include=["documents", "metadatas", "embeddings"])
+            for i, chunk_id in enumerate(stored["ids"]):
+                chunks[chunk_id] = (stored["documents"][i], stored["metadatas"][i], stored["embeddings"][i])
+        keyword_ranking = [chunk_id for chunk_id, _, _ in keyword_hits if chunk_id in chunks]
+
+        fused = reciprocal_rank_fusion([vector_ranking, keyword_ranking])[:self.candidates]
+        query_tokens = set(tokenize(query))
+        scored = []
+        for chunk_id in fused:
+            text, metadata, vector = chunks[chunk_id]
+            score = _cosine(query_vector, vector) + self.lexical_weight * _term_coverage(query_tokens, text)
+            scored.append((score, chunk_id))
+        scored.sort(reverse=True)
+        return [
+            Document(page_content=chunks[chunk_id][0], metadata=chunks[chunk_id][1] or {})
+            for _, chunk_id in scored[:self.top_k]
+        ]
+
+    def _get_relevant_documents(self, query, *, run_manager=None) -> List[Document]:
+        return self.search(query)
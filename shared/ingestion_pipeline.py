@@ -0,0 +1,279 @@
+import time
+import uuid
+import queue
+import threading
+import multiprocessing
+from contextlib import nullcontext
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pypdf import PdfReader
+from langchain_core.documents import Document
+from .metrics import span, observe_stage
+
+_DONE = object()
+
+def load_pdf_pages(pdf_path, start, stop):
+    """Parses pages [start, stop) of one PDF into Documents. Runs inside a worker process."""
+    reader = PdfReader(pdf_path)
+    return [
+        Document(page_content=reader.pages[i].extract_text(), metadata={"source": pdf_path, "page": i})
+        for i in range(start, stop)
+    ]
+
+def count_pdf_pages(pdf_path):
+    """Returns the number of pages of one PDF. Runs inside a worker process."""
+    return len(PdfReader(pdf_path).pages)
+
+def _timed_load(pdf_path, start, stop):
+    """load_pdf_pages plus its duration, so the parent can record the "load" stage."""
+    started = time.perf_counter()
+    pages = load_pdf_pages(pdf_path, start, stop)
+    return pages, time.perf_counter() - started
+
+def _pool_context():
+    """
+    Parse workers are started by a fork server (or spawned where there is none) rather
+    than forked from this process, whose threads and open SQLite handles a fork would copy.
+    """
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
+
+def _result(item, future):
+    try:
+        return item, future.result()
+    except Exception as e:
+        return item, e
+
+def _page_counts(pool, pdf_paths, lookahead):
+    """Yields (pdf_path, page count or exception), counting up to lookahead files ahead in the pool."""
+    pending = deque()
+    for pdf_path in pdf_paths:
+        pending.append((pdf_path, pool.submit(count_pdf_pages, pdf_path)))
+        if len(pending) > lookahead:
+            yield _result(*pending.popleft())
+    while pending:
+        yield _result(*pending.popleft())
+
+def _page_windows(page_counts, pages_per_task, failed, on_file_event):
+    """
+    Yields (pdf_path, start, stop, is_last) parse tasks, one PDF at a time. A PDF
+    without pages gets one empty window, so it still reaches the end of the pipeline.
+    """
+    for pdf_path, page_count in page_counts:
+        if isinstance(page_count, Exception):
+            print(f"Error loading {pdf_path}: {page_count}")
+            failed[pdf_path] = f"parsing failed: {page_count}"
+            continue
+        on_file_event(pdf_path, "parsing")
+        for start in range(0, max(page_count, 1), pages_per_task):
+            stop = min(start + pages_per_task, page_count)
+            yield pdf_path, start, stop, stop == page_count
+
+def _parse_in_pool(pdf_paths, pages_per_task, parse_workers, max_pending, failed, on_file_event):
+    """
+    Yields (task, pages or exception) in submission order, keeping at most
+    max_pending tasks in flight so parsed pages never pile up in memory.
+    The page counts that the tasks are cut from are read in the pool as well.
+    """
+    with ProcessPoolExecutor(max_workers=parse_workers, mp_context=_pool_context()) as pool:
+        pending = deque()
+        tasks = _page_windows(_page_counts(pool, pdf_paths, max_pending), pages_per_task, failed, on_file_event)
+        for task in tasks:
+            pending.append((task, pool.submit(_timed_load, *task[:3])))
+            if len(pending) >= max_pending:
+                yield _result(*pending.popleft())
+        while pending:
+            yield _result(*pending.popleft())
+
+def _embed_worker(embeddings, embed_queue, upsert_queue, failed):
+    """Embeds chunk batches and hands them to the upsert stage."""
+    while True:
+        batch = embed_queue.get()
+        if batch is _DONE:
+            return
+        try:
+            with span("embed"):
+                vectors = embeddings.embed_documents([chunk.page_content for _, _, chunk in batch])
+            upsert_queue.put((batch, vectors))
+        except Exception as e:
+            print(f"Embedding batch of {len(batch)} chunk(s) failed: {e}")
+            for pdf_path, _, _ in batch:
+                failed.setdefault(pdf_path, f"embedding failed: {e}")
+
+def _upsert_worker(collection, keyword_index, upsert_queue, failed, progress_queue, write_lock):
+    """Writes embedded batches to Chroma (and the keyword index). A single writer keeps upserts serialized."""
+    while True:
+        item = upsert_queue.get()
+        if item is _DONE:
+            return
+        batch, vectors = item
+        try:
+            with write_lock(), span("upsert"):
+                collection.upsert(
+                    ids=[chunk_id for _, chunk_id, _ in batch],
+                    embeddings=vectors,
+                    documents=[chunk.page_content for _, _, chunk in batch],
+                    metadatas=[chunk.metadata for _, _, chunk in batch],
+                )
+                if keyword_index is not None:
+                    keyword_index.upsert(
+                        [chunk_id for _, chunk_id, _ in batch],
+                        [chunk.page_content for _, _, chunk in batch],
+                        [chunk.metadata for _, _, chunk in batch],
+                    )
+            progress_queue.put(("chunks_indexed", len(batch)))
+        except Exception as e:
+            print(f"Upserting batch of {len(batch)} chunk(s) failed: {e}")
+            for pdf_path, _, _ in batch:
+                failed.setdefault(pdf_path, f"upsert failed: {e}")
+
+def iter_ingestion_pipeline(pdf_paths, vector_store, embeddings, prepare_pages=None, chunk_id_prefix=None,
+                            batch_size=64, pages_per_task=8, parse_workers=None, embed_workers=4, queue_size=8,
+                            write_lock=nullcontext, on_file_event=None, keyword_index=None, stop_event=None,
+                            finish_file=None):
+    """
+    Streams PDFs through a staged pipeline: parse page windows (process pool) ->
+    split -> embed (thread pool, in batches) -> upsert (single writer). Stages are
+    connected by bounded queues, so peak memory depends on batch_size,
+    pages_per_task and queue_size rather than on the size of the corpus.
+
+    prepare_pages(pdf_path, pages) may return modified pages before splitting; page
+    windows of a file arrive in order, so the first call for a file sees page 0.
+    finish_file(pdf_path) is called once the last window of a file has been
+    prepared; returning a reason drops the file (it is reported in "failed" with
+    that reason and its chunks are removed again).
+    chunk_id_prefix(pdf_path) may supply a stable prefix for the file's chunk IDs.
+    write_lock() is entered around every write to the collection, so a store-wide
+    reader/writer lock is only held for one batch at a time.
+    on_file_event(pdf_path, state) is told when a file starts "parsing" and when
+    all of its chunks have been handed to the "embedding" stage.
+    keyword_index, if given, receives the same chunks as the collection.
+    Once stop_event (a threading.Event) is set, no further page windows are parsed,
+    every file is failed as "cancelled" and the chunks already written are removed.
+
+    Yields a progress dict after every parsed file and upserted batch. The last
+    dict has done=True plus "chunk_ids" ({pdf_path: [ids]}) and "failed"
+    ({pdf_path: reason}). Chunks of files that failed part-way are removed again.
+    """
+    on_file_event = on_file_event or (lambda pdf_path, state: None)
+    progress = {"files_total": len(pdf_paths), "files_parsed": 0, "chunks_indexed": 0, "done": False}
+    chunk_ids = {}
+    failed = {}
+    if not pdf_paths:
+        yield dict(progress, done=True, chunk_ids=chunk_ids, failed=failed)
+        return
+
+    from langchain.text_splitter import RecursiveCharacterTextSplitter # deferred: heavy import
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+    collection = vector_store._collection
+    embed_queue = queue.Queue(maxsize=queue_size)
+    upsert_queue = queue.Queue(maxsize=queue_size)
+    progress_queue = queue.Queue()
+
+    embedders = [
+        threading.Thread(target=_embed_worker, args=(embeddings, embed_queue, upsert_queue, failed), daemon=True)
+        for _ in range(embed_workers)
+    ]
+    upserter = threading.Thread(
+        target=_upsert_worker, args=(collection, keyword_index, upsert_queue, failed, progress_queue, write_lock), daemon=True
+    )
+
+    def produce():
+        prefixes = {}
+        batch = []
+        try:
+            windows = _parse_in_pool(pdf_paths, pages_per_task, parse_workers, queue_size, failed, on_file_event)
+            for (pdf_path, start, stop, is_last), pages in windows:
+                if stop_event is not None and stop_event.is_set():
+                    for path in pdf_paths:
+                        failed.setdefault(path, "cancelled")
+                    batch = []
+                    break
+                if pdf_path in failed:
+                    continue
+                if isinstance(pages, Exception):
+                    print(f"Error loading {pdf_path}: {pages}")
+                    failed[pdf_path] = f"parsing failed: {pages}"
+                    continue
+                pages, load_seconds = pages
+                observe_stage("load", load_seconds)
+                try:
+                    with span("split"):
+                        if prepare_pages is not None:
+                            pages = prepare_pages(pdf_path, pages)
+                        chunks = splitter.split_documents(pages)
+                except Exception as e:
+                    print(f"Error preparing {pdf_path}: {e}")
+                    failed[pdf_path] = f"preparation failed: {e}"
+                    continue
+                dropped = is_last and finish_file is not None and finish_file(pdf_path)
+                if dropped:
+                    failed[pdf_path] = dropped
+                    chunks = []
+                    batch = [item for item in batch if item[0] != pdf_path]
+
+                if pdf_path not in prefixes:
+                    prefixes[pdf_path] = chunk_id_prefix(pdf_path) if chunk_id_prefix else uuid.uuid4().hex
+                    chunk_ids[pdf_path] = []
+                file_ids = chunk_ids[pdf_path]
+                for chunk in chunks:
+                    chunk_id = f"{prefixes[pdf_path]}-{len(file_ids)}"
+                    file_ids.append(chunk_id)
+                    batch.append((pdf_path, chunk_id, chunk))
+                    if len(batch) >= batch_size:
+                        embed_queue.put(batch)
+                        batch = []
+                if is_last:
+                    if stop == 0:
+                        failed.setdefault(pdf_path, "no pages")
+                    if not dropped:
+                        on_file_event(pdf_path, "embedding")
+                    progress_queue.put(("files_parsed", 1))
+            if batch:
+                embed_queue.put(batch)
+        except Exception as e:
+            print(f"Ingestion pipeline stopped early: {e}")
+            for pdf_path in pdf_paths:
+                failed.setdefault(pdf_path, f"pipeline error: {e}")
+        finally:
+            for _ in embedders:
+                embed_queue.put(_DONE)
+            for thread in embedders:
+                thread.join()
+            upsert_queue.put(_DONE)
+            upserter.join()
+            progress_queue.put(_DONE)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    for thread in embedders + [upserter, producer]:
+        thread.start()
+
+    while True:
+        event = progress_queue.get()
+        if event is _DONE:
+            break
+        key, amount = event
+        progress[key] += amount
+        yield dict(progress)
+    producer.join()
+
+    partial_ids = [chunk_id for path in failed for chunk_id in chunk_ids.get(path, [])]
+    if partial_ids:
+        with write_lock():
+            collection.delete(ids=partial_ids)
+            if keyword_index is not None:
+                keyword_index.delete(partial_ids)
+
+    yield dict(
+        progress,
+        done=True,
+        chunk_ids={path: ids for path, ids in chunk_ids.items() if path not in failed},
+        failed=failed,
+    )
+
+def describe_progress(progress):
+    """Formats a pipeline progress dict for the status panel."""
+    return (
+        f"Status: Processing... parsed {progress['files_parsed']}/{progress['files_total']} PDF(s), "
+        f"indexed {progress['chunks_indexed']} chunk(s)."
+    )
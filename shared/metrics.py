@@ -0,0 +1,173 @@
+import json
+import time
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIX = "askmydocs"
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+HELP = {
+    "stage_duration_seconds": ("histogram", "Time spent in each ingestion and query stage."),
+    "request_duration_seconds": ("histogram", "Time spent handling a request inside the handler."),
+    "requests_total": ("counter", "Handled requests by kind and outcome."),
+    "llm_calls_total": ("counter", "LLM calls by purpose."),
+    "llm_tokens_total": ("counter", "Estimated LLM tokens by purpose and direction."),
+    "embedding_calls_total": ("counter", "Calls to the embedding API (cache misses only)."),
+    "embedded_texts_total": ("counter", "Texts sent to the embedding API."),
+    "embedding_retries_total": ("counter", "Retried embedding batches by reason (rate_limit or error)."),
+    "cache_lookups_total": ("counter", "Cache lookups by cache and result."),
+    "query_filters_total": ("counter", "Self-query filters by how they were built (local, cache or llm)."),
+}
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = [(key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for key, value in pairs]
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+class MetricsRegistry:
+    """Thread-safe counters and histograms rendered in the Prometheus text format."""
+
+    def __init__(self, prefix=PREFIX):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            key = _label_key(labels)
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            key = _label_key(labels)
+            histogram = series.setdefault(key, {"buckets": [0] * len(DURATION_BUCKETS), "sum": 0.0, "count": 0})
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                full_name = f"{self.prefix}_{name}"
+                lines.append(f"# HELP {full_name} {HELP.get(name, ('counter', name))[1]}")
+                lines.append(f"# TYPE {full_name} counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{full_name}{_format_labels(key)} {value}")
+            for name, series in sorted(self._histograms.items()):
+                full_name = f"{self.prefix}_{name}"
+                lines.append(f"# HELP {full_name} {HELP.get(name, ('histogram', name))[1]}")
+                lines.append(f"# TYPE {full_name} histogram")
+                for key, histogram in sorted(series.items()):
+                    for bound, count in zip(DURATION_BUCKETS, histogram["buckets"]):
+                        lines.append(f"{full_name}_bucket{_format_labels(key, [('le', str(bound))])} {count}")
+                    lines.append(f"{full_name}_bucket{_format_labels(key, [('le', '+Inf')])} {histogram['count']}")
+                    lines.append(f"{full_name}_sum{_format_labels(key)} {histogram['sum']:.6f}")
+                    lines.append(f"{full_name}_count{_format_labels(key)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+_trace_log = {"path": None, "lock": threading.Lock()}
+
+def configure_trace_log(path):
+    """Enables the per-request JSON-lines trace log (None disables it)."""
+    _trace_log["path"] = path or None
+
+class RequestTrace:
+    """Collects the timed stages of one question or upload for the trace log."""
+
+    def __init__(self, kind, **attrs):
+        self.kind = kind
+        self.attrs = attrs
+        self.spans = []
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+
+    def span(self, stage, **attrs):
+        return span(stage, trace=self, **attrs)
+
+    def finish(self, outcome="ok", **attrs):
+        duration = time.perf_counter() - self._start
+        registry.inc("requests_total", kind=self.kind, outcome=outcome)
+        registry.observe("request_duration_seconds", duration, kind=self.kind)
+        if _trace_log["path"] is None:
+            return
+        record = {
+            "kind": self.kind, "outcome": outcome, "started_at": self.started_at,
+            "duration_ms": round(duration * 1000, 3), **self.attrs, **attrs, "spans": self.spans,
+        }
+        try:
+            with _trace_log["lock"], open(_trace_log["path"], "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+        except Exception as e:
+            print(f"Could not write trace log: {e}")
+
+@contextmanager
+def span(stage, trace=None, **attrs):
+    """Times a stage into the stage_duration_seconds histogram (and the request trace, if given)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        registry.observe("stage_duration_seconds", duration, stage=stage)
+        if trace is not None:
+            trace.spans.append({"stage": stage, "offset_ms": round((start - trace._start) * 1000, 3),
+                                "duration_ms": round(duration * 1000, 3), **attrs})
+
+def observe_stage(stage, seconds):
+    """Records a stage duration measured elsewhere (e.g. in a worker process)."""
+    registry.observe("stage_duration_seconds", seconds, stage=stage)
+
+def record_llm_call(purpose, prompt_tokens=0, completion_tokens=0):
+    registry.inc("llm_calls_total", purpose=purpose)
+    if prompt_tokens:
+        registry.inc("llm_tokens_total", prompt_tokens, purpose=purpose, direction="prompt")
+    if completion_tokens:
+        registry.inc("llm_tokens_total", completion_tokens, purpose=purpose, direction="completion")
+
+def record_embedding_call(texts):
+    registry.inc("embedding_calls_total")
+    registry.inc("embedded_texts_total", texts)
+
+def record_cache_lookup(cache, hit, count=1):
+    if count:
+        registry.inc("cache_lookups_total", count, cache=cache, result="hit" if hit else "miss")
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Scrapes would otherwise flood the console
+
+def start_metrics_server(port, host="0.0.0.0"):
+    """Serves /metrics on its own port in a daemon thread. Returns the server, or None if it could not start."""
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        print(f"Metrics endpoint could not start on port {port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"Metrics available at http://{host}:{port}/metrics")
+    return server
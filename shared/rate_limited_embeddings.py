@@ -0,0 +1,159 @@
+import re
+import time
+import random
+import threading
+from langchain_core.embeddings import Embeddings
+from .metrics import registry
+
+RATE_LIMIT_ERROR_NAMES = {"ResourceExhausted", "TooManyRequests", "RateLimitError"}
+_RATE_LIMIT_MESSAGE = re.compile(r"rate.?limit|too many requests|resource has been exhausted|quota", re.IGNORECASE)
+
+def is_rate_limit_error(error):
+    """
+    True for quota/throttling errors: google.api_core ResourceExhausted and similar
+    types, an HTTP status of 429, or a message that names the rate limit or quota.
+    A bare "429" in a message (an ID, a byte count) is not enough.
+    """
+    if any(cls.__name__ in RATE_LIMIT_ERROR_NAMES for cls in type(error).__mro__):
+        return True
+    statuses = (getattr(error, "code", None), getattr(error, "status_code", None),
+                getattr(getattr(error, "response", None), "status_code", None))
+    if any(isinstance(status, int) and status == 429 for status in statuses):
+        return True
+    return bool(_RATE_LIMIT_MESSAGE.search(str(error)))
+
+def estimate_text_tokens(texts):
+    return sum((len(text) + 3) // 4 for text in texts)
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled at `per_minute` units per minute, holding at
+    most one minute's worth. acquire(amount) blocks until the units are available.
+    A per_minute of 0 (or None) disables the limit.
+    """
+
+    def __init__(self, per_minute, clock=time.monotonic, sleep=time.sleep):
+        self.per_minute = per_minute or 0
+        self.capacity = float(self.per_minute)
+        self.tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        """Takes `amount` units (capped at the capacity) and returns the seconds spent waiting."""
+        if not self.per_minute:
+            return 0.0
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self._clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.per_minute / 60.0)
+                self._updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                wait = (amount - self.tokens) * 60.0 / self.per_minute
+            self._sleep(wait)
+            waited += wait
+
+    def drain(self):
+        """Empties the bucket, e.g. after the API reported that the quota is exhausted."""
+        with self._lock:
+            self.tokens = 0.0
+            self._updated = self._clock()
+
+class RateLimitedEmbeddings(Embeddings):
+    """
+    Wraps an embeddings object so bulk embedding stays inside the API quota.
+    Texts are sent in batches whose size adapts: it is halved whenever the API
+    throttles and grows by a tenth of max_batch_size after every `grow_after`
+    successful calls in a row. Every call first takes one request and the batch's
+    estimated tokens from the requests/tokens per minute buckets. Only a failed
+    batch is retried, with exponential backoff and jitter, so a throttled call
+    never repeats batches that already succeeded.
+    """
+
+    def __init__(self, underlying, requests_per_minute=0, tokens_per_minute=0, max_batch_size=100,
+                 min_batch_size=1, max_retries=5, base_delay=1.0, max_delay=60.0, grow_after=5, sleep=time.sleep):
+        self.underlying = underlying
+        self.model = getattr(underlying, "model", type(underlying).__name__)
+        self.max_batch_size = max_batch_size
+        self.min_batch_size = min_batch_size
+        self.batch_size = max_batch_size
+        self.max_retries = max_retries
+        self.grow_after = grow_after
+        self._successes = 0
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.requests = TokenBucket(requests_per_minute, sleep=sleep)
+        self.tokens = TokenBucket(tokens_per_minute, sleep=sleep)
+        self.throttled = 0
+        self.retries = 0
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+    def _shrink(self):
+        with self._lock:
+            self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+            self.throttled += 1
+            self._successes = 0
+
+    def _grow(self):
+        with self._lock:
+            self._successes += 1
+            if self._successes >= self.grow_after:
+                self.batch_size = min(self.max_batch_size, self.batch_size + max(1, self.max_batch_size // 10))
+                self._successes = 0
+
+    def _backoff(self, attempt):
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        self._sleep(delay * random.uniform(0.5, 1.0))
+
+    def _call(self, texts, embed_fn):
+        """Embeds one batch, retrying it on failure. A throttled batch is split in half before its retry."""
+        for attempt in range(self.max_retries + 1):
+            self.requests.acquire(1)
+            self.tokens.acquire(estimate_text_tokens(texts))
+            try:
+                vectors = embed_fn(texts)
+                self._grow()
+                return vectors
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                with self._lock:
+                    self.retries += 1
+                if is_rate_limit_error(e):
+                    registry.inc("embedding_retries_total", reason="rate_limit")
+                    self._shrink()
+                    self.requests.drain()
+                    print(f"Embedding API throttled; retrying {len(texts)} text(s) in batches of {self.batch_size}.")
+                    self._backoff(attempt)
+                    if len(texts) > self.batch_size:
+                        return self._embed_batches(texts, embed_fn)
+                else:
+                    registry.inc("embedding_retries_total", reason="error")
+                    print(f"Embedding batch of {len(texts)} text(s) failed ({e}); retrying.")
+                    self._backoff(attempt)
+
+    def _embed_batches(self, texts, embed_fn):
+        vectors = []
+        start = 0
+        while start < len(texts):
+            batch = texts[start:start + self.batch_size]
+            vectors.extend(self._call(batch, embed_fn))
+            start += len(batch)
+        return vectors
+
+    def embed_documents(self, texts):
+        return self._embed_batches(list(texts), self.underlying.embed_documents)
+
+    def embed_query(self, text):
+        return self._call([text], lambda texts: [self.underlying.embed_query(texts[0])])[0]
+
+    def stats(self):
+        with self._lock:
+            return {"batch_size": self.batch_size, "throttled": self.throttled, "retries": self.retries}
@@ -0,0 +1,360 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+from typing import Any, List
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+SNAPSHOT_FORMAT = "ask-my-docs-snapshot"
+SNAPSHOT_FORMAT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+CURRENT_FILE = "CURRENT" # holds the id of the snapshot replicas should serve
+SCAN_BLOCK_ROWS = 8192 # rows scored per step of an exact search
+READ_ONLY_MESSAGE = "Snapshots are read-only; change the knowledge base on the writer instance."
+
+# Layout of a snapshot directory (besides manifest.json and one <name>.json per extra):
+#   vectors.f32           rows x dimension little-endian float32, memory-mapped
+#   norms.f32             per-row L2 norm of the vectors
+#   documents.bin         UTF-8 chunk texts back to back, memory-mapped
+#   document_offsets.i64  rows + 1 byte offsets into documents.bin
+#   chunks.jsonl          {"id", "metadata"} per row
+_DATA_FILES = ["vectors.f32", "norms.f32", "documents.bin", "document_offsets.i64", "chunks.jsonl"]
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _write_json(path, value):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(value, f)
+        f.flush()
+        os.fsync(f.fileno())
+
+# --- Publishing ---
+
+def current_snapshot_id(snapshots_dir):
+    """Returns the id of the published snapshot, or None if nothing was published yet."""
+    try:
+        with open(os.path.join(snapshots_dir, CURRENT_FILE), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def publish_snapshot(snapshots_dir, snapshot_id):
+    """Atomically points CURRENT at the snapshot, so readers see either the old or the new one."""
+    tmp_path = os.path.join(snapshots_dir, f".{CURRENT_FILE}.{uuid.uuid4().hex}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(snapshot_id)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(snapshots_dir, CURRENT_FILE))
+
+def list_snapshots(snapshots_dir):
+    """Returns the ids of the complete snapshots, oldest first."""
+    if not os.path.isdir(snapshots_dir):
+        return []
+    created = {}
+    for name in os.listdir(snapshots_dir):
+        manifest_path = os.path.join(snapshots_dir, name, MANIFEST_FILE)
+        if not name.startswith(".") and os.path.exists(manifest_path):
+            try:
+                with open(manifest_path, encoding="utf-8") as f:
+                    created[name] = json.load(f)["created_at"]
+            except Exception as e:
+                print(f"Skipping unreadable snapshot {name}: {e}")
+    return sorted(created, key=lambda name: (created[name], name))
+
+def prune_snapshots(snapshots_dir, keep=3):
+    """
+    Deletes all but the newest `keep` snapshots, never the published one. A replica
+    still mapping a deleted snapshot keeps reading it until it swaps (on POSIX).
+    """
+    current = current_snapshot_id(snapshots_dir)
+    snapshot_ids = list_snapshots(snapshots_dir)
+    for snapshot_id in snapshot_ids[:-max(1, keep)]:
+        if snapshot_id != current:
+            shutil.rmtree(os.path.join(snapshots_dir, snapshot_id), ignore_errors=True)
+
+def export_snapshot(collection, snapshots_dir, extras=None, batch_size=1000, keep=3):
+    """
+    Writes every chunk of the collection (vector, text and metadata) and the JSON
+    `extras` ({name: value}) as a new snapshot, then publishes it. Returns the
+    snapshot id. Writers must be kept out of the collection while it runs.
+    """
+    os.makedirs(snapshots_dir, exist_ok=True)
+    snapshot_id = f"{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())}-{uuid.uuid4().hex[:8]}"
+    tmp_dir = os.path.join(snapshots_dir, f".{snapshot_id}.tmp")
+    os.makedirs(tmp_dir)
+    try:
+        rows, dimension, offset = 0, 0, 0
+        files = {name: open(os.path.join(tmp_dir, name), "wb") for name in _DATA_FILES}
+        try:
+            files["document_offsets.i64"].write(np.zeros(1, dtype="<i8").tobytes())
+            for start in range(0, collection.count(), batch_size):
+                batch = collection.get(limit=batch_size, offset=start, include=["embeddings", "documents", "metadatas"])
+                if not len(batch["ids"]):
+                    break
+                vectors = np.asarray(batch["embeddings"], dtype="<f4")
+                if dimension and vectors.shape[1] != dimension:
+                    raise ValueError(f"Mixed embedding dimensions in the collection ({dimension}, {vectors.shape[1]})")
+                dimension = vectors.shape[1]
+                files["vectors.f32"].write(vectors.tobytes())
+                files["norms.f32"].write(np.linalg.norm(vectors, axis=1).astype("<f4").tobytes())
+                texts = [(document or "").encode("utf-8") for document in batch["documents"]]
+                files["documents.bin"].write(b"".join(texts))
+                ends = offset + np.cumsum([len(text) for text in texts], dtype=np.int64)
+                files["document_offsets.i64"].write(ends.astype("<i8").tobytes())
+                offset = int(ends[-1])
+                files["chunks.jsonl"].write("".join(
+                    json.dumps({"id": chunk_id, "metadata": metadata or {}}) + "\n"
+                    for chunk_id, metadata in zip(batch["ids"], batch["metadatas"])
+                ).encode("utf-8"))
+                rows += len(batch["ids"])
+            for f in files.values():
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            for f in files.values():
+                f.close()
+
+        for name, value in (extras or {}).items():
+            _write_json(os.path.join(tmp_dir, f"{name}.json"), value)
+        _write_json(os.path.join(tmp_dir, MANIFEST_FILE), {
+            "format": SNAPSHOT_FORMAT,
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "snapshot_id": snapshot_id,
+            "created_at": time.time(),
+            "rows": rows,
+            "dimension": dimension,
+            "extras": sorted(extras or {}),
+            "files": {
+                name: {"bytes": os.path.getsize(os.path.join(tmp_dir, name)), "sha256": _sha256(os.path.join(tmp_dir, name))}
+                for name in sorted(os.listdir(tmp_dir))
+            },
+        })
+        os.rename(tmp_dir, os.path.join(snapshots_dir, snapshot_id))
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    publish_snapshot(snapshots_dir, snapshot_id)
+    prune_snapshots(snapshots_dir, keep)
+    print(f"Published snapshot {snapshot_id} with {rows} chunk(s).")
+    return snapshot_id
+
+# --- Reading ---
+
+class Snapshot:
+    """
+    A snapshot opened read-only. Vectors and chunk texts are memory-mapped, so
+    replicas on one machine share them through the OS page cache; only the chunk
+    ids and metadata are loaded into memory. verify=True checks every checksum first.
+    """
+
+    def __init__(self, path, verify=True):
+        self.path = path
+        with open(os.path.join(path, MANIFEST_FILE), encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        if (self.manifest.get("format"), self.manifest.get("format_version")) != (SNAPSHOT_FORMAT, SNAPSHOT_FORMAT_VERSION):
+            raise ValueError(
+                f"Unsupported snapshot format in {path}: "
+                f"{self.manifest.get('format')} version {self.manifest.get('format_version')}"
+            )
+        if verify:
+            self.verify()
+        self.snapshot_id = self.manifest["snapshot_id"]
+        self.rows = self.manifest["rows"]
+        self.dimension = self.manifest["dimension"]
+        self.vectors = self._map("vectors.f32", "<f4", (self.rows, self.dimension))
+        self.norms = self._map("norms.f32", "<f4", (self.rows,))
+        self._offsets = self._map("document_offsets.i64", "<i8", (self.rows + 1,))
+        self._documents = self._map("documents.bin", np.uint8, (int(self._offsets[-1]),))
+        self.ids, self.metadatas = [], []
+        with open(os.path.join(path, "chunks.jsonl"), encoding="utf-8") as f:
+            for line in f:
+                chunk = json.loads(line)
+                self.ids.append(chunk["id"])
+                self.metadatas.append(chunk["metadata"])
+        self._extras = {}
+
+    def _map(self, name, dtype, shape):
+        if not all(shape):
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(os.path.join(self.path, name), dtype=dtype, mode="r", shape=shape)
+
+    def verify(self):
+        """Checks the size and SHA-256 of every file against the manifest (ValueError if one differs)."""
+        for name, expected in self.manifest["files"].items():
+            file_path = os.path.join(self.path, name)
+            if not os.path.exists(file_path) or os.path.getsize(file_path) != expected["bytes"]:
+                raise ValueError(f"Snapshot {self.path} is incomplete: {name} is missing or truncated")
+            if _sha256(file_path) != expected["sha256"]:
+                raise ValueError(f"Snapshot {self.path} is corrupt: checksum mismatch in {name}")
+
+    def document(self, row):
+        return self._documents[self._offsets[row]:self._offsets[row + 1]].tobytes().decode("utf-8")
+
+    def extra(self, name, default=None):
+        """Returns the JSON extra exported under `name` (e.g. the PDF manifest)."""
+        if name not in self.manifest["extras"]:
+            return default
+        if name not in self._extras:
+            with open(os.path.join(self.path, f"{name}.json"), encoding="utf-8") as f:
+                self._extras[name] = json.load(f)
+        return self._extras[name]
+
+def import_snapshot(snapshot, collection, batch_size=1000):
+    """Bulk-loads the snapshot's chunks into a writable collection without re-embedding them."""
+    for start in range(0, snapshot.rows, batch_size):
+        end = min(snapshot.rows, start + batch_size)
+        collection.upsert(
+            ids=snapshot.ids[start:end],
+            embeddings=np.asarray(snapshot.vectors[start:end], dtype=np.float32).tolist(),
+            documents=[snapshot.document(row) for row in range(start, end)],
+            metadatas=snapshot.metadatas[start:end],
+        )
+    print(f"Imported {snapshot.rows} chunk(s) from snapshot {snapshot.snapshot_id}.")
+    return snapshot.rows
+
+# --- Serving ---
+
+def _compare(actual, operator, operand):
+    try:
+        if operator == "$eq":
+            return actual == operand
+        if operator == "$ne":
+            return actual != operand
+        if operator == "$in":
+            return actual in operand
+        if operator == "$nin":
+            return actual not in operand
+        if actual is None:
+            return False
+        if operator == "$gt":
+            return actual > operand
+        if operator == "$gte":
+            return actual >= operand
+        if operator == "$lt":
+            return actual < operand
+        if operator == "$lte":
+            return actual <= operand
+    except TypeError: # e.g. a string compared with a number
+        return False
+    raise ValueError(f"Unsupported filter operator: {operator}")
+
+def where_matches(metadata, where):
+    """Evaluates a Chroma where filter ($and/$or, $eq/$ne/$gt/$gte/$lt/$lte/$in/$nin) on one chunk's metadata."""
+    for key, value in where.items():
+        if key == "$and":
+            if not all(where_matches(metadata, condition) for condition in value):
+                return False
+        elif key == "$or":
+            if not any(where_matches(metadata, condition) for condition in value):
+                return False
+        else:
+            conditions = value if isinstance(value, dict) else {"$eq": value}
+            if not all(_compare(metadata.get(key), operator, operand) for operator, operand in conditions.items()):
+                return False
+    return True
+
+class SnapshotCollection:
+    """
+    Read-only view of a Snapshot with the subset of the Chroma collection API
+    the apps use (count, get, query). Queries are exact cosine searches over the
+    memory-mapped vectors; where filters are evaluated on the in-memory metadata.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self._rows = {chunk_id: row for row, chunk_id in enumerate(snapshot.ids)}
+
+    def count(self):
+        return self.snapshot.rows
+
+    def _select(self, ids=None, where=None):
+        rows = range(self.snapshot.rows) if ids is None else [self._rows[i] for i in ids if i in self._rows]
+        if where:
+            rows = [row for row in rows if where_matches(self.snapshot.metadatas[row], where)]
+        return list(rows)
+
+    def _records(self, rows, include):
+        snapshot = self.snapshot
+        return {
+            "ids": [snapshot.ids[row] for row in rows],
+            "documents": [snapshot.document(row) for row in rows] if "documents" in include else None,
+            "metadatas": [snapshot.metadatas[row] for row in rows] if "metadatas" in include else None,
+            "embeddings": [snapshot.vectors[row].astype(np.float32).tolist() for row in rows]
+                          if "embeddings" in include else None,
+        }
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=("documents", "metadatas")):
+        rows = self._select(ids, where)
+        start = offset or 0
+        return self._records(rows[start:None if limit is None else start + limit], include)
+
+    def _search(self, query, candidates, n_results):
+        """Returns (rows, cosine similarities) of the best n_results rows (of the candidates, if given)."""
+        snapshot = self.snapshot
+        total = snapshot.rows if candidates is None else len(candidates)
+        if total == 0:
+            return [], []
+        query = np.asarray(query, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        scores = np.empty(total, dtype=np.float32)
+        for start in range(0, total, SCAN_BLOCK_ROWS):
+            end = min(total, start + SCAN_BLOCK_ROWS)
+            rows = slice(start, end) if candidates is None else candidates[start:end]
+            norms = snapshot.norms[rows]
+            scores[start:end] = (snapshot.vectors[rows] @ query) / np.where(norms > 0, norms, 1.0)
+        k = min(n_results, total)
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        rows = best if candidates is None else candidates[best]
+        return [int(row) for row in rows], scores[best].tolist()
+
+    def query(self, query_embeddings, n_results=10, where=None, include=("documents", "metadatas", "distances")):
+        candidates = np.asarray(self._select(where=where), dtype=np.int64) if where else None
+        result = {key: [] for key in ("ids", "documents", "metadatas", "embeddings", "distances")}
+        for query in query_embeddings:
+            rows, similarities = self._search(query, candidates, n_results)
+            records = self._records(rows, include)
+            for key in ("ids", "documents", "metadatas", "embeddings"):
+                result[key].append(records[key])
+            result["distances"].append([1.0 - similarity for similarity in similarities])
+        return result
+
+    def upsert(self, *args, **kwargs):
+        raise RuntimeError(READ_ONLY_MESSAGE)
+
+    def delete(self, *args, **kwargs):
+        raise RuntimeError(READ_ONLY_MESSAGE)
+
+class SnapshotVectorStore(VectorStore):
+    """Read-only LangChain VectorStore over a SnapshotCollection, exposed as _collection like langchain_chroma.Chroma."""
+
+    def __init__(self, snapshot, embedding_function):
+        self._collection = SnapshotCollection(snapshot)
+        self._embedding_function = embedding_function
+
+    @property
+    def embeddings(self):
+        return self._embedding_function
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs) -> List[str]:
+        raise RuntimeError(READ_ONLY_MESSAGE)
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs: Any) -> List[Document]:
+        hits = self._collection.query([self._embedding_function.embed_query(query)], n_results=k, where=filter)
+        return [Document(page_content=document, metadata=metadata)
+                for document, metadata in zip(hits["documents"][0], hits["metadatas"][0])]
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, **kwargs):
+        raise RuntimeError(f"{READ_ONLY_MESSAGE} New snapshots are written with export_snapshot.")
@@ -0,0 +1,16 @@
+import os
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VERSION_2_DIR = os.path.join(REPO_DIR, "version_2")
+BENCH_DIR = os.path.join(REPO_DIR, "benchmarks")
+
+# The shared package and app.py are imported from the repository root, the version_2 modules
+# from version_2 (as its main.py does)
+sys.path[:0] = [REPO_DIR, BENCH_DIR]
+sys.path.append(VERSION_2_DIR)
+
+# version_2/config.py needs an API key and creates its data directories in the working directory
+os.environ.setdefault("GOOGLE_API_KEY", "test")
+os.chdir(tempfile.mkdtemp(prefix="ask-my-docs-tests-"))
@@ -0,0 +1,37 @@
+from langchain_core.embeddings import Embeddings
+from shared.answer_cache import AnswerCache
+
+class SameVectorEmbeddings(Embeddings):
+    """Embeds every text to the same vector, so only the guard can tell questions apart."""
+
+    def embed_documents(self, texts):
+        return [[1.0, 0.0] for _ in texts]
+
+    def embed_query(self, text):
+        return [1.0, 0.0]
+
+def test_exact_match_ignores_case_and_punctuation():
+    cache = AnswerCache()
+    cache.put("What is the total for Acme?", 1, "100", "- a.pdf")
+    assert cache.get("what is the total for acme", 1) == ("100", "- a.pdf")
+
+def test_newer_generation_drops_entries():
+    cache = AnswerCache()
+    cache.put("What is the total for Acme?", 1, "100", "- a.pdf")
+    assert cache.get("What is the total for Acme?", 2) is None
+    cache.put("What is the total for Acme?", 1, "stale", "")
+    assert cache.get("What is the total for Acme?", 2) is None
+
+def test_semantic_matching_is_off_by_default():
+    cache = AnswerCache(embeddings=SameVectorEmbeddings())
+    cache.put("What is the total for Acme?", 1, "100", "- a.pdf")
+    assert cache.get("Tell me the total for Acme", 1) is None
+
+def test_semantic_match_requires_the_same_names_and_numbers():
+    cache = AnswerCache(embeddings=SameVectorEmbeddings(), similarity_threshold=0.95)
+    cache.put("What is the total for Acme?", 1, "Acme: 100", "- a.pdf")
+    assert cache.get("What is the total for Globex?", 1) is None
+    assert cache.get("What's the total billed to Acme?", 1) == ("Acme: 100", "- a.pdf")
+    cache.put("Who was billed on invoice INV-1?", 1, "Acme", "- a.pdf")
+    assert cache.get("Who was billed on invoice INV-2?", 1) is None
+    assert cache.stats()["semantic_hits"] == 1
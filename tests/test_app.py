@@ -0,0 +1,84 @@
+import os
+import pytest
+from fakes import FakeChatModel, FakeEmbeddings
+
+os.environ.setdefault("GEMINI_API_KEY", "test")
+os.environ.setdefault("METRICS_PORT", "0")
+app = pytest.importorskip("app")
+
+@pytest.fixture(autouse=True)
+def empty_app():
+    """Starts every test with no PDFs, an empty knowledge base and the fake models."""
+    app.models.update(llm=FakeChatModel(), embeddings=FakeEmbeddings(size=32), answer_cache=None)
+    app.clear_all_data()
+    yield
+    app.clear_all_data()
+
+def last(iterator):
+    for value in iterator:
+        pass
+    return value
+
+def test_question_before_any_upload_asks_for_the_knowledge_base():
+    assert os.path.exists(app.KEYWORD_INDEX_PATH)
+    answer, sources = last(app.get_answer("What is the total of INV-001?"))
+    assert answer.startswith("The knowledge base has not been created yet")
+    assert sources == ""
+
+INVOICES = [os.path.join(os.path.dirname(os.path.dirname(__file__)), "version_2", "invoices", f"invoice_{i}.pdf")
+            for i in (1, 2, 3)]
+
+def add_pdf(name, invoice):
+    with open(invoice, "rb") as src, open(os.path.join(app.PDFS_DIR, name), "wb") as dst:
+        dst.write(src.read())
+
+def rebuild():
+    return last(app.rebuild_vector_store(None))
+
+def chunk_ids_by_file():
+    stored = app.vector_store_instance._collection.get(include=["metadatas"])
+    by_file = {}
+    for chunk_id, metadata in zip(stored["ids"], stored["metadatas"]):
+        by_file.setdefault(os.path.basename(metadata["source"]), set()).add(chunk_id)
+    return by_file
+
+def test_unchanged_files_are_not_re_embedded(monkeypatch):
+    add_pdf("a.pdf", INVOICES[0])
+    add_pdf("b.pdf", INVOICES[1])
+    assert "2 indexed" in rebuild()
+    before = chunk_ids_by_file()
+    monkeypatch.setattr(FakeEmbeddings, "embed_documents", lambda self, texts: pytest.fail("re-embedded"))
+    assert "2 unchanged" in rebuild()
+    assert chunk_ids_by_file() == before
+
+def test_modified_file_replaces_its_old_chunks():
+    add_pdf("a.pdf", INVOICES[0])
+    add_pdf("b.pdf", INVOICES[1])
+    rebuild()
+    before = chunk_ids_by_file()
+    add_pdf("a.pdf", INVOICES[2])
+    assert "1 indexed" in rebuild()
+    after = chunk_ids_by_file()
+    assert after["b.pdf"] == before["b.pdf"]
+    assert after["a.pdf"] and not after["a.pdf"] & before["a.pdf"]
+    assert set(app.load_manifest()["a.pdf"]["chunk_ids"]) == after["a.pdf"]
+
+def test_removed_file_is_purged():
+    add_pdf("a.pdf", INVOICES[0])
+    add_pdf("b.pdf", INVOICES[1])
+    rebuild()
+    os.remove(os.path.join(app.PDFS_DIR, "b.pdf"))
+    assert "1 removed" in rebuild()
+    assert set(chunk_ids_by_file()) == {"a.pdf"}
+    assert set(app.load_manifest()) == {"a.pdf"}
+    assert all(os.path.basename(hit[2]["source"]) == "a.pdf" for hit in app.keyword_index.search("invoice", k=100))
+
+def test_identical_files_under_different_names_keep_separate_chunks():
+    add_pdf("a.pdf", INVOICES[0])
+    add_pdf("copy of a.pdf", INVOICES[0])
+    rebuild()
+    by_file = chunk_ids_by_file()
+    assert by_file["a.pdf"] and by_file["copy of a.pdf"] and not by_file["a.pdf"] & by_file["copy of a.pdf"]
+    os.remove(os.path.join(app.PDFS_DIR, "copy of a.pdf"))
+    rebuild()
+    assert chunk_ids_by_file() == {"a.pdf": by_file["a.pdf"]}
@@ -0,0 +1,64 @@
+import os
+import numpy as np
+import pytest
+from compact_index import CompactCollection, READ_ONLY_MESSAGE
+
+def vectors(count, seed=0):
+    return np.random.default_rng(seed).normal(size=(count, 16)).astype(np.float32)
+
+def add(collection, ids, embeddings):
+    collection.upsert(ids, embeddings, [f"text {chunk_id}" for chunk_id in ids],
+                      [{"source": chunk_id.split("-")[0]} for chunk_id in ids])
+
+def test_query_finds_the_stored_vector(tmp_path):
+    collection = CompactCollection(str(tmp_path))
+    data = vectors(50)
+    add(collection, [f"a-{i}" for i in range(50)], data)
+    hits = collection.query([data[7]], n_results=3)
+    assert hits["ids"][0][0] == "a-7"
+    assert hits["distances"][0][0] == pytest.approx(0.0, abs=1e-3)
+
+def test_appends_extend_the_live_rows_without_a_full_reload(tmp_path):
+    collection = CompactCollection(str(tmp_path))
+    data = vectors(20)
+    add(collection, [f"a-{i}" for i in range(10)], data[:10])
+    collection.query([data[0]], n_results=1)
+    layout = collection._mapped["layout"]
+    add(collection, [f"b-{i}" for i in range(10)], data[10:])
+    assert collection.query([data[15]], n_results=1)["ids"][0] == ["b-5"]
+    assert collection._mapped["layout"] == layout
+    assert list(collection._mapped["alive"]) == list(range(20))
+
+def test_deletes_and_revivals_reload_the_live_rows(tmp_path):
+    collection = CompactCollection(str(tmp_path))
+    data = vectors(10)
+    add(collection, [f"a-{i}" for i in range(10)], data)
+    collection.query([data[0]], n_results=1)
+    collection.delete(ids=["a-3"])
+    assert "a-3" not in collection.query([data[3]], n_results=10)["ids"][0]
+    add(collection, ["a-3"], data[3:4])
+    assert collection.query([data[3]], n_results=1)["ids"][0] == ["a-3"]
+
+def test_index_without_float_copy_ranks_by_int8_scores(tmp_path):
+    collection = CompactCollection(str(tmp_path), rescore_factor=0)
+    data = vectors(30)
+    add(collection, [f"a-{i}" for i in range(30)], data)
+    assert not os.path.exists(tmp_path / "vectors.f16")
+    assert collection.query([data[12]], n_results=1)["ids"][0] == ["a-12"]
+    embedding = collection.get(ids=["a-12"], include=("embeddings",))["embeddings"][0]
+    assert np.allclose(embedding, data[12], atol=np.abs(data[12]).max() / 100)
+    # The choice is fixed at creation, so reopening with re-scoring still has no float copy to read
+    assert CompactCollection(str(tmp_path), rescore_factor=4).query([data[12]], n_results=1)["ids"][0] == ["a-12"]
+
+def test_read_only_collection_sees_writes_and_refuses_its_own(tmp_path):
+    writer = CompactCollection(str(tmp_path))
+    data = vectors(10)
+    add(writer, [f"a-{i}" for i in range(5)], data[:5])
+    reader = CompactCollection(str(tmp_path), read_only=True)
+    assert reader.count() == 5
+    add(writer, [f"a-{i}" for i in range(5, 10)], data[5:])
+    assert reader.query([data[8]], n_results=1)["ids"][0] == ["a-8"]
+    with pytest.raises(RuntimeError, match=READ_ONLY_MESSAGE):
+        reader.upsert(["b-0"], data[:1])
+    with pytest.raises(RuntimeError, match=READ_ONLY_MESSAGE):
+        reader.delete(ids=["a-0"])
@@ -0,0 +1,27 @@
+import asyncio
+from shared.concurrency import iterate_async, iterate_in_thread
+
+async def count_to(n, closed):
+    try:
+        for i in range(n):
+            await asyncio.sleep(0)
+            yield i
+    finally:
+        closed.append(True)
+
+def test_iterate_async_yields_every_item():
+    closed = []
+    assert list(iterate_async(count_to(3, closed))) == [0, 1, 2]
+    assert closed == [True]
+
+def test_iterate_async_closes_an_abandoned_generator():
+    closed = []
+    items = iterate_async(count_to(10, closed))
+    assert next(items) == 0
+    items.close()
+    assert closed == [True]
+
+def test_iterate_in_thread_round_trip():
+    async def collect():
+        return [item async for item in iterate_in_thread(iter(range(3)))]
+    assert asyncio.run(collect()) == [0, 1, 2]
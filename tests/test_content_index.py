@@ -0,0 +1,26 @@
+from content_index import ContentIndex, TextFingerprint, minhash_signature, normalize_text, text_sha256
+
+def test_streamed_fingerprint_matches_whole_text():
+    pages = ["Invoice  No: INV-1\nAcme Corp", "", "Total due:\t1,200.00 USD  ", "Thank you for your business."]
+    fingerprint = TextFingerprint()
+    for page in pages:
+        fingerprint.update(page)
+    text = normalize_text(" ".join(pages))
+    assert fingerprint.result() == (text_sha256(text), minhash_signature(text))
+
+def test_empty_text_has_no_fingerprint():
+    fingerprint = TextFingerprint()
+    fingerprint.update("  \n ")
+    assert fingerprint.result() == (None, None)
+
+def test_lookups_exclude_the_file_itself():
+    index = ContentIndex(":memory:")
+    fingerprint = TextFingerprint()
+    fingerprint.update("one two three four five six seven")
+    text_hash, signature = fingerprint.result()
+    index.add("PDFs/a.pdf", "bytes-a", text_hash, signature)
+    assert index.find_file("bytes-a") == "PDFs/a.pdf"
+    assert index.find_text(text_hash) == "PDFs/a.pdf"
+    assert index.find_text(text_hash, exclude="PDFs/a.pdf") is None
+    assert index.find_near_duplicate(signature, 0.9) == ("PDFs/a.pdf", 1.0)
+    assert index.find_near_duplicate(signature, 0.9, exclude="PDFs/a.pdf") == (None, 0.0)
@@ -0,0 +1,40 @@
+from langchain_core.documents import Document
+from shared.context_packing import pack_context
+
+def doc(text, source="a.pdf", page=1):
+    return Document(page_content=text, metadata={"source": source, "page": page})
+
+OPENING = "Invoice INV-001 issued by Acme Corp to Globex for consulting services rendered in March."
+CLOSING = "consulting services rendered in March. Payment is due within thirty days of receipt."
+
+def test_overlapping_chunks_of_a_page_are_merged():
+    first, second = doc(OPENING), doc(CLOSING)
+    context, used_docs, stats = pack_context([first, second])
+    assert context.count("consulting services rendered in March.") == 1
+    assert "Payment is due within thirty days" in context
+    assert stats["blocks"] == 1 and used_docs == [first, second]
+
+def test_duplicates_and_contained_chunks_are_dropped():
+    context, used_docs, stats = pack_context([doc(OPENING), doc(OPENING), doc("issued by Acme Corp")])
+    assert context.count(OPENING) == 1
+    assert stats == {"chunks": 3, "blocks": 1, "tokens": stats["tokens"]}
+    assert len(used_docs) == 3
+
+def test_chunks_of_other_pages_stay_separate_in_rank_order():
+    context, _, stats = pack_context([doc(CLOSING, page=2), doc(OPENING, source="b.pdf")])
+    assert stats["blocks"] == 2
+    assert context.index("[a.pdf, page 2]") < context.index("[b.pdf, page 1]")
+
+def test_budget_cuts_the_last_block_and_leaves_its_chunk_out_of_the_sources():
+    short = doc("Acme Corp total due is 1200 dollars. " * 5, source="a.pdf")
+    long = doc("Globex line items " * 200, source="b.pdf")
+    context, used_docs, stats = pack_context([short, long], max_tokens=150)
+    assert context.endswith(" ...")
+    assert stats["blocks"] == 2 and stats["tokens"] <= 150
+    assert used_docs == [short]
+
+def test_budget_too_small_for_another_block_stops_packing():
+    context, used_docs, stats = pack_context([doc("word " * 100, source="a.pdf"), doc("other " * 50, source="b.pdf")],
+                                             max_tokens=140)
+    assert stats["blocks"] == 1 and "b.pdf" not in context
+    assert [d.metadata["source"] for d in used_docs] == ["a.pdf"]
@@ -0,0 +1,48 @@
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from shared import embedding_cache
+from shared.embedding_cache import CachedEmbeddings
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    """DeterministicFakeEmbedding that records the texts it was asked to embed."""
+
+    calls: list = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return super().embed_documents(texts)
+
+def test_hits_skip_the_underlying_model(tmp_path):
+    underlying = CountingEmbeddings(size=8, calls=[])
+    cache = CachedEmbeddings(underlying, str(tmp_path / "embeddings.sqlite3"))
+    first = cache.embed_documents(["alpha", "beta", "alpha"])
+    second = cache.embed_documents(["beta", "alpha"])
+    assert underlying.calls == [["alpha", "beta"]]
+    assert second == [first[1], first[0]]
+    assert first[0] == underlying.embed_documents(["alpha"])[0]
+    assert cache.stats()["hits"] == 3 and cache.stats()["misses"] == 2
+
+def test_vectors_persist_across_instances(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite3")
+    CachedEmbeddings(DeterministicFakeEmbedding(size=8), path).embed_documents(["alpha"])
+    underlying = CountingEmbeddings(size=8, calls=[])
+    CachedEmbeddings(underlying, path, model_name=DeterministicFakeEmbedding.__name__).embed_documents(["alpha"])
+    assert underlying.calls == []
+
+def test_queries_and_documents_are_cached_separately(tmp_path):
+    cache = CachedEmbeddings(DeterministicFakeEmbedding(size=8), str(tmp_path / "embeddings.sqlite3"))
+    cache.embed_documents(["alpha"])
+    cache.embed_query("alpha")
+    assert cache.stats() == {"hits": 0, "misses": 2, "hit_rate": 0.0, "entries": 2}
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    clock = iter(range(100))
+    monkeypatch.setattr(embedding_cache.time, "time", lambda: next(clock))
+    underlying = CountingEmbeddings(size=8, calls=[])
+    cache = CachedEmbeddings(underlying, str(tmp_path / "embeddings.sqlite3"), max_entries=2)
+    cache.embed_documents(["alpha"])
+    cache.embed_documents(["beta"])
+    cache.embed_documents(["alpha"]) # refreshes alpha, so beta is now the oldest
+    cache.embed_documents(["gamma"])
+    assert cache.stats()["entries"] == 2
+    cache.embed_documents(["alpha", "beta"])
+    assert underlying.calls == [["alpha"], ["beta"], ["gamma"], ["beta"]]
@@ -0,0 +1,76 @@
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from shared.hybrid_retrieval import HybridRetriever, KeywordIndex, backfill_keyword_index, reciprocal_rank_fusion
+
+EMBEDDINGS = DeterministicFakeEmbedding(size=16)
+CHUNKS = {
+    "a-0": ("Invoice INV-001 from Acme Corp, total 1200 USD", {"source": "a.pdf", "vendor_name": "Acme Corp"}),
+    "b-0": ("Invoice INV-002 from Globex, total 800 USD", {"source": "b.pdf", "vendor_name": "Globex"}),
+    "c-0": ("Payment terms are net 30 for all Globex orders", {"source": "c.pdf", "vendor_name": "Globex"}),
+}
+
+class FakeCollection:
+    """
+    The Chroma collection methods the retriever uses. query returns the chunks
+    matching the where filter in a fixed order and records every call.
+    """
+
+    def __init__(self, chunks, vector_order):
+        self.chunks = chunks
+        self.vector_order = vector_order
+        self.queries = []
+
+    def count(self):
+        return len(self.chunks)
+
+    def _matches(self, chunk_id, where):
+        return all(self.chunks[chunk_id][1].get(field) == value for field, value in (where or {}).items())
+
+    def query(self, query_embeddings, n_results, where=None, include=()):
+        self.queries.append(where)
+        ids = [chunk_id for chunk_id in self.vector_order if self._matches(chunk_id, where)][:n_results]
+        return {"ids": [ids], "documents": [[self.chunks[i][0] for i in ids]],
+                "metadatas": [[self.chunks[i][1] for i in ids]],
+                "embeddings": [EMBEDDINGS.embed_documents([self.chunks[i][0] for i in ids])]}
+
+    def get(self, ids=None, limit=None, offset=0, include=()):
+        ids = list(self.chunks)[offset:offset + limit] if ids is None else [i for i in ids if i in self.chunks]
+        return {"ids": ids, "documents": [self.chunks[i][0] for i in ids], "metadatas": [self.chunks[i][1] for i in ids],
+                "embeddings": EMBEDDINGS.embed_documents([self.chunks[i][0] for i in ids])}
+
+def keyword_index(collection):
+    index = KeywordIndex(":memory:")
+    backfill_keyword_index(index, collection)
+    return index
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    assert reciprocal_rank_fusion([["a", "b", "c"], ["b"]]) == ["b", "a", "c"]
+    assert reciprocal_rank_fusion([["a"], []]) == ["a"]
+
+def test_keyword_index_ranks_exact_tokens_and_filters_by_source():
+    index = keyword_index(FakeCollection(CHUNKS, list(CHUNKS)))
+    assert [hit[0] for hit in index.search("INV-002")][0] == "b-0"
+    assert [hit[0] for hit in index.search("Globex", sources=["c.pdf"])] == ["c-0"]
+    assert index.search("Globex", sources=[]) == []
+    index.delete(["b-0"])
+    assert "b-0" not in [hit[0] for hit in index.search("INV-002")]
+
+def test_keyword_hits_missing_from_the_vector_side_are_fused_in():
+    # The vector side never returns b-0; the exact invoice number still finds it through BM25
+    collection = FakeCollection(CHUNKS, ["c-0", "a-0"])
+    retriever = HybridRetriever(collection=collection, keyword_index=keyword_index(collection), embeddings=EMBEDDINGS,
+                                top_k=3, lexical_weight=10.0)
+    docs = retriever.search("INV-002 total")
+    assert docs[0].metadata["source"] == "b.pdf"
+    assert {doc.metadata["source"] for doc in docs} == {"a.pdf", "b.pdf", "c.pdf"}
+
+def test_where_filter_goes_to_the_vector_side_and_sources_to_the_keyword_side():
+    collection = FakeCollection(CHUNKS, list(CHUNKS))
+    retriever = HybridRetriever(collection=collection, keyword_index=keyword_index(collection), embeddings=EMBEDDINGS)
+    docs = retriever.search("INV-001 Acme invoice", where={"vendor_name": "Globex"}, sources=["b.pdf", "c.pdf"])
+    assert collection.queries == [{"vendor_name": "Globex"}]
+    assert {doc.metadata["source"] for doc in docs} == {"b.pdf", "c.pdf"}
+
+def test_empty_collection_returns_nothing():
+    collection = FakeCollection({}, [])
+    retriever = HybridRetriever(collection=collection, keyword_index=KeywordIndex(":memory:"), embeddings=EMBEDDINGS)
+    assert retriever.search("anything") == []
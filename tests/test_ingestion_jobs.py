@@ -0,0 +1,53 @@
+import threading
+from ingestion_jobs import IngestionJobQueue
+
+def make_pdfs(tmp_path, *names):
+    paths = []
+    for name in names:
+        path = tmp_path / name
+        path.write_bytes(b"%PDF-1.4")
+        paths.append(str(path))
+    return paths
+
+def test_files_move_to_a_terminal_state(tmp_path):
+    a, b = make_pdfs(tmp_path, "a.pdf", "b.pdf")
+    done = threading.Event()
+
+    def process(pdf_paths, on_file_state, stop_event):
+        on_file_state(a, "indexed")
+        done.set() # b is left unfinished and must be failed by the queue
+
+    queue = IngestionJobQueue(str(tmp_path / "jobs.sqlite3"), process, poll_seconds=0.01)
+    queue.start()
+    job_id = queue.submit([a, b])
+    assert done.wait(5)
+    queue.cancel_all() # returns once the worker is idle again
+    assert {f["pdf_path"]: f["state"] for f in queue.status(job_id)} == {a: "indexed", b: "failed"}
+
+def test_cancel_all_stops_the_running_job_and_fails_queued_ones(tmp_path):
+    a, b = make_pdfs(tmp_path, "a.pdf", "b.pdf")
+    started, stopped = threading.Event(), []
+
+    def process(pdf_paths, on_file_state, stop_event):
+        on_file_state(pdf_paths[0], "embedding")
+        started.set()
+        stopped.append(stop_event.wait(5))
+
+    queue = IngestionJobQueue(str(tmp_path / "jobs.sqlite3"), process, poll_seconds=0.01)
+    queue.start()
+    running = queue.submit([a])
+    assert started.wait(5)
+    queued = queue.submit([b])
+    queue.cancel_all("knowledge base cleared")
+    assert stopped == [True]
+    assert not queue.stop_event.is_set()
+    assert queue.status(running)[0]["state"] == "failed"
+    assert queue.status(queued)[0] == {"pdf_path": b, "state": "failed", "detail": "knowledge base cleared"}
+
+def test_unfinished_files_are_recovered(tmp_path):
+    (a,) = make_pdfs(tmp_path, "a.pdf")
+    queue = IngestionJobQueue(str(tmp_path / "jobs.sqlite3"), process=None)
+    job_id = queue.submit([a])
+    queue.set_state(job_id, a, "parsing")
+    assert IngestionJobQueue(str(tmp_path / "jobs.sqlite3"), process=None).recover() == 1
+    assert queue.status(job_id)[0]["state"] == "queued"
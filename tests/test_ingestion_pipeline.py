@@ -0,0 +1,68 @@
+import os
+import threading
+from types import SimpleNamespace
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from conftest import VERSION_2_DIR
+from shared.ingestion_pipeline import iter_ingestion_pipeline, _pool_context
+
+INVOICES = [os.path.join(VERSION_2_DIR, "invoices", f"invoice_{i}.pdf") for i in (1, 2)]
+
+class DictCollection:
+    """In-memory stand-in for the Chroma collection methods the pipeline writes with."""
+
+    def __init__(self):
+        self.rows = {}
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        self.rows.update({chunk_id: (document, metadata) for chunk_id, document, metadata in zip(ids, documents, metadatas)})
+
+    def delete(self, ids):
+        for chunk_id in ids:
+            self.rows.pop(chunk_id, None)
+
+def run(collection, pdf_paths=INVOICES, **kwargs):
+    store = SimpleNamespace(_collection=collection)
+    progress = list(iter_ingestion_pipeline(pdf_paths, store, DeterministicFakeEmbedding(size=8), batch_size=2,
+                                            parse_workers=1, **kwargs))
+    return progress[-1]
+
+def test_every_chunk_is_indexed_under_its_prefix():
+    collection = DictCollection()
+    result = run(collection, chunk_id_prefix=os.path.basename)
+    assert result["done"] and result["failed"] == {}
+    assert sorted(result["chunk_ids"]) == sorted(INVOICES)
+    assert set(collection.rows) == {chunk_id for ids in result["chunk_ids"].values() for chunk_id in ids}
+    assert all(chunk_id.startswith(os.path.basename(path)) for path, ids in result["chunk_ids"].items() for chunk_id in ids)
+
+def test_stopped_pipeline_undoes_its_writes():
+    collection = DictCollection()
+    stop_event = threading.Event()
+    stop_event.set()
+    result = run(collection, stop_event=stop_event)
+    assert result["chunk_ids"] == {}
+    assert result["failed"] == {path: "cancelled" for path in INVOICES}
+    assert collection.rows == {}
+
+def test_parse_workers_are_not_forked_from_the_app_process():
+    assert _pool_context().get_start_method() in ("forkserver", "spawn")
+
+def test_unreadable_pdf_fails_without_stopping_the_others(tmp_path):
+    broken = tmp_path / "broken.pdf"
+    broken.write_bytes(b"not a pdf")
+    collection = DictCollection()
+    result = run(collection, pdf_paths=[str(broken)] + INVOICES)
+    assert list(result["failed"]) == [str(broken)] and result["failed"][str(broken)].startswith("parsing failed")
+    assert sorted(result["chunk_ids"]) == sorted(INVOICES)
+
+def test_pdf_without_pages_is_failed_after_passing_through(tmp_path):
+    from pypdf import PdfWriter
+    empty = str(tmp_path / "empty.pdf")
+    PdfWriter().write(empty)
+    events = []
+    store = SimpleNamespace(_collection=DictCollection())
+    progress = list(iter_ingestion_pipeline([empty, INVOICES[0]], store, DeterministicFakeEmbedding(size=8),
+                                            parse_workers=1, on_file_event=lambda path, state: events.append((path, state))))
+    assert progress[-1]["failed"] == {empty: "no pages"}
+    assert list(progress[-1]["chunk_ids"]) == [INVOICES[0]]
+    assert progress[-1]["files_parsed"] == 2
+    assert [state for path, state in events if path == empty] == ["parsing", "embedding"]
@@ -0,0 +1,46 @@
+import pytest
+from langchain_core.structured_query import Comparator, Comparison
+from invoice_index import InvoiceIndex, detect_aggregate
+
+@pytest.mark.parametrize("question, expected", [
+    ("How many invoices are there?", ("count", None)),
+    ("How many Acme invoices do we have?", ("count", None)),
+    ("Number of invoices per vendor", ("count", "vendor")),
+    ("What is the average invoice value for Acme?", ("avg", None)),
+    ("What is the total value of all invoices?", ("sum", None)),
+    ("What is the total billed by Umbrella Corp?", ("sum", None)),
+    ("Sum of invoice amounts by year", ("sum", "year")),
+    ("Which invoice has the highest total?", ("max", None)),
+    ("What is the lowest invoice amount per month?", ("min", "month")),
+    ("What is the total for Acme Corp?", ("sum", None)),
+    ("Total for each vendor", ("sum", "vendor")),
+    ("What is the total of Globex's invoices in 2024?", ("sum", None)),
+    ("total of Umbrella Corp", ("sum", None)),
+])
+def test_detect_aggregate(question, expected):
+    assert detect_aggregate(question) == expected
+
+@pytest.mark.parametrize("question", [
+    "What is the invoice number of the Acme invoice?",
+    "What is the phone number of the vendor?",
+    "What does net 30 mean?",
+    "What is the maximum discount on INV-004?",
+    "What is the total amount of INV-004?",
+    "What is the total of INV-004?",
+    "What is the total for invoice number 1234?",
+    "What is the total for the Acme invoice?",
+])
+def test_lookup_questions_are_not_aggregates(question):
+    assert detect_aggregate(question) == (None, None)
+
+def test_aggregate_applies_filter_and_grouping():
+    index = InvoiceIndex(":memory:")
+    index.upsert({
+        "a.pdf": {"invoice_date": "2025-01-10", "invoice_number": "INV-1", "total_value": 100.0, "vendor_name": "Acme Corp"},
+        "b.pdf": {"invoice_date": "2025-02-10", "invoice_number": "INV-2", "total_value": 50.0, "vendor_name": "Acme Corp"},
+        "c.pdf": {"invoice_date": "2025-02-11", "invoice_number": "INV-3", "total_value": 70.0, "vendor_name": "Globex"},
+    })
+    acme = Comparison(comparator=Comparator.EQ, attribute="vendor_name", value="acme corp")
+    assert index.aggregate("sum", acme) == [{"group": None, "value": 150.0, "invoice_count": 2}]
+    assert [row["value"] for row in index.aggregate("count", group_by="month")] == [1, 2]
+    assert index.matching_sources(acme) == ["a.pdf", "b.pdf"]
@@ -0,0 +1,62 @@
+import pytest
+from langchain_core.runnables import RunnableLambda
+from metadata_extractor import MetadataExtractionService, extract_metadata_with_rules
+
+INVOICE = "Supplier: Acme Corp\nInvoice No: INV-001\nDate: 05/03/2025\nGrand Total: 1,250.50"
+
+class ResourceExhausted(Exception):
+    """Named like the google.api_core quota error, which is treated as transient."""
+
+class FakeLLM:
+    """Returns fixed invoice details from with_structured_output, failing the first `failures` calls."""
+
+    model = "fake-llm"
+
+    def __init__(self, failures=0, error=ResourceExhausted):
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    def with_structured_output(self, schema):
+        def extract(prompt):
+            self.calls += 1
+            if self.calls <= self.failures:
+                raise self.error("429 quota exceeded")
+            return schema(invoice_date="2025-03-05", invoice_number="INV-9", total_value=99.0, vendor_name="Globex")
+        return RunnableLambda(extract)
+
+def service(llm, tmp_path, **kwargs):
+    return MetadataExtractionService(llm, str(tmp_path / "metadata.sqlite3"), backoff_seconds=0, **kwargs)
+
+def test_rules_read_fixed_layout_invoices():
+    assert extract_metadata_with_rules(INVOICE) == {
+        "invoice_date": "2025-03-05", "invoice_number": "INV-001", "total_value": 1250.5, "vendor_name": "Acme Corp",
+    }
+    assert extract_metadata_with_rules("Quarterly report, no invoice details") is None
+
+def test_local_extractors_run_before_the_llm(tmp_path):
+    llm = FakeLLM()
+    extractor = service(llm, tmp_path, local_extractors=[extract_metadata_with_rules])
+    results, errors, stats = extractor.extract_many({"a.pdf": INVOICE, "b.pdf": "Free-form invoice text"})
+    assert results["a.pdf"]["vendor_name"] == "Acme Corp"
+    assert results["b.pdf"]["vendor_name"] == "Globex"
+    assert errors == {}
+    assert (stats["local"], stats["llm"], llm.calls) == (1, 1, 1)
+
+def test_llm_results_are_cached(tmp_path):
+    llm = FakeLLM()
+    service(llm, tmp_path).extract("Free-form invoice text")
+    metadata, method = service(llm, tmp_path).extract("Free-form   invoice text")
+    assert (metadata["invoice_number"], method, llm.calls) == ("INV-9", "cache", 1)
+
+def test_transient_errors_are_retried(tmp_path):
+    llm = FakeLLM(failures=2)
+    metadata, method = service(llm, tmp_path, max_retries=3).extract("Free-form invoice text")
+    assert (method, llm.calls) == ("llm", 3)
+
+@pytest.mark.parametrize("failures, error", [(5, ResourceExhausted), (1, ValueError)])
+def test_failures_are_reported_not_invented(tmp_path, failures, error):
+    llm = FakeLLM(failures=failures, error=error)
+    results, errors, stats = service(llm, tmp_path, max_retries=2).extract_many({"a.pdf": "Free-form invoice text"})
+    assert results == {} and "a.pdf" in errors and stats["failed"] == 1
+    assert llm.calls == (3 if error is ResourceExhausted else 1)
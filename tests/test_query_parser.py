@@ -0,0 +1,58 @@
+import pytest
+from langchain_core.runnables import RunnableLambda
+from langchain_core.structured_query import Comparator, Comparison, Operation, StructuredQuery
+from query_parser import QueryFilterParser, parse_filter, vendor_aliases
+
+ALIASES = vendor_aliases(["Acme Corp", "Globex"])
+
+def date(comparator, value):
+    return Comparison(comparator=comparator, attribute="invoice_date", value=value)
+
+@pytest.mark.parametrize("question, expected", [
+    ("invoices from 2025-01-01 to 2025-03-31", [date(Comparator.GTE, "2025-01-01"), date(Comparator.LTE, "2025-03-31")]),
+    ("invoices between 2025-01-01 and 2025-03-31", [date(Comparator.GTE, "2025-01-01"), date(Comparator.LTE, "2025-03-31")]),
+    ("invoices from 1 January 2025 through 31 March 2025",
+     [date(Comparator.GTE, "2025-01-01"), date(Comparator.LTE, "2025-03-31")]),
+    ("invoices since 2025-02-01", [date(Comparator.GTE, "2025-02-01")]),
+    ("invoices from 2025-02-01", [date(Comparator.GTE, "2025-02-01")]),
+    ("invoices after 2025-02-01", [date(Comparator.GT, "2025-02-01")]),
+    ("invoices until 2025-02-01", [date(Comparator.LTE, "2025-02-01")]),
+    ("invoices before 2025-02-01", [date(Comparator.LT, "2025-02-01")]),
+])
+def test_date_ranges_include_their_bounds(question, expected):
+    query_filter = parse_filter(question, ALIASES).filter
+    assert (query_filter.arguments if isinstance(query_filter, Operation) else [query_filter]) == expected
+
+def test_known_vendor_and_invoice_number():
+    assert parse_filter("What is the average invoice value for Acme?", ALIASES).filter == Comparison(
+        comparator=Comparator.EQ, attribute="vendor_name", value="Acme Corp")
+    assert parse_filter("What are the payment terms for invoice INV-001?", ALIASES).filter == Comparison(
+        comparator=Comparator.EQ, attribute="invoice_number", value="INV-001")
+
+def test_question_without_filter():
+    assert parse_filter("Which vendor has the highest total?", ALIASES).filter is None
+
+@pytest.mark.parametrize("question", [
+    "What is the total billed by Umbrella Corp?",
+    "total for vendor Initech",
+    "What is the total of invoices issued by Wayne Enterprises?",
+    "How much did we pay Umbrella?",
+    "Show the Initech invoices",
+])
+def test_unknown_vendors_are_left_to_the_llm(question):
+    assert parse_filter(question, ALIASES) is None
+
+def test_parser_falls_back_to_the_query_constructor():
+    calls = []
+
+    def construct(inputs):
+        calls.append(inputs["query"])
+        return StructuredQuery(query=inputs["query"], filter=None, limit=None)
+
+    parser = QueryFilterParser(lambda: ["Acme Corp", "Globex"])
+    constructor = RunnableLambda(construct)
+    parser.construct("How many invoices from Acme?", 1, constructor)
+    parser.construct("How many invoices from Umbrella Corp?", 1, constructor)
+    parser.construct("How many invoices from Umbrella Corp?", 1, constructor)
+    assert calls == ["How many invoices from Umbrella Corp?"]
+    assert parser.stats()["llm"] == 1 and parser.stats()["cache"] == 1
@@ -0,0 +1,77 @@
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from fakes import ThrottlingEmbeddings
+from shared.rate_limited_embeddings import RateLimitedEmbeddings, TokenBucket, is_rate_limit_error
+
+TEXTS = [f"chunk {i}" for i in range(50)]
+
+class ResourceExhausted(Exception):
+    pass
+
+class HTTPError(Exception):
+    def __init__(self, message, code):
+        super().__init__(message)
+        self.code = code
+
+@pytest.mark.parametrize("error, expected", [
+    (ResourceExhausted("quota"), True),
+    (HTTPError("Too Many Requests", 429), True),
+    (HTTPError("Bad request", 400), False),
+    (Exception("429 Resource has been exhausted (e.g. check quota)."), True),
+    (Exception("Rate limit reached for requests"), True),
+    (Exception("Document 429 could not be parsed"), False),
+    (Exception("Payload of 14290 bytes is too large"), False),
+])
+def test_is_rate_limit_error(error, expected):
+    assert is_rate_limit_error(error) is expected
+
+def rate_limited(underlying, **kwargs):
+    sleeps = []
+    return RateLimitedEmbeddings(underlying, sleep=sleeps.append, **kwargs), sleeps
+
+def test_batches_shrink_until_the_api_accepts_them():
+    expected = DeterministicFakeEmbedding(size=8).embed_documents(TEXTS)
+    throttling = ThrottlingEmbeddings(DeterministicFakeEmbedding(size=8), throttle_rate=0, max_batch_size=10)
+    embeddings, sleeps = rate_limited(throttling, max_batch_size=40, grow_after=100)
+    assert embeddings.embed_documents(TEXTS) == expected
+    assert embeddings.batch_size == 10
+    assert embeddings.stats()["throttled"] == throttling.throttled == 2
+    assert len(sleeps) == 2 # one backoff per throttled call
+    # Only the throttled calls are repeated: 2 rejected, then 5 accepted batches of 10
+    assert throttling.calls == 7
+
+def test_random_throttling_is_retried_without_losing_or_repeating_texts():
+    expected = DeterministicFakeEmbedding(size=8).embed_documents(TEXTS)
+    throttling = ThrottlingEmbeddings(DeterministicFakeEmbedding(size=8), throttle_rate=0.3, seed=1)
+    embeddings, _ = rate_limited(throttling, max_batch_size=8, max_retries=10)
+    assert embeddings.embed_documents(TEXTS) == expected
+    assert embeddings.stats()["retries"] == throttling.throttled > 0
+
+def test_batch_size_grows_back_after_successes():
+    throttling = ThrottlingEmbeddings(DeterministicFakeEmbedding(size=8), throttle_rate=0, max_batch_size=5)
+    embeddings, _ = rate_limited(throttling, max_batch_size=20, grow_after=1)
+    embeddings.embed_documents(TEXTS[:5]) # throttled at 20, then accepted in halves
+    throttling.max_batch_size = None
+    embeddings.embed_documents(TEXTS)
+    assert embeddings.batch_size == 20
+
+def test_backoff_is_exponential_and_gives_up_after_max_retries():
+    throttling = ThrottlingEmbeddings(DeterministicFakeEmbedding(size=8), throttle_rate=1.0)
+    embeddings, sleeps = rate_limited(throttling, max_retries=3, base_delay=1.0, max_delay=60.0)
+    with pytest.raises(Exception, match="429"):
+        embeddings.embed_query("chunk")
+    assert throttling.calls == 4
+    assert [1.0 * 2 ** attempt * 0.5 <= delay <= 1.0 * 2 ** attempt for attempt, delay in enumerate(sleeps)] == [True] * 3
+
+def test_token_bucket_waits_for_refill():
+    now = [0.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    bucket = TokenBucket(60, clock=lambda: now[0], sleep=sleep)
+    assert bucket.acquire(60) == 0.0
+    assert bucket.acquire(30) == pytest.approx(30.0)
+    assert TokenBucket(0).acquire(10 ** 6) == 0.0
@@ -0,0 +1,55 @@
+import os
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from shared.snapshot import Snapshot, SnapshotVectorStore, current_snapshot_id, export_snapshot
+
+class ListCollection:
+    """In-memory stand-in for the Chroma collection methods export_snapshot uses."""
+
+    def __init__(self, ids, embeddings, documents, metadatas):
+        self.rows = list(zip(ids, embeddings, documents, metadatas))
+
+    def count(self):
+        return len(self.rows)
+
+    def get(self, limit=None, offset=0, include=()):
+        rows = self.rows[offset:offset + limit]
+        return {"ids": [r[0] for r in rows], "embeddings": [r[1] for r in rows],
+                "documents": [r[2] for r in rows], "metadatas": [r[3] for r in rows]}
+
+EMBEDDINGS = DeterministicFakeEmbedding(size=8)
+TEXTS = ["Acme Corp invoice", "Globex invoice", "Initech invoice"]
+
+@pytest.fixture
+def snapshot_path(tmp_path):
+    collection = ListCollection(
+        ["a-0", "b-0", "c-0"], EMBEDDINGS.embed_documents(TEXTS), TEXTS,
+        [{"source": "a.pdf", "total_value": 10.0}, {"source": "b.pdf", "total_value": 20.0}, {"source": "c.pdf"}],
+    )
+    snapshots_dir = str(tmp_path / "snapshots")
+    snapshot_id = export_snapshot(collection, snapshots_dir, extras={"pdfs": ["a.pdf"]}, batch_size=2)
+    assert current_snapshot_id(snapshots_dir) == snapshot_id
+    return os.path.join(snapshots_dir, snapshot_id)
+
+def test_round_trip_and_search(snapshot_path):
+    snapshot = Snapshot(snapshot_path)
+    assert (snapshot.rows, snapshot.ids, snapshot.extra("pdfs")) == (3, ["a-0", "b-0", "c-0"], ["a.pdf"])
+    store = SnapshotVectorStore(snapshot, EMBEDDINGS)
+    assert store.similarity_search("Globex invoice", k=1)[0].page_content == "Globex invoice"
+    hits = store._collection.query([EMBEDDINGS.embed_query("Globex invoice")], n_results=3,
+                                   where={"total_value": {"$lt": 15}})
+    assert hits["ids"] == [["a-0"]]
+
+def test_corrupt_snapshot_is_rejected(snapshot_path):
+    with open(os.path.join(snapshot_path, "documents.bin"), "r+b") as f:
+        f.write(b"X")
+    with pytest.raises(ValueError, match="checksum"):
+        Snapshot(snapshot_path)
+
+def test_snapshot_store_is_read_only(snapshot_path):
+    store = SnapshotVectorStore(Snapshot(snapshot_path), EMBEDDINGS)
+    for write in (lambda: store.add_texts(["new"]), lambda: store._collection.upsert(ids=["x"]),
+                  lambda: store._collection.delete(ids=["a-0"]),
+                  lambda: SnapshotVectorStore.from_texts(["new"], EMBEDDINGS)):
+        with pytest.raises(RuntimeError, match="read-only"):
+            write()
@@ -0,0 +1,126 @@
+import os
+import shutil
+import threading
+import time
+from types import SimpleNamespace
+import pytest
+from pypdf import PdfReader, PdfWriter
+from fakes import FakeChatModel, FakeEmbeddings
+from conftest import VERSION_2_DIR
+
+vector_store_manager = pytest.importorskip("vector_store_manager")
+import llm_utils
+
+INVOICES = [os.path.join(VERSION_2_DIR, "invoices", f"invoice_{i}.pdf") for i in (1, 2)]
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    """vector_store_manager on the compact backend with fresh indexes in tmp_path and the fake models."""
+    monkeypatch.chdir(tmp_path)
+    for directory in ("PDFs", "vector_store", "cache"):
+        os.makedirs(directory)
+    for name in ("vector_store_instance", "invoice_index", "keyword_index", "content_index"):
+        monkeypatch.setattr(vector_store_manager, name, None)
+    monkeypatch.setattr(vector_store_manager, "VECTOR_BACKEND", "compact")
+    monkeypatch.setattr(llm_utils, "_models", {"llm": FakeChatModel(), "embeddings": FakeEmbeddings(size=32)})
+    return vector_store_manager
+
+def resaved_copy(pdf_path, dest_path):
+    """Same pages (and text) as pdf_path, different bytes."""
+    writer = PdfWriter(clone_from=PdfReader(pdf_path))
+    writer.add_metadata({"/Producer": "re-saved"})
+    writer.write(dest_path)
+    return dest_path
+
+def stage(manager, *paths):
+    return manager.stage_uploads([SimpleNamespace(name=path) for path in paths])[0]
+
+def indexed_sources(manager):
+    stored = manager.get_vector_store_instance()._collection.get(include=["metadatas"])
+    return {metadata["source"] for metadata in stored["metadatas"]}
+
+def run(iterator):
+    for status in iterator:
+        pass
+    return status
+
+def test_copy_with_the_same_text_is_skipped_during_ingestion(manager, tmp_path):
+    copy = resaved_copy(INVOICES[0], str(tmp_path / "copy.pdf"))
+    original, duplicate = stage(manager, INVOICES[0], copy)
+    states = {}
+    status = run(manager.ingest_pdfs([original, duplicate], lambda path, state, detail=None: states.update({path: state})))
+    assert states == {original: "indexed", duplicate: "skipped"}
+    assert "Skipped 1 duplicate(s): copy.pdf (same text as invoice_1.pdf)" in status
+    assert indexed_sources(manager) == {original}
+    assert not os.path.exists(duplicate)
+    assert set(manager.get_invoice_index().matching_sources(None)) == {original}
+
+def test_copy_of_an_indexed_pdf_is_skipped_in_a_later_job(manager, tmp_path):
+    run(manager.ingest_pdfs(stage(manager, INVOICES[0])))
+    duplicate, = stage(manager, resaved_copy(INVOICES[0], str(tmp_path / "copy.pdf")))
+    status = run(manager.ingest_pdfs([duplicate]))
+    assert status.startswith("Status: All new PDFs are already in the knowledge base.")
+    assert indexed_sources(manager) == {os.path.join("PDFs", "invoice_1.pdf")}
+
+def test_removing_a_file_while_it_is_ingested_leaves_nothing_behind(manager, tmp_path, monkeypatch):
+    from ingestion_jobs import IngestionJobQueue
+    parsing, release = threading.Event(), threading.Event()
+
+    def process(pdf_paths, on_file_state, stop_event):
+        def on_state(path, state, detail=None):
+            on_file_state(path, state, detail)
+            if state == "parsing":
+                parsing.set()
+                release.wait(timeout=10)
+        return list(manager.ingest_pdfs(pdf_paths, on_state, stop_event))
+
+    jobs = IngestionJobQueue(str(tmp_path / "jobs.db"), process, poll_seconds=0.05)
+    wait_for_files = jobs.wait_for_files
+    # The job only continues once removal has started waiting for it
+    monkeypatch.setattr(jobs, "wait_for_files", lambda paths: (release.set(), wait_for_files(paths)))
+    monkeypatch.setattr(manager, "ingestion_jobs", jobs)
+    pdf_path, = stage(manager, INVOICES[0])
+    job_id = jobs.submit([pdf_path])
+    jobs.start()
+    assert parsing.wait(timeout=10)
+
+    status, _ = manager.remove_selected_pdf("invoice_1.pdf")
+    assert status == "Status: Removed invoice_1.pdf. Knowledge base updated."
+    assert release.is_set()
+    assert jobs.status(job_id)[0]["state"] == "indexed"
+    assert indexed_sources(manager) == set()
+    assert manager.get_invoice_index().matching_sources(None) == []
+    assert not os.path.exists(pdf_path)
+
+def test_removing_a_queued_file_fails_it_in_its_job(manager, tmp_path, monkeypatch):
+    from ingestion_jobs import IngestionJobQueue
+    jobs = IngestionJobQueue(str(tmp_path / "jobs.db"), lambda *args: pytest.fail("job should not run"))
+    monkeypatch.setattr(manager, "ingestion_jobs", jobs)
+    pdf_path, = stage(manager, INVOICES[0])
+    job_id = jobs.submit([pdf_path])
+
+    manager.remove_selected_pdf("invoice_1.pdf")
+    assert jobs.status(job_id) == [{"pdf_path": pdf_path, "state": "failed", "detail": "removed by the user"}]
+
+def test_snapshot_exports_after_removals_run_in_the_background_and_are_merged(manager, monkeypatch):
+    run(manager.ingest_pdfs(stage(manager, *INVOICES)))
+    started, release, exports = threading.Event(), threading.Event(), []
+
+    def export():
+        exports.append(len(indexed_sources(manager)))
+        started.set()
+        release.wait(timeout=10)
+
+    monkeypatch.setattr(manager, "SNAPSHOT_EXPORT_ON_WRITE", True)
+    monkeypatch.setattr(manager, "export_knowledge_base_snapshot", export)
+    manager.remove_selected_pdf("invoice_1.pdf")
+    assert started.wait(timeout=10)
+    # Neither waits for the running export; both are covered by a single follow-up export
+    manager.remove_selected_pdf("invoice_2.pdf")
+    manager.clear_all_data()
+    release.set()
+    deadline = time.monotonic() + 10
+    while len(exports) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.1)
+    assert exports == [1, 0]
@@ -0,0 +1,394 @@
+import os
+import re
+import json
+import uuid
+import shutil
+import sqlite3
+import threading
+from typing import Any, List
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+SCAN_BLOCK_ROWS = 8192 # rows dequantized per step, bounds the scratch memory of a scan
+
+_FILES = {
+    "codes": ("codes.i8", np.int8),       # rows x dimension int8 codes, scanned for every query
+    "scales": ("scales.f32", np.float32), # per-row dequantization scale (max |x| / 127)
+    "norms": ("norms.f32", np.float32),   # per-row L2 norm of the original vector
+    "vectors": ("vectors.f16", np.float16), # rows x dimension float16 copy, read only for re-scoring (optional)
+}
+
+READ_ONLY_MESSAGE = "This compact index was opened read-only; writes go through the writer process."
+
+def _column(field):
+    if not re.fullmatch(r"\w+", field):
+        raise ValueError(f"Unsupported metadata field in filter: {field!r}")
+    return f"json_extract(metadata, '$.{field}')"
+
+def where_to_sql(where):
+    """Translates a Chroma where filter ($and/$or, $eq/$ne/$gt/$gte/$lt/$lte/$in/$nin) into SQL."""
+    clauses, params = [], []
+    for key, value in where.items():
+        if key in ("$and", "$or"):
+            parts = [where_to_sql(condition) for condition in value]
+            joiner = " AND " if key == "$and" else " OR "
+            clauses.append("(" + joiner.join(f"({clause})" for clause, _ in parts) + ")")
+            params += [param for _, part_params in parts for param in part_params]
+            continue
+        column = _column(key)
+        conditions = value if isinstance(value, dict) else {"$eq": value}
+        for operator, operand in conditions.items():
+            if operator in ("$in", "$nin"):
+                if not operand:
+                    clauses.append("0" if operator == "$in" else "1")
+                    continue
+                negate = "NOT " if operator == "$nin" else ""
+                clauses.append(f"{column} {negate}IN ({', '.join('?' * len(operand))})")
+                params += list(operand)
+                continue
+            sql_operators = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+            if operator not in sql_operators:
+                raise ValueError(f"Unsupported filter operator: {operator}")
+            clauses.append(f"{column} {sql_operators[operator]} ?")
+            params.append(operand)
+    return " AND ".join(clauses) or "1", params
+
+def quantize(vectors):
+    """Symmetric per-row int8 quantization. Returns (codes, scales, norms)."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32), np.linalg.norm(vectors, axis=1).astype(np.float32)
+
+class CompactCollection:
+    """
+    Vector collection with the subset of the Chroma collection API used by the
+    app (count, get, query, upsert, delete). Vectors are kept as int8 codes in a
+    memory-mapped file that every process maps read-only, so the OS page cache
+    holds one shared copy. A query scans the codes for approximate cosine scores
+    and re-scores the best rescore_factor * n_results candidates with the float16
+    copy of their vectors. An index created with rescore_factor=0 keeps no float16
+    copy (one byte per dimension instead of three) and ranks by the int8 scores.
+    Documents and metadata live in SQLite, where Chroma where filters are
+    evaluated. Writes must be serialized by the caller; a read_only collection
+    (for worker processes that only search) opens SQLite read-only and refuses them.
+    """
+
+    def __init__(self, path, rescore_factor=4, read_only=False):
+        self.path = path
+        self.rescore_factor = rescore_factor
+        self.read_only = read_only
+        self._lock = threading.Lock()
+        self._mapped = {"version": None, "layout": None, "rows": 0, "alive": None}
+        database = os.path.join(path, "chunks.sqlite3")
+        if read_only:
+            self._conn = sqlite3.connect(f"file:{database}?mode=ro", uri=True, check_same_thread=False)
+            self._float_copy = bool(self._meta("float_copy", default=1))
+            return
+        os.makedirs(path, exist_ok=True)
+        self._conn = sqlite3.connect(database, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " row INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, document TEXT, metadata TEXT,"
+            " alive INTEGER NOT NULL DEFAULT 1)"
+        )
+        for field in ("source", "source_key"):
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_chunks_{field} ON chunks ({_column(field)})")
+        # Whether the float16 copy is kept is fixed when the index is created
+        self._float_copy = bool(self._meta("float_copy", default=int(rescore_factor > 0)))
+        self._set_meta(float_copy=int(self._float_copy))
+        self._conn.commit()
+
+    # --- Storage helpers ---
+
+    def _meta(self, key, default=0):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return int(row[0]) if row else default
+
+    def _set_meta(self, **values):
+        self._conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                               [(key, str(value)) for key, value in values.items()])
+
+    def _file(self, name):
+        return os.path.join(self.path, _FILES[name][0])
+
+    def _files(self):
+        return [name for name in _FILES if name != "vectors" or self._float_copy]
+
+    def _check_writable(self):
+        if self.read_only:
+            raise RuntimeError(READ_ONLY_MESSAGE)
+
+    def _write_rows(self, name, rows, values):
+        """Writes values for the given row numbers, coalescing consecutive rows into one write."""
+        values = np.ascontiguousarray(values, dtype=_FILES[name][1])
+        row_bytes = values[0].nbytes if values.ndim > 1 else values.itemsize
+        mode = "r+b" if os.path.exists(self._file(name)) else "w+b"
+        with open(self._file(name), mode) as f:
+            start = 0
+            while start < len(rows):
+                end = start + 1
+                while end < len(rows) and rows[end] == rows[end - 1] + 1:
+                    end += 1
+                f.seek(rows[start] * row_bytes)
+                f.write(values[start:end].tobytes())
+                start = end
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _refresh(self):
+        """
+        Re-maps the files after another writer (or process) changed them. Appends
+        only add rows past the last mapped one, so the live rows are reloaded in
+        full only when the layout counter shows a delete, revival or compaction.
+        """
+        version = self._meta("version")
+        if version == self._mapped["version"]:
+            return self._mapped
+        # One read transaction, so the counters and the live rows come from the same commit
+        self._conn.execute("BEGIN")
+        try:
+            meta = {key: int(value) for key, value in self._conn.execute("SELECT key, value FROM meta")}
+            rows, dimension, layout = meta.get("rows", 0), meta.get("dimension", 0), meta.get("layout", 0)
+            previous = self._mapped
+            if previous["alive"] is not None and layout == previous["layout"]:
+                appended = self._conn.execute(
+                    "SELECT row FROM chunks WHERE alive = 1 AND row >= ? ORDER BY row", (previous["rows"],)
+                )
+                alive = np.concatenate([previous["alive"], np.array([row for row, in appended], dtype=np.int64)])
+            else:
+                alive = np.array(
+                    [row for row, in self._conn.execute("SELECT row FROM chunks WHERE alive = 1 ORDER BY row")],
+                    dtype=np.int64,
+                )
+        finally:
+            self._conn.commit()
+        mapped = {"version": meta.get("version", 0), "layout": layout, "rows": rows, "dimension": dimension,
+                  "alive": alive, "vectors": None}
+        for name in self._files():
+            shape = (rows, dimension) if name in ("codes", "vectors") else (rows,)
+            mapped[name] = np.memmap(self._file(name), dtype=_FILES[name][1], mode="r", shape=shape) if rows else None
+        self._mapped = mapped
+        return mapped
+
+    def _vectors(self, mapped, rows):
+        """Float32 vectors of the given rows, from the float16 copy or else dequantized from the codes."""
+        if len(rows) == 0:
+            return np.zeros((0, mapped.get("dimension", 0)), dtype=np.float32)
+        if mapped["vectors"] is not None:
+            return mapped["vectors"][rows].astype(np.float32)
+        return mapped["codes"][rows].astype(np.float32) * mapped["scales"][rows][..., None]
+
+    def _fetch(self, rows):
+        """Returns {row: (id, document, metadata)} for the given rows."""
+        records = {}
+        rows = [int(row) for row in rows]
+        for start in range(0, len(rows), 500):
+            batch = rows[start:start + 500]
+            for row, chunk_id, document, metadata in self._conn.execute(
+                f"SELECT row, id, document, metadata FROM chunks WHERE row IN ({','.join('?' * len(batch))})", batch
+            ):
+                records[row] = (chunk_id, document, json.loads(metadata) if metadata else {})
+        return records
+
+    # --- Chroma collection API ---
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks WHERE alive = 1").fetchone()[0]
+
+    def upsert(self, ids, embeddings, documents=None, metadatas=None):
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        documents = documents or [None] * len(ids)
+        metadatas = metadatas or [None] * len(ids)
+        self._check_writable()
+        with self._lock:
+            dimension = self._meta("dimension")
+            if dimension and vectors.shape[1] != dimension:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match the index ({dimension})")
+            existing, revived = {}, False
+            for start in range(0, len(ids), 500):
+                batch = list(ids[start:start + 500])
+                for chunk_id, row, alive in self._conn.execute(
+                    f"SELECT id, row, alive FROM chunks WHERE id IN ({','.join('?' * len(batch))})", batch
+                ):
+                    existing[chunk_id] = row
+                    revived = revived or not alive
+            next_row = self._meta("rows")
+            rows = []
+            for chunk_id in ids:
+                if chunk_id in existing:
+                    rows.append(existing[chunk_id])
+                else:
+                    existing[chunk_id] = next_row
+                    rows.append(next_row)
+                    next_row += 1
+
+            # Vectors are written before the rows are committed, so readers never see a row without them
+            order = np.argsort(rows, kind="stable")
+            sorted_rows = [rows[i] for i in order]
+            codes, scales, norms = quantize(vectors[order])
+            self._write_rows("codes", sorted_rows, codes)
+            self._write_rows("scales", sorted_rows, scales)
+            self._write_rows("norms", sorted_rows, norms)
+            if self._float_copy:
+                self._write_rows("vectors", sorted_rows, vectors[order].astype(np.float16))
+
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (row, id, document, metadata, alive) VALUES (?, ?, ?, ?, 1)",
+                [(row, chunk_id, document, json.dumps(metadata) if metadata is not None else None)
+                 for row, chunk_id, document, metadata in zip(rows, ids, documents, metadatas)],
+            )
+            self._set_meta(rows=next_row, dimension=vectors.shape[1], version=self._meta("version") + 1)
+            if revived:
+                self._set_meta(layout=self._meta("layout") + 1)
+            self._conn.commit()
+
+    def delete(self, ids=None, where=None):
+        self._check_writable()
+        with self._lock:
+            if where is not None:
+                clause, params = where_to_sql(where)
+                self._conn.execute(f"UPDATE chunks SET alive = 0 WHERE alive = 1 AND ({clause})", params)
+            for start in range(0, len(ids or []), 500):
+                batch = list(ids[start:start + 500])
+                self._conn.execute(f"UPDATE chunks SET alive = 0 WHERE id IN ({','.join('?' * len(batch))})", batch)
+            self._set_meta(version=self._meta("version") + 1, layout=self._meta("layout") + 1)
+            self._conn.commit()
+            dead = self._conn.execute("SELECT COUNT(*) FROM chunks WHERE alive = 0").fetchone()[0]
+            if dead > max(1000, self._meta("rows") // 2):
+                self._compact()
+
+    def _compact(self):
+        """Rewrites the files without deleted rows and renumbers the remaining ones."""
+        mapped = self._refresh()
+        alive = mapped["alive"]
+        for name in self._files():
+            data = mapped[name][alive] if len(alive) else np.zeros((0,), dtype=_FILES[name][1])
+            with open(self._file(name) + ".tmp", "wb") as f:
+                f.write(np.ascontiguousarray(data).tobytes())
+        self._conn.execute("DELETE FROM chunks WHERE alive = 0")
+        self._conn.executemany("UPDATE chunks SET row = ? WHERE row = ?",
+                               [(new_row, int(old_row)) for new_row, old_row in enumerate(alive)])
+        for name in self._files():
+            os.replace(self._file(name) + ".tmp", self._file(name))
+        self._set_meta(rows=len(alive), version=self._meta("version") + 1, layout=self._meta("layout") + 1)
+        self._conn.commit()
+        self._mapped = {"version": None, "layout": None, "rows": 0, "alive": None}
+        print(f"Compacted the vector index to {len(alive)} row(s).")
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=("documents", "metadatas")):
+        clauses, params = ["alive = 1"], []
+        if ids is not None:
+            if not ids:
+                return {"ids": [], "documents": [], "metadatas": [], "embeddings": []}
+            clauses.append(f"id IN ({','.join('?' * len(ids))})")
+            params += list(ids)
+        if where:
+            clause, where_params = where_to_sql(where)
+            clauses.append(f"({clause})")
+            params += where_params
+        sql = f"SELECT row, id, document, metadata FROM chunks WHERE {' AND '.join(clauses)} ORDER BY row"
+        sql += " LIMIT ? OFFSET ?"
+        params += [-1 if limit is None else limit, offset or 0]
+        with self._lock:
+            records = self._conn.execute(sql, params).fetchall()
+            mapped = self._refresh() if "embeddings" in include else None
+        result = {"ids": [chunk_id for _, chunk_id, _, _ in records], "documents": None, "metadatas": None,
+                  "embeddings": None}
+        if "documents" in include:
+            result["documents"] = [document for _, _, document, _ in records]
+        if "metadatas" in include:
+            result["metadatas"] = [json.loads(metadata) if metadata else {} for _, _, _, metadata in records]
+        if "embeddings" in include:
+            result["embeddings"] = self._vectors(mapped, [row for row, _, _, _ in records]).tolist()
+        return result
+
+    def _candidate_rows(self, mapped, where):
+        if not where:
+            return mapped["alive"]
+        clause, params = where_to_sql(where)
+        return np.array(
+            [row for row, in self._conn.execute(f"SELECT row FROM chunks WHERE alive = 1 AND ({clause})", params)
+             if row < mapped["rows"]],
+            dtype=np.int64,
+        )
+
+    def _search(self, mapped, candidates, query, n_results):
+        """Returns (rows, cosine similarities) of the best n_results candidates."""
+        query = np.asarray(query, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        approximate = np.empty(len(candidates), dtype=np.float32)
+        for start in range(0, len(candidates), SCAN_BLOCK_ROWS):
+            rows = candidates[start:start + SCAN_BLOCK_ROWS]
+            codes = mapped["codes"][rows].astype(np.float32)
+            norms = mapped["norms"][rows]
+            approximate[start:start + len(rows)] = (codes @ query) * mapped["scales"][rows] / np.where(norms > 0, norms, 1.0)
+        if mapped["vectors"] is None or self.rescore_factor <= 0:
+            best = np.argsort(-approximate, kind="stable")[:n_results]
+            return candidates[best], approximate[best]
+        shortlist_size = min(len(candidates), n_results * self.rescore_factor)
+        shortlist = candidates[np.argpartition(-approximate, shortlist_size - 1)[:shortlist_size]]
+        vectors = self._vectors(mapped, shortlist)
+        norms = np.linalg.norm(vectors, axis=1)
+        exact = (vectors @ query) / np.where(norms > 0, norms, 1.0)
+        best = np.argsort(-exact, kind="stable")[:n_results]
+        return shortlist[best], exact[best]
+
+    def query(self, query_embeddings, n_results=10, where=None, include=("documents", "metadatas", "distances")):
+        result = {key: [] for key in ("ids", "documents", "metadatas", "embeddings", "distances")}
+        with self._lock:
+            mapped = self._refresh()
+            candidates = self._candidate_rows(mapped, where) if mapped["rows"] else np.zeros(0, dtype=np.int64)
+            for query in query_embeddings:
+                if len(candidates) == 0:
+                    rows, similarities, records = [], [], {}
+                else:
+                    rows, similarities = self._search(mapped, candidates, query, n_results)
+                    records = self._fetch(rows)
+                result["ids"].append([records[int(row)][0] for row in rows])
+                result["documents"].append([records[int(row)][1] for row in rows])
+                result["metadatas"].append([records[int(row)][2] for row in rows])
+                result["embeddings"].append(self._vectors(mapped, np.asarray(rows, dtype=np.int64)).tolist()
+                                            if "embeddings" in include else None)
+                result["distances"].append([float(1.0 - similarity) for similarity in similarities])
+        return result
+
+    def disk_bytes(self):
+        return sum(os.path.getsize(os.path.join(self.path, name)) for name in os.listdir(self.path))
+
+class CompactVectorStore(VectorStore):
+    """LangChain VectorStore over a CompactCollection, exposed as _collection like langchain_chroma.Chroma."""
+
+    def __init__(self, path, embedding_function, rescore_factor=4, read_only=False):
+        self._collection = CompactCollection(path, rescore_factor=rescore_factor, read_only=read_only)
+        self._embedding_function = embedding_function
+
+    @property
+    def embeddings(self):
+        return self._embedding_function
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs) -> List[str]:
+        texts = list(texts)
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        self._collection.upsert(ids, self._embedding_function.embed_documents(texts), texts, metadatas)
+        return ids
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs: Any) -> List[Document]:
+        hits = self._collection.query([self._embedding_function.embed_query(query)], n_results=k, where=filter)
+        return [Document(page_content=document, metadata=metadata)
+                for document, metadata in zip(hits["documents"][0], hits["metadatas"][0])]
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, path="compact_index", **kwargs):
+        store = cls(path, embedding)
+        store.add_texts(texts, metadatas, ids)
+        return store
+
+def drop_compact_index(path):
+    """Deletes the index files (the caller must drop its CompactVectorStore first)."""
+    if os.path.exists(path):
+        shutil.rmtree(path)
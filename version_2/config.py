@@ -12,6 +12,51 @@ if not API_KEY or API_KEY == "":
 PDFS_DIR = "PDFs"
 VECTOR_STORE_DIR = "vector_store"
 COLLECTION_NAME = "ask_my_docs_collection"
+INVOICE_INDEX_PATH = os.path.join(VECTOR_STORE_DIR, "invoices.sqlite3")
+JOBS_DB_PATH = os.path.join(VECTOR_STORE_DIR, "jobs.sqlite3")
+KEYWORD_INDEX_PATH = os.path.join(VECTOR_STORE_DIR, "keywords.sqlite3")
+CONTENT_INDEX_PATH = os.path.join(VECTOR_STORE_DIR, "content_hashes.sqlite3")
+# "chroma", or "compact" for the int8 memory-mapped index in compact_index.py
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma").lower()
+COMPACT_INDEX_DIR = os.path.join(VECTOR_STORE_DIR, "compact")
+COMPACT_RESCORE_FACTOR = int(os.getenv("COMPACT_RESCORE_FACTOR", "4"))
+# Search-only worker processes open the compact index read-only and leave indexing to the writer
+COMPACT_READ_ONLY = os.getenv("COMPACT_READ_ONLY", "false").lower() in ("1", "true", "yes")
+# Snapshots: the writer publishes the knowledge base after every change; replicas serve the latest one read-only
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+SNAPSHOT_EXPORT_ON_WRITE = os.getenv("SNAPSHOT_EXPORT_ON_WRITE", "false").lower() in ("1", "true", "yes")
+SERVE_SNAPSHOT = os.getenv("SERVE_SNAPSHOT", "false").lower() in ("1", "true", "yes")
+SNAPSHOT_POLL_SECONDS = int(os.getenv("SNAPSHOT_POLL_SECONDS", "10"))
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", "3"))
+CACHE_DIR = "cache"
+EMBEDDING_CACHE_PATH = os.path.join(CACHE_DIR, "embeddings.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+# Embedding API quota (0 disables a limit); batches shrink on throttling and grow back after successes
+EMBED_REQUESTS_PER_MINUTE = int(os.getenv("EMBED_REQUESTS_PER_MINUTE", "1500"))
+EMBED_TOKENS_PER_MINUTE = int(os.getenv("EMBED_TOKENS_PER_MINUTE", "1000000"))
+EMBED_MAX_BATCH_SIZE = int(os.getenv("EMBED_MAX_BATCH_SIZE", "100"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "5"))
+METADATA_CACHE_PATH = os.path.join(CACHE_DIR, "metadata.sqlite3")
+METADATA_EXTRACTION_CONCURRENCY = int(os.getenv("METADATA_EXTRACTION_CONCURRENCY", "4"))
+METADATA_EXTRACTION_RETRIES = int(os.getenv("METADATA_EXTRACTION_RETRIES", "3"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "256"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+# Reuse the answer of a similar earlier question (cosine similarity, e.g. 0.95); 0 matches exact questions only
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0"))
+QUERY_CONCURRENCY_LIMIT = int(os.getenv("QUERY_CONCURRENCY_LIMIT", "16"))
+QUEUE_MAX_SIZE = int(os.getenv("QUEUE_MAX_SIZE", "256"))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+INGEST_EMBED_WORKERS = int(os.getenv("INGEST_EMBED_WORKERS", "4"))
+# Uploads whose text is at least this similar (MinHash Jaccard estimate, e.g. 0.9) to an indexed PDF are skipped.
+# Off (0) by default: invoices sharing a template already score around 0.6.
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0"))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "6"))
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "30"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+WARM_UP_ON_START = os.getenv("WARM_UP_ON_START", "true").lower() in ("1", "true", "yes")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464")) # 0 disables the /metrics endpoint
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH") # JSON-lines log of per-request stage timings
 
 os.makedirs(PDFS_DIR, exist_ok=True)
 os.makedirs(VECTOR_STORE_DIR, exist_ok=True)
+os.makedirs(CACHE_DIR, exist_ok=True)
@@ -0,0 +1,175 @@
+import re
+import array
+import random
+import sqlite3
+import hashlib
+import threading
+from collections import deque
+
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16 # 16 bands of 4 rows: pairs above ~0.5 Jaccard similarity become candidates
+SHINGLE_WORDS = 5
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(1)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME))
+                 for _ in range(MINHASH_PERMUTATIONS)]
+
+def file_sha256(path):
+    """Hashes the raw bytes of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def normalize_text(text):
+    """Lowercases and collapses whitespace so re-saved copies of a PDF hash the same."""
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+def text_sha256(normalized_text):
+    return hashlib.sha256(normalized_text.encode("utf-8")).hexdigest()
+
+def _shingle_hash(words):
+    return int.from_bytes(hashlib.blake2b(" ".join(words).encode("utf-8"), digest_size=8).digest(), "big")
+
+class TextFingerprint:
+    """
+    Streaming SHA-256 and MinHash signature of a text fed in pieces (e.g. page by
+    page), so only the running minima and the last few words are kept in memory.
+    The result equals hashing the normalized concatenation of all pieces.
+    """
+
+    def __init__(self):
+        self._digest = hashlib.sha256()
+        self._minima = [_MERSENNE_PRIME] * MINHASH_PERMUTATIONS
+        self._window = deque(maxlen=SHINGLE_WORDS - 1)
+        self._words = 0
+
+    def _add_shingle(self, words):
+        h = _shingle_hash(words)
+        self._minima = [min(m, (a * h + b) % _MERSENNE_PRIME) for m, (a, b) in zip(self._minima, _PERMUTATIONS)]
+
+    def update(self, text):
+        text = normalize_text(text)
+        if not text:
+            return
+        self._digest.update(((" " if self._words else "") + text).encode("utf-8"))
+        for word in text.split():
+            if len(self._window) == SHINGLE_WORDS - 1:
+                self._add_shingle([*self._window, word])
+            self._window.append(word)
+            self._words += 1
+
+    def result(self):
+        """Returns (text_hash, minhash_signature), or (None, None) if no text was fed."""
+        if not self._words:
+            return None, None
+        if self._words < SHINGLE_WORDS:
+            self._add_shingle(list(self._window)) # A short text is a single shingle
+        return self._digest.hexdigest(), list(self._minima)
+
+def minhash_signature(normalized_text):
+    """MinHash signature over the word shingles of the text (None if it has no words)."""
+    fingerprint = TextFingerprint()
+    fingerprint.update(normalized_text)
+    return fingerprint.result()[1]
+
+def estimated_similarity(signature_a, signature_b):
+    """Estimated Jaccard similarity of the two texts' shingle sets."""
+    return sum(1 for a, b in zip(signature_a, signature_b) if a == b) / len(signature_a)
+
+def _bands(signature):
+    rows = MINHASH_PERMUTATIONS // MINHASH_BANDS
+    return [
+        (band, hashlib.sha1(array.array("Q", signature[band * rows:(band + 1) * rows]).tobytes()).hexdigest())
+        for band in range(MINHASH_BANDS)
+    ]
+
+class ContentIndex:
+    """
+    Persistent SQLite index of the content hashes of every staged PDF: the
+    SHA-256 of the file bytes, of the normalized extracted text and an optional
+    MinHash signature with LSH bands for near-duplicate lookups.
+    """
+
+    def __init__(self, db_path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " source TEXT PRIMARY KEY, file_hash TEXT NOT NULL, text_hash TEXT, signature BLOB)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_files_file_hash ON files (file_hash)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_files_text_hash ON files (text_hash)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS bands (band INTEGER NOT NULL, bucket TEXT NOT NULL, source TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_bands_bucket ON bands (band, bucket)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_bands_source ON bands (source)")
+        self._conn.commit()
+
+    def add(self, source, file_hash, text_hash=None, signature=None):
+        with self._lock:
+            self._conn.execute("DELETE FROM bands WHERE source = ?", (source,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (source, file_hash, text_hash, signature) VALUES (?, ?, ?, ?)",
+                (source, file_hash, text_hash, array.array("Q", signature).tobytes() if signature else None),
+            )
+            if signature:
+                self._conn.executemany(
+                    "INSERT INTO bands (band, bucket, source) VALUES (?, ?, ?)",
+                    [(band, bucket, source) for band, bucket in _bands(signature)],
+                )
+            self._conn.commit()
+
+    def find_file(self, file_hash):
+        """Returns the source with identical bytes, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT source FROM files WHERE file_hash = ? LIMIT 1", (file_hash,)).fetchone()
+        return row[0] if row else None
+
+    def find_text(self, text_hash, exclude=None):
+        """Returns a source other than exclude with the same normalized text, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT source FROM files WHERE text_hash = ? AND source != ? LIMIT 1", (text_hash, exclude or "")
+            ).fetchone()
+        return row[0] if row else None
+
+    def find_near_duplicate(self, signature, threshold, exclude=None):
+        """Returns (source, similarity) of the most similar other file at or above threshold, or (None, 0.0)."""
+        bands = _bands(signature)
+        with self._lock:
+            candidates = self._conn.execute(
+                "SELECT DISTINCT f.source, f.signature FROM bands b JOIN files f ON f.source = b.source"
+                f" WHERE ({' OR '.join(['(b.band = ? AND b.bucket = ?)'] * len(bands))}) AND f.source != ?",
+                [value for band in bands for value in band] + [exclude or ""],
+            ).fetchall()
+        best, best_similarity = None, 0.0
+        for source, blob in candidates:
+            similarity = estimated_similarity(signature, array.array("Q", blob).tolist())
+            if similarity >= threshold and similarity > best_similarity:
+                best, best_similarity = source, similarity
+        return best, best_similarity
+
+    def sources(self):
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT source FROM files")}
+
+    def file_hashes(self):
+        """Returns {source: SHA-256 of the file bytes}."""
+        with self._lock:
+            return dict(self._conn.execute("SELECT source, file_hash FROM files").fetchall())
+
+    def delete(self, sources):
+        with self._lock:
+            self._conn.executemany("DELETE FROM files WHERE source = ?", [(source,) for source in sources])
+            self._conn.executemany("DELETE FROM bands WHERE source = ?", [(source,) for source in sources])
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM files")
+            self._conn.execute("DELETE FROM bands")
+            self._conn.commit()
+
@@ -0,0 +1,195 @@
+import os
+import time
+import uuid
+import sqlite3
+import threading
+
+FILE_STATES = ["queued", "extracting_metadata", "parsing", "embedding", "indexed", "skipped", "failed"]
+TERMINAL_STATES = {"indexed", "skipped", "failed"}
+
+class IngestionJobQueue:
+    """
+    Persistent background ingestion queue. Jobs and the state of every file in
+    them live in SQLite, and a single worker thread processes queued files with
+    process(pdf_paths, on_file_state, stop_event), where on_file_state(pdf_path, state, detail=None)
+    moves a file through queued -> extracting_metadata -> parsing -> embedding ->
+    indexed | failed (or to skipped if it duplicates an indexed file), and
+    process should return early once stop_event is set (see cancel_all).
+    Files left in a non-terminal state by a crash or restart are re-queued by start().
+    """
+
+    def __init__(self, db_path, process, poll_seconds=1.0):
+        self.process = process
+        self.poll_seconds = poll_seconds
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock) # notified when a file's state or the running job changes
+        self._running = (None, set()) # (job_id, pdf_paths) of the job being processed
+        self._wake = threading.Event()
+        self._claim_lock = threading.Lock() # a job is claimed and marked running atomically
+        self._idle = threading.Event()
+        self._idle.set()
+        self.stop_event = threading.Event()
+        self._thread = None
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, created_at REAL NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_files ("
+            " job_id TEXT NOT NULL, pdf_path TEXT NOT NULL, state TEXT NOT NULL, detail TEXT,"
+            " updated_at REAL NOT NULL, PRIMARY KEY (job_id, pdf_path))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_job_files_state ON job_files (state)")
+        self._conn.commit()
+
+    def submit(self, pdf_paths):
+        """Queues already staged PDFs as a new job and returns its ID."""
+        job_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT INTO jobs (id, created_at) VALUES (?, ?)", (job_id, now))
+            self._conn.executemany(
+                "INSERT INTO job_files (job_id, pdf_path, state, detail, updated_at) VALUES (?, ?, 'queued', NULL, ?)",
+                [(job_id, pdf_path, now) for pdf_path in pdf_paths],
+            )
+            self._conn.commit()
+        self._wake.set()
+        return job_id
+
+    def set_state(self, job_id, pdf_path, state, detail=None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE job_files SET state = ?, detail = ?, updated_at = ? WHERE job_id = ? AND pdf_path = ?",
+                (state, detail, time.time(), job_id, pdf_path),
+            )
+            self._conn.commit()
+            self._changed.notify_all()
+
+    def status(self, job_id):
+        """Returns [{"pdf_path", "state", "detail"}] for the files of a job."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT pdf_path, state, detail FROM job_files WHERE job_id = ? ORDER BY pdf_path", (job_id,)
+            ).fetchall()
+        return [{"pdf_path": pdf_path, "state": state, "detail": detail} for pdf_path, state, detail in rows]
+
+    def cancel_pending(self, reason="cancelled"):
+        """Fails every file that has not started processing yet."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE job_files SET state = 'failed', detail = ?, updated_at = ? WHERE state = 'queued'",
+                (reason, time.time()),
+            )
+            self._conn.commit()
+
+    def cancel_all(self, reason="cancelled"):
+        """
+        Fails every queued file, asks the running job (if any) to stop and waits
+        until it has, so the caller can modify the knowledge base without it.
+        """
+        self.stop_event.set()
+        try:
+            with self._claim_lock:
+                self.cancel_pending(reason)
+            self._idle.wait()
+        finally:
+            self.stop_event.clear()
+
+    def cancel_files(self, pdf_paths, reason="cancelled"):
+        """
+        Fails the given files in every queued job. Returns the ones the running job
+        has claimed; wait_for_files waits until it is done with them.
+        """
+        with self._claim_lock, self._lock:
+            running_job, running = self._running
+            self._conn.executemany(
+                "UPDATE job_files SET state = 'failed', detail = ?, updated_at = ?"
+                " WHERE pdf_path = ? AND state = 'queued' AND job_id != ?",
+                [(reason, time.time(), pdf_path, running_job or "") for pdf_path in pdf_paths],
+            )
+            self._conn.commit()
+            return [pdf_path for pdf_path in pdf_paths if pdf_path in running]
+
+    def _unfinished(self, pdf_paths):
+        """Files of the running job among pdf_paths that are not in a terminal state yet (call with _lock held)."""
+        job_id, running = self._running
+        states = dict(self._conn.execute(
+            "SELECT pdf_path, state FROM job_files WHERE job_id = ?", (job_id,)
+        ).fetchall()) if job_id else {}
+        return [p for p in pdf_paths if p in running and states.get(p) not in TERMINAL_STATES]
+
+    def wait_for_files(self, pdf_paths):
+        """Blocks until the running job has finished with every one of pdf_paths."""
+        with self._changed:
+            self._changed.wait_for(lambda: not self._unfinished(pdf_paths))
+
+    def recover(self):
+        """Re-queues files that were in flight when the process stopped. Returns how many."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE job_files SET state = 'queued', detail = 'recovered after restart', updated_at = ?"
+                f" WHERE state NOT IN ({', '.join('?' * len(TERMINAL_STATES))}) AND state != 'queued'",
+                (time.time(), *TERMINAL_STATES),
+            )
+            self._conn.commit()
+        return cursor.rowcount
+
+    def _next_job(self):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT f.job_id FROM job_files f JOIN jobs j ON j.id = f.job_id"
+                " WHERE f.state = 'queued' ORDER BY j.created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None, []
+            paths = [r[0] for r in self._conn.execute(
+                "SELECT pdf_path FROM job_files WHERE job_id = ? AND state = 'queued'", (row[0],)
+            ).fetchall()]
+        return row[0], paths
+
+    def _run(self):
+        while True:
+            with self._claim_lock:
+                job_id, pdf_paths = self._next_job()
+                if job_id is not None:
+                    self._idle.clear()
+                    with self._lock:
+                        self._running = (job_id, set(pdf_paths))
+            if job_id is None:
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+                continue
+            try:
+                self._run_job(job_id, pdf_paths)
+            finally:
+                with self._changed:
+                    self._running = (None, set())
+                    self._changed.notify_all()
+                self._idle.set()
+
+    def _run_job(self, job_id, pdf_paths):
+        # Files deleted while queued (e.g. by "Clear All Data") are failed up front
+        for pdf_path in [p for p in pdf_paths if not os.path.exists(p)]:
+            self.set_state(job_id, pdf_path, "failed", "file no longer exists")
+        pdf_paths = [p for p in pdf_paths if os.path.exists(p)]
+        if not pdf_paths:
+            return
+        print(f"Ingestion job {job_id}: processing {len(pdf_paths)} file(s).")
+        detail = "not processed"
+        try:
+            self.process(pdf_paths, lambda pdf_path, state, detail=None: self.set_state(job_id, pdf_path, state, detail),
+                         self.stop_event)
+        except Exception as e:
+            print(f"Ingestion job {job_id} failed: {e}")
+            detail = str(e)
+        for row in self.status(job_id):
+            if row["pdf_path"] in pdf_paths and row["state"] not in TERMINAL_STATES:
+                self.set_state(job_id, row["pdf_path"], "failed", detail)
+
+    def start(self):
+        """Recovers unfinished work and starts the background worker (idempotent)."""
+        if self._thread is not None:
+            return
+        recovered = self.recover()
+        if recovered:
+            print(f"Recovered {recovered} unfinished ingestion file(s).")
+        self._thread = threading.Thread(target=self._run, name="ingestion-worker", daemon=True)
+        self._thread.start()
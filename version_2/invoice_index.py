@@ -0,0 +1,162 @@
+import re
+import sqlite3
+import threading
+from langchain_core.structured_query import Comparison, Operation
+
+INVOICE_FIELDS = ["invoice_date", "invoice_number", "total_value", "vendor_name"]
+TEXT_FIELDS = {"invoice_date", "invoice_number", "vendor_name"}
+
+AGGREGATE_FUNCTIONS = {"sum": "SUM", "count": "COUNT", "avg": "AVG", "min": "MIN", "max": "MAX"}
+GROUP_BY_EXPRESSIONS = {
+    "vendor": "vendor_name COLLATE NOCASE",
+    "month": "substr(invoice_date, 1, 7)",
+    "year": "substr(invoice_date, 1, 4)",
+}
+
+# Aggregate wording must be tied to invoices or amounts ("how many invoices", "average
+# amount", "highest invoice", "total billed"), so lookups such as "the invoice number of
+# the Acme invoice" or "what does net 30 mean" stay on the retrieval path
+_AMOUNTS = r"(?:invoices|amounts|values|totals|bills|invoice\s+(?:amount|value|total)s?)"
+_AGGREGATE_PATTERNS = [
+    ("avg", rf"\b(?:average|avg|mean)\s+(?:of\s+)?(?:(?:all|the|our)\s+)?(?:{_AMOUNTS}|invoice|amount|value|total|spend(?:ing)?)\b"),
+    ("count", r"\b(?:how many|number of|count of|count)\s+(?:(?:the|all|our)\s+)?(?:\w+\s+){0,2}?invoices\b"),
+    ("max", rf"\b(?:max|maximum|highest|largest|biggest|most expensive)\s+(?:{_AMOUNTS}|invoice|amount|value|total|bill)\b"),
+    ("min", rf"\b(?:min|minimum|lowest|smallest|cheapest)\s+(?:{_AMOUNTS}|invoice|amount|value|total|bill)\b"),
+    ("sum", rf"\b(?:total|sum)\s+(?:of\s+)?(?:(?:all|the|our)\s+)?(?:{_AMOUNTS}|(?:amount\s+)?(?:billed|invoiced|spent|paid)|spend(?:ing)?"
+            r"|(?:amount|value)\s+of\s+(?:(?:all|the|our)\s+)?(?:\w+\s+)?invoices)\b"),
+    # "total for Acme", "total of 2024", but not the total of one invoice ("total of INV-004", "total for the Acme invoice")
+    ("sum", r"\b(?:total|sum)\s+(?:for|of)\s+(?![^?.]*\b(?:invoice\b|inv[-/]?\d))\w"),
+]
+_GROUP_BY_PATTERN = r"\b(?:per|by|for each|each|grouped by)\s+(vendor|month|year)s?\b"
+
+def detect_aggregate(question):
+    """Returns (function, group_by) for aggregate questions, or (None, None)."""
+    text = question.lower()
+    function = next((name for name, pattern in _AGGREGATE_PATTERNS if re.search(pattern, text)), None)
+    if function is None:
+        return None, None
+    group_match = re.search(_GROUP_BY_PATTERN, text)
+    return function, group_match.group(1) if group_match else None
+
+def filter_to_sql(node):
+    """Translates a self-query filter (Comparison/Operation tree) into a SQL clause and parameters."""
+    if node is None:
+        return "", []
+    if isinstance(node, Operation):
+        parts = [filter_to_sql(argument) for argument in node.arguments]
+        parts = [(clause, params) for clause, params in parts if clause]
+        if not parts:
+            return "", []
+        operator = node.operator.value
+        if operator == "not":
+            return f"NOT ({parts[0][0]})", parts[0][1]
+        joiner = " AND " if operator == "and" else " OR "
+        return joiner.join(f"({clause})" for clause, _ in parts), [p for _, params in parts for p in params]
+    if isinstance(node, Comparison):
+        if node.attribute not in INVOICE_FIELDS:
+            raise ValueError(f"Unsupported filter attribute: {node.attribute}")
+        column = node.attribute
+        collate = " COLLATE NOCASE" if column in TEXT_FIELDS else ""
+        value = node.value
+        if isinstance(value, dict) and "date" in value:
+            value = value["date"]
+        comparator = node.comparator.value
+        if comparator in ("in", "nin"):
+            values = value if isinstance(value, (list, tuple)) else [value]
+            placeholders = ", ".join("?" * len(values))
+            negate = "NOT " if comparator == "nin" else ""
+            return f"{column}{collate} {negate}IN ({placeholders})", list(values)
+        if comparator in ("like", "contain"):
+            return f"{column} LIKE ?", [f"%{value}%"]
+        sql_operators = {"eq": "=", "ne": "!=", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+        return f"{column}{collate} {sql_operators[comparator]} ?", [value]
+    raise ValueError(f"Unsupported filter node: {node!r}")
+
+class InvoiceIndex:
+    """
+    Structured SQLite index of the InvoiceMetadata of every ingested PDF,
+    one row per source file, used to answer aggregate questions exactly.
+    """
+
+    def __init__(self, db_path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS invoices ("
+            " source TEXT PRIMARY KEY, invoice_date TEXT, invoice_number TEXT,"
+            " total_value REAL, vendor_name TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_vendor ON invoices (vendor_name COLLATE NOCASE)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_date ON invoices (invoice_date)")
+        self._conn.commit()
+
+    def upsert(self, rows):
+        """Inserts or replaces {source: metadata} rows."""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO invoices (source, invoice_date, invoice_number, total_value, vendor_name)"
+                " VALUES (?, ?, ?, ?, ?)",
+                [
+                    (source, meta.get("invoice_date"), meta.get("invoice_number"),
+                     meta.get("total_value"), meta.get("vendor_name"))
+                    for source, meta in rows.items()
+                ],
+            )
+            self._conn.commit()
+
+    def delete(self, sources):
+        with self._lock:
+            self._conn.executemany("DELETE FROM invoices WHERE source = ?", [(source,) for source in sources])
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM invoices")
+            self._conn.commit()
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM invoices").fetchone()[0]
+
+    def rows(self):
+        """Returns every indexed invoice as {source: metadata}."""
+        with self._lock:
+            return {
+                source: {"invoice_date": invoice_date, "invoice_number": invoice_number,
+                         "total_value": total_value, "vendor_name": vendor_name}
+                for source, invoice_date, invoice_number, total_value, vendor_name in self._conn.execute(
+                    "SELECT source, invoice_date, invoice_number, total_value, vendor_name FROM invoices"
+                )
+            }
+
+    def vendors(self):
+        """Returns the distinct vendor names of the indexed invoices."""
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                "SELECT DISTINCT vendor_name FROM invoices WHERE vendor_name IS NOT NULL"
+            ).fetchall()]
+
+    def aggregate(self, function, query_filter=None, group_by=None):
+        """
+        Runs an exact aggregate over total_value for the invoices matching query_filter.
+        Returns a list of {"group", "value", "invoice_count"} rows (one row when group_by is None).
+        """
+        sql_function = AGGREGATE_FUNCTIONS[function]
+        value_expr = "COUNT(*)" if function == "count" else f"{sql_function}(total_value)"
+        where, params = filter_to_sql(query_filter)
+        group_expr = GROUP_BY_EXPRESSIONS[group_by] if group_by else "NULL"
+        sql = f"SELECT {group_expr}, {value_expr}, COUNT(*) FROM invoices"
+        if where:
+            sql += f" WHERE {where}"
+        if group_by:
+            sql += f" GROUP BY {group_expr} ORDER BY {group_expr}"
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [{"group": group, "value": value, "invoice_count": count} for group, value, count in rows]
+
+    def matching_sources(self, query_filter=None, limit=50):
+        """Returns the sources matching query_filter (all of them when limit is None)."""
+        where, params = filter_to_sql(query_filter)
+        sql = "SELECT source FROM invoices" + (f" WHERE {where}" if where else "") + " ORDER BY source LIMIT ?"
+        with self._lock:
+            return [row[0] for row in self._conn.execute(sql, params + [-1 if limit is None else limit]).fetchall()]
@@ -1,8 +1,50 @@
-from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
-from config import API_KEY
-
-try:
-    embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key=API_KEY)
-    llm = ChatGoogleGenerativeAI(model="models/gemini-2.5-flash-lite-preview-06-17", temperature=0, google_api_key=API_KEY)
-except Exception as e:
-    raise RuntimeError(f"Failed to initialize Google AI models. Check your API key and network connection. Error: {e}")
+import threading
+from config import (
+    API_KEY, EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES, EMBED_REQUESTS_PER_MINUTE, EMBED_TOKENS_PER_MINUTE,
+    EMBED_MAX_BATCH_SIZE, EMBED_MAX_RETRIES
+)
+
+# The Google clients are built on first use, so importing this module (and serving
+# the UI) does not wait for langchain_google_genai to load or the clients to connect.
+_models = {"llm": None, "embeddings": None}
+_models_lock = threading.Lock()
+
+def _init_error(e):
+    return RuntimeError(f"Failed to initialize Google AI models. Check your API key and network connection. Error: {e}")
+
+def get_embeddings():
+    """Returns the shared (cached) embeddings client, creating it on first use."""
+    with _models_lock:
+        if _models["embeddings"] is None:
+            try:
+                from langchain_google_genai import GoogleGenerativeAIEmbeddings
+                from shared.embedding_cache import CachedEmbeddings
+                from shared.rate_limited_embeddings import RateLimitedEmbeddings
+                _models["embeddings"] = CachedEmbeddings(
+                    RateLimitedEmbeddings(
+                        GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key=API_KEY),
+                        requests_per_minute=EMBED_REQUESTS_PER_MINUTE,
+                        tokens_per_minute=EMBED_TOKENS_PER_MINUTE,
+                        max_batch_size=EMBED_MAX_BATCH_SIZE,
+                        max_retries=EMBED_MAX_RETRIES,
+                    ),
+                    EMBEDDING_CACHE_PATH,
+                    max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
+                    checkpoint_size=EMBED_MAX_BATCH_SIZE,
+                )
+            except Exception as e:
+                raise _init_error(e)
+        return _models["embeddings"]
+
+def get_llm():
+    """Returns the shared chat model, creating it on first use."""
+    with _models_lock:
+        if _models["llm"] is None:
+            try:
+                from langchain_google_genai import ChatGoogleGenerativeAI
+                _models["llm"] = ChatGoogleGenerativeAI(
+                    model="models/gemini-2.5-flash-lite-preview-06-17", temperature=0, google_api_key=API_KEY
+                )
+            except Exception as e:
+                raise _init_error(e)
+        return _models["llm"]
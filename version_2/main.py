@@ -1,6 +1,31 @@
+import time
+STARTED_AT = time.perf_counter()
+
+import os
+import sys
+import threading
 import gradio as gr
-from vector_store_manager import add_to_vector_store, remove_selected_pdf, clear_all_data, get_pdf_list
-from qa_chain_builder import get_answer
+
+# The modules shared with app.py live in the repository root's shared/ package
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import (
+    QUERY_CONCURRENCY_LIMIT, QUEUE_MAX_SIZE, WARM_UP_ON_START, METRICS_PORT, TRACE_LOG_PATH
+)
+from vector_store_manager import (
+    submit_ingestion_job_async, remove_selected_pdf_async, clear_all_data_async, get_pdf_list,
+    render_job_status, ingestion_jobs, start_snapshot_sync, read_only_status
+)
+from qa_chain_builder import get_answer_async, warm_up
+from shared.metrics import configure_trace_log, start_metrics_server
+
+_first_page_served = threading.Event()
+
+def on_page_load():
+    """Refreshes the PDF list and logs the time from process start to the first page served."""
+    if not _first_page_served.is_set():
+        _first_page_served.set()
+        print(f"Time to first page: {time.perf_counter() - STARTED_AT:.2f}s")
+    return gr.update(choices=get_pdf_list(), value=[])
 
 # --- GRADIO UI SETUP ---
 
@@ -16,11 +41,14 @@ def setup_gradio_ui():
                 process_button = gr.Button("Add to Knowledge Base", variant="primary")
                 
                 gr.Markdown("### 2. Current Documents")
-                pdf_list_dropdown = gr.Dropdown(label="Select PDF to Remove", choices=get_pdf_list(), interactive=True)
-                remove_button = gr.Button("Remove Selected PDF", variant="secondary")
+                pdf_list_dropdown = gr.Dropdown(label="Select PDF(s) to Remove", choices=get_pdf_list(), multiselect=True, interactive=True)
+                remove_button = gr.Button("Remove Selected PDFs", variant="secondary")
                 clear_button = gr.Button("Clear All Data", variant="stop")
                 
                 processing_status = gr.Markdown("Status: Ready. Upload PDFs and create the knowledge base.")
+                job_status = gr.Markdown("")
+                job_id = gr.State(None)
+                job_timer = gr.Timer(2)
 
             with gr.Column(scale=2):
                 gr.Markdown("### 3. Ask a Question")
@@ -33,33 +61,56 @@ def setup_gradio_ui():
                 gr.Markdown("### Sources")
                 sources_output = gr.Markdown("Source documents will be listed here...")
 
-        # Link UI components to the core logic functions
+        # Link UI components to the core logic functions.
+        # Store mutations share one "ingest" slot; questions run concurrently up to their own limit.
+        # Uploads only stage the files and queue a job; the background worker indexes them.
         process_button.click(
-            add_to_vector_store, 
+            submit_ingestion_job_async, 
             inputs=[file_uploader], 
-            outputs=[processing_status, pdf_list_dropdown]
+            outputs=[processing_status, pdf_list_dropdown, job_id],
+            concurrency_limit=1,
+            concurrency_id="ingest",
         )
+        job_timer.tick(render_job_status, inputs=[job_id], outputs=[job_status], show_progress="hidden")
         ask_button.click(
-            get_answer, 
+            get_answer_async, 
             inputs=[question_input], 
-            outputs=[answer_output, sources_output]
+            outputs=[answer_output, sources_output],
+            concurrency_limit=QUERY_CONCURRENCY_LIMIT,
+            concurrency_id="query",
         )
         remove_button.click(
-            remove_selected_pdf,
+            remove_selected_pdf_async,
             inputs=[pdf_list_dropdown],
-            outputs=[processing_status, pdf_list_dropdown]
+            outputs=[processing_status, pdf_list_dropdown],
+            concurrency_limit=1,
+            concurrency_id="ingest",
         )
         clear_button.click(
-            clear_all_data, 
+            clear_all_data_async, 
             inputs=[], 
-            outputs=[processing_status, pdf_list_dropdown]
+            outputs=[processing_status, pdf_list_dropdown],
+            concurrency_limit=1,
+            concurrency_id="ingest",
         )
         
-        app.load(get_pdf_list, outputs=pdf_list_dropdown)
+        app.load(on_page_load, outputs=pdf_list_dropdown)
 
+    app.queue(max_size=QUEUE_MAX_SIZE)
     return app
 
 # --- MAIN EXECUTION ---
 if __name__ == "__main__":
+    configure_trace_log(TRACE_LOG_PATH)
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+    # Replicas and read-only workers never index; the writer's jobs stay with the writer
+    if not read_only_status():
+        ingestion_jobs.start()
+    start_snapshot_sync()
     gradio_app = setup_gradio_ui()
+    print(f"UI built in {time.perf_counter() - STARTED_AT:.2f}s")
+    # Models and the vector store load in the background while the first page is served
+    if WARM_UP_ON_START:
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
     gradio_app.launch(share=True, debug=True)
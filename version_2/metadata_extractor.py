@@ -1,13 +1,73 @@
+import re
+import json
 import time
 import random
+import sqlite3
+import hashlib
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from metadata_schema import InvoiceMetadata
-from llm_utils import llm
+from config import METADATA_CACHE_PATH, METADATA_EXTRACTION_CONCURRENCY, METADATA_EXTRACTION_RETRIES
+from llm_utils import get_llm
+from shared.metrics import record_llm_call
+from shared.context_packing import estimate_tokens
+
+TRANSIENT_ERROR_NAMES = {
+    "ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "DeadlineExceeded",
+    "InternalServerError", "GatewayTimeout", "TimeoutError", "ConnectionError",
+}
+
+class MetadataExtractionError(Exception):
+    """Raised when invoice metadata could not be extracted from a document."""
+
+def is_transient_error(error):
+    """True for rate-limit, timeout and server errors that are worth retrying."""
+    return any(cls.__name__ in TRANSIENT_ERROR_NAMES for cls in type(error).__mro__)
+
+_RULE_PATTERNS = {
+    "invoice_number": r"invoice\s*(?:no\.?|number|num|#)\s*[:#]?\s*([A-Z0-9][A-Z0-9\-/]*)",
+    "invoice_date": r"(?:invoice\s+)?date\s*[:]?\s*(\d{4}-\d{2}-\d{2}|\d{1,2}[/.-]\d{1,2}[/.-]\d{4}|\d{1,2}\s+[A-Za-z]+\s+\d{4})",
+    "total_value": r"(?:grand\s+total|total\s+amount|amount\s+due|invoice\s+total)\s*[:]?\s*(?:rs\.?|inr|usd|eur|[$\u20ac\u20b9\u00a3])?\s*([\d,]+(?:\.\d+)?)",
+    "vendor_name": r"(?:supplier|vendor|seller|issued\s+by|from)\s*:\s*([^\n]+)",
+}
+_DATE_FORMATS = ["%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%d %B %Y", "%d %b %Y"]
+
+def normalize_date(value):
+    """Returns value as YYYY-MM-DD, or None if it is not a recognized date."""
+    for date_format in _DATE_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), date_format).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+def extract_metadata_with_rules(doc_content: str):
+    """
+    Reads invoice details from fixed-layout invoices ("Invoice No:", "Date:",
+    "Grand Total:", "Supplier:") without calling the LLM.
+    Returns the metadata dict, or None if any field is missing or fails validation.
+    """
+    fields = {}
+    for field, pattern in _RULE_PATTERNS.items():
+        match = re.search(pattern, doc_content, re.IGNORECASE)
+        if not match:
+            return None
+        fields[field] = match.group(1).strip()
+    fields["invoice_date"] = normalize_date(fields["invoice_date"])
+    try:
+        fields["total_value"] = float(fields["total_value"].replace(",", ""))
+        metadata = InvoiceMetadata(**fields)
+    except (TypeError, ValueError):
+        return None
+    if metadata.total_value <= 0 or not metadata.vendor_name:
+        return None
+    return metadata.model_dump()
 
 def extract_metadata_from_document(doc_content: str, llm_model) -> dict:
     """Uses the LLM to extract structured metadata from document content."""
     parser_llm = llm_model.with_structured_output(InvoiceMetadata)
-    try:
-        prompt = f"""
+    prompt = f"""
         Extract the following invoice details from the document content provided below.
         Ensure the 'invoice_date' is in YYYY-MM-DD format, 'total_value' is a number,
         and 'invoice_number' and 'vendor_name' are strings.
@@ -17,14 +77,128 @@ def extract_metadata_from_document(doc_content: str, llm_model) -> dict:
 
         Extracted Invoice Details:
         """
-        extracted_data = parser_llm.invoke(prompt)
-        return extracted_data.dict()
-    except Exception as e:
-        print(f"Error extracting metadata: {e}")
-        # Fallback to dummy data or raise an error if extraction fails
-        return {
-            "invoice_date": "2025-07-21",
-            "invoice_number": f"INV-{int(time.time())}-{random.randint(0, 10000)}",
-            "total_value": round(random.uniform(100, 5000), 2),
-            "vendor_name": "Unknown Vendor"
-        }
+    record_llm_call("metadata", prompt_tokens=estimate_tokens(prompt))
+    extracted_data = parser_llm.invoke(prompt)
+    if extracted_data is None:
+        raise MetadataExtractionError("The model returned no invoice details.")
+    return extracted_data.model_dump()
+
+class MetadataExtractionService:
+    """
+    Extracts invoice metadata concurrently with a bounded worker count.
+    Each document goes through the local_extractors chain first (cheap rule or
+    template extractors returning a validated dict or None); only documents none
+    of them can read fall through to extract_metadata_from_document. LLM calls
+    retry transient errors with exponential backoff and their results are cached
+    in SQLite keyed by the hash of the first-page text, so re-uploads skip the LLM.
+    Failures are reported explicitly rather than replaced with made-up values.
+    Any model exposing with_structured_output(...).invoke(...) can be used,
+    including a local fake in tests.
+    """
+
+    def __init__(self, llm_model, cache_path, local_extractors=(), max_concurrency=4, max_retries=3,
+                 backoff_seconds=1.0):
+        self.llm_model = llm_model
+        self.local_extractors = list(local_extractors)
+        self.model_name = getattr(llm_model, "model", type(llm_model).__name__)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS extracted (key TEXT PRIMARY KEY, metadata TEXT NOT NULL)")
+        self._conn.commit()
+
+    def _key(self, doc_content):
+        normalized = re.sub(r"\s+", " ", doc_content).strip()
+        return f"{self.model_name}:{hashlib.sha256(normalized.encode('utf-8')).hexdigest()}"
+
+    def _cached(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT metadata FROM extracted WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _store(self, key, metadata):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extracted (key, metadata) VALUES (?, ?)", (key, json.dumps(metadata))
+            )
+            self._conn.commit()
+
+    def extract(self, doc_content):
+        """
+        Returns (metadata, method) for one document, where method is "local",
+        "cache" or "llm". Raises MetadataExtractionError if nothing could read it.
+        """
+        for extractor in self.local_extractors:
+            metadata = extractor(doc_content)
+            if metadata is not None:
+                return metadata, "local"
+
+        key = self._key(doc_content)
+        cached = self._cached(key)
+        if cached is not None:
+            return cached, "cache"
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                metadata = extract_metadata_from_document(doc_content, self.llm_model)
+                break
+            except Exception as e:
+                if attempt == self.max_retries or not is_transient_error(e):
+                    raise MetadataExtractionError(str(e)) from e
+                delay = self.backoff_seconds * (2 ** attempt) * random.uniform(0.5, 1.5)
+                print(f"Transient metadata extraction error, retrying in {delay:.1f}s: {e}")
+                time.sleep(delay)
+
+        self._store(key, metadata)
+        return metadata, "llm"
+
+    def extract_many(self, documents):
+        """
+        Extracts metadata for {key: doc_content} concurrently.
+        Returns ({key: metadata}, {key: error message}, stats) where stats counts
+        how many documents were resolved locally, from the cache or by the LLM.
+        """
+        results, errors = {}, {}
+        stats = {"local": 0, "cache": 0, "llm": 0, "failed": 0}
+
+        def run(item):
+            key, doc_content = item
+            try:
+                metadata, method = self.extract(doc_content)
+                return key, metadata, method, None
+            except MetadataExtractionError as e:
+                return key, None, "failed", str(e)
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            for key, metadata, method, error in pool.map(run, documents.items()):
+                stats[method] += 1
+                if error is None:
+                    results[key] = metadata
+                else:
+                    print(f"Error extracting metadata for {key}: {error}")
+                    errors[key] = error
+
+        if documents:
+            stats["local_hit_ratio"] = stats["local"] / len(documents)
+            print(f"Metadata extraction: {stats['local']} local, {stats['cache']} cached, "
+                  f"{stats['llm']} LLM, {stats['failed']} failed (local hit ratio {stats['local_hit_ratio']:.0%}).")
+        return results, errors, stats
+
+_metadata_service = None
+_metadata_service_lock = threading.Lock()
+
+def get_metadata_service():
+    """Returns the shared MetadataExtractionService, creating it (and the LLM client) on first use."""
+    global _metadata_service
+    with _metadata_service_lock:
+        if _metadata_service is None:
+            _metadata_service = MetadataExtractionService(
+                get_llm(),
+                METADATA_CACHE_PATH,
+                local_extractors=[extract_metadata_with_rules],
+                max_concurrency=METADATA_EXTRACTION_CONCURRENCY,
+                max_retries=METADATA_EXTRACTION_RETRIES,
+            )
+        return _metadata_service
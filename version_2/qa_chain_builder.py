@@ -1,64 +1,26 @@
 import os
-from langchain.prompts import PromptTemplate
-from langchain.chains import RetrievalQA
-from langchain.retrievers.self_query.base import SelfQueryRetriever
-from langchain_core.runnables import RunnablePassthrough, RunnableParallel
+import asyncio
+import threading
+from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from llm_utils import llm
-from metadata_schema import DOCUMENT_DESCRIPTION, metadata_field_info
-from vector_store_manager import get_vector_store_instance
+from langchain_core.structured_query import Comparison, Operation
+from llm_utils import get_llm, get_embeddings
+from config import (
+    ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_SIMILARITY, RETRIEVAL_TOP_K, RETRIEVAL_CANDIDATES,
+    CONTEXT_TOKEN_BUDGET, VECTOR_BACKEND, SERVE_SNAPSHOT
+)
+from shared.answer_cache import AnswerCache
+from vector_store_manager import (
+    get_vector_store_instance, get_store_generation, get_invoice_index, get_keyword_index, store_lock
+)
+from invoice_index import detect_aggregate, TEXT_FIELDS
+from query_parser import QueryFilterParser
+from shared.hybrid_retrieval import HybridRetriever
+from shared.context_packing import pack_context, estimate_tokens
+from shared.concurrency import iterate_async
+from shared.metrics import RequestTrace, record_llm_call
 
-def get_qa_chain():
-    """Builds and returns a SelfQueryRetriever."""
-    vector_store_instance = get_vector_store_instance()
-    if vector_store_instance is None:
-        return None
-
-    return SelfQueryRetriever.from_llm(
-        llm,
-        vector_store_instance,
-        DOCUMENT_DESCRIPTION,
-        metadata_field_info,
-        verbose=True,
-        search_kwargs={"k": 100} # Retrieve up to 100 documents
-    )
-
-def get_answer(question):
-    """Handles the question asking logic."""
-    if not question:
-        return "Please enter a question.", ""
-    
-    retriever = get_qa_chain()
-    if retriever is None:
-        return "The knowledge base has not been created yet. Please process your PDFs first.", ""
-
-    try:
-        # Use the retriever to get relevant documents
-        retrieved_docs = retriever.invoke(question)
-        print(f"\nRetrieved Documents ({len(retrieved_docs)}):\n")
-        for i, doc in enumerate(retrieved_docs):
-            print(f"Document {i+1}:\n  Page Content (first 100 chars): {doc.page_content[:100]}...\n  Metadata: {doc.metadata}\n")
-
-        # If the query is aggregative, calculate the result
-        if any(word in question.lower() for word in ["total", "sum", "count", "average"]):
-            total_value = 0
-            invoice_count = 0
-            seen_invoices = set()
-
-            for doc in retrieved_docs:
-                invoice_id = (doc.metadata.get("invoice_number"), doc.metadata.get("source"))
-                if invoice_id not in seen_invoices:
-                    total_value += doc.metadata.get("total_value", 0)
-                    invoice_count += 1
-                    seen_invoices.add(invoice_id)
-
-            answer = f"Found {invoice_count} invoices. The total value is {total_value:.2f}."
-            sources = "\n".join([f"- {os.path.basename(doc.metadata.get('source', 'Unknown'))}" for doc in retrieved_docs])
-            return answer, sources
-
-        # Otherwise, use the standard QA chain with LCEL
-        else:
-            prompt_template = '''
+QA_PROMPT_TEMPLATE = '''
     Use the following pieces of context from the uploaded documents to answer the question at the end.
     If you don't know the answer based on the provided context, just say that you don't know. Do not make up an answer.
     Keep the answer concise and helpful.
@@ -70,22 +32,225 @@ def get_answer(question):
 
     Helpful Answer:
     '''
-            QA_PROMPT = PromptTemplate.from_template(prompt_template)
+QA_PROMPT = PromptTemplate.from_template(QA_PROMPT_TEMPLATE)
+
+# The answer chain and answer cache need the Google clients, so they are built on first use
+_components = {"answer_chain": None, "answer_cache": None}
+_components_lock = threading.Lock()
+
+def get_answer_chain():
+    """Returns the answer chain. It takes pre-retrieved context, so retrieval runs exactly once per question."""
+    with _components_lock:
+        if _components["answer_chain"] is None:
+            _components["answer_chain"] = QA_PROMPT | get_llm() | StrOutputParser()
+        return _components["answer_chain"]
 
-            rag_chain = (
-                {"context": retriever, "question": RunnablePassthrough()} 
-                | QA_PROMPT 
-                | llm 
-                | StrOutputParser()
+def get_answer_cache():
+    """Returns the cache that reuses answers for repeated or near-duplicate questions until the knowledge base changes."""
+    with _components_lock:
+        if _components["answer_cache"] is None:
+            _components["answer_cache"] = AnswerCache(
+                max_entries=ANSWER_CACHE_MAX_ENTRIES, ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+                embeddings=get_embeddings(), similarity_threshold=ANSWER_CACHE_SIMILARITY,
             )
-            
-            answer = rag_chain.invoke(question)
-            sources = "\n".join(
-                [f"- {os.path.basename(doc.metadata.get('source', 'Unknown'))}, page {doc.metadata.get('page', 'N/A')}"
-                 for doc in retrieved_docs]
+        return _components["answer_cache"]
+
+# The retrievers are built once per vector store generation and shared across requests
+_retriever_cache = {"generation": None, "retriever": None, "hybrid": None}
+_retriever_lock = threading.Lock()
+
+def get_qa_chain():
+    """
+    Returns the cached SelfQueryRetriever, rebuilding it (and the hybrid retriever)
+    only after the vector store changed. The self-query retriever is used to turn
+    questions into metadata filters; the search itself runs in hybrid_retrieve.
+    """
+    generation = get_store_generation()
+    with _retriever_lock:
+        if _retriever_cache["generation"] != generation or _retriever_cache["retriever"] is None:
+            vector_store_instance = get_vector_store_instance()
+            if vector_store_instance is None:
+                return None
+
+            from langchain.retrievers.self_query.base import SelfQueryRetriever
+            from metadata_schema import DOCUMENT_DESCRIPTION, metadata_field_info
+            translator = None
+            if VECTOR_BACKEND == "compact" or SERVE_SNAPSHOT:
+                # The compact index and snapshots evaluate Chroma where filters, so they share Chroma's translator
+                from langchain_community.query_constructors.chroma import ChromaTranslator
+                translator = ChromaTranslator()
+            retriever = SelfQueryRetriever.from_llm(
+                get_llm(),
+                vector_store_instance,
+                DOCUMENT_DESCRIPTION,
+                metadata_field_info,
+                structured_query_translator=translator,
+                verbose=True,
+                search_kwargs={"k": RETRIEVAL_CANDIDATES}
+            )
+            hybrid = HybridRetriever(
+                collection=vector_store_instance._collection,
+                keyword_index=get_keyword_index(),
+                embeddings=get_embeddings(),
+                top_k=RETRIEVAL_TOP_K,
+                candidates=RETRIEVAL_CANDIDATES,
             )
-            return answer, sources
+            _retriever_cache.update(generation=generation, retriever=retriever, hybrid=hybrid)
+        return _retriever_cache["retriever"]
+
+# Questions like "invoices from Acme after 2025-01-01" are parsed locally; the LLM
+# query constructor is only called for the ones the parser cannot read
+query_filter_parser = QueryFilterParser(lambda: get_invoice_index().vendors())
+
+def _has_text_range(node):
+    """True if the filter compares a string field with gt/gte/lt/lte, which Chroma cannot evaluate."""
+    if isinstance(node, Operation):
+        return any(_has_text_range(argument) for argument in node.arguments)
+    return (isinstance(node, Comparison) and node.attribute in TEXT_FIELDS
+            and node.comparator.value in ("gt", "gte", "lt", "lte"))
+
+def hybrid_retrieve(question, retriever, structured_query):
+    """
+    Runs the hybrid (vector + BM25, locally reranked) search for a question.
+    The self-query filter restricts the vector side through Chroma and the
+    keyword side through the invoice index, so both see the same documents.
+    Date ranges are resolved by the invoice index for both sides.
+    """
+    with _retriever_lock:
+        hybrid = _retriever_cache["hybrid"]
+    where, sources = None, None
+    if structured_query.filter is not None:
+        _, search_kwargs = retriever.structured_query_translator.visit_structured_query(structured_query)
+        where = search_kwargs.get("filter")
+        try:
+            sources = get_invoice_index().matching_sources(structured_query.filter, limit=None)
+        except ValueError as e:
+            print(f"Keyword search skipped, filter not supported by the invoice index: {e}")
+            sources = []
+        if _has_text_range(structured_query.filter):
+            if not sources:
+                return []
+            where = {"source": {"$in": sources}}
+    return hybrid.search(question, where=where, sources=sources)
+
+def build_prompt_inputs(question, docs):
+    """
+    Packs the retrieved documents into a deduplicated context within the token
+    budget and logs the size of the prompt. Returns (inputs, used_docs, prompt_tokens).
+    """
+    context, used_docs, _ = pack_context(docs, max_tokens=CONTEXT_TOKEN_BUDGET)
+    inputs = {"context": context, "question": question}
+    prompt_tokens = estimate_tokens(QA_PROMPT.format(**inputs))
+    print(f"Prompt: ~{prompt_tokens} tokens sent to the LLM.")
+    return inputs, used_docs, prompt_tokens
+
+def run_aggregate(query_filter, function, group_by):
+    """Runs an exact aggregate on the structured invoice index and formats the answer and sources."""
+    invoice_index = get_invoice_index()
+    rows = invoice_index.aggregate(function, query_filter, group_by)
+    labels = {"sum": "total value", "count": "invoice count", "avg": "average value",
+              "min": "lowest value", "max": "highest value"}
+
+    def format_value(value):
+        if value is None:
+            return "n/a"
+        return str(value) if function == "count" else f"{value:.2f}"
+
+    if group_by:
+        lines = [f"- {row['group'] or 'Unknown'}: {format_value(row['value'])} ({row['invoice_count']} invoices)"
+                 for row in rows]
+        answer = f"The {labels[function]} per {group_by}:\n" + ("\n".join(lines) or "No matching invoices.")
+    else:
+        row = rows[0]
+        answer = f"Found {row['invoice_count']} invoices. The {labels[function]} is {format_value(row['value'])}."
+
+    sources = invoice_index.matching_sources(query_filter)
+    return answer, "\n".join(f"- {os.path.basename(source)}" for source in sources)
+
+def format_sources(docs):
+    """Lists the source file and page of each retrieved document."""
+    return "\n".join(
+        [f"- {os.path.basename(doc.metadata.get('source', 'Unknown'))}, page {doc.metadata.get('page', 'N/A')}"
+         for doc in docs]
+    )
+
+def get_answer(question):
+    """Synchronous get_answer_async (used by scripts and the benchmarks), so both run the same code."""
+    yield from iterate_async(get_answer_async(question))
+
+async def get_answer_async(question):
+    """
+    Handles the question asking logic with the async LangChain APIs, so a Gradio
+    worker can serve many questions concurrently without a thread per request.
+    Yields the sources as soon as retrieval finishes, then the answer as it streams in.
+    """
+    if not question:
+        yield "Please enter a question.", ""
+        return
+
+    retriever = await asyncio.to_thread(get_qa_chain)
+    if retriever is None:
+        yield "The knowledge base has not been created yet. Please process your PDFs first.", ""
+        return
+
+    trace = RequestTrace("question")
+    generation = get_store_generation()
+    answer_cache = await asyncio.to_thread(get_answer_cache)
+    cached = await asyncio.to_thread(answer_cache.get, question, generation)
+    if cached is not None:
+        trace.finish("cache_hit")
+        yield cached
+        return
+
+    try:
+        # The question becomes a metadata filter, parsed locally when possible and by the LLM otherwise
+        with trace.span("query_construction"):
+            structured_query = await query_filter_parser.aconstruct(question, generation, retriever.query_constructor)
+        function, group_by = detect_aggregate(question)
+        if function is not None:
+            with trace.span("aggregate", function=function):
+                answer, sources = await asyncio.to_thread(run_aggregate, structured_query.filter, function, group_by)
+            await asyncio.to_thread(answer_cache.put, question, generation, answer, sources)
+            trace.finish("aggregate")
+            yield answer, sources
+            return
+
+        async with store_lock.read_async():
+            with trace.span("search"):
+                retrieved_docs = await asyncio.to_thread(hybrid_retrieve, question, retriever, structured_query)
+        with trace.span("context_packing"):
+            inputs, used_docs, prompt_tokens = build_prompt_inputs(question, retrieved_docs)
+        sources = format_sources(used_docs)
+        yield "*Generating answer...*", sources
+
+        answer = ""
+        answer_chain = await asyncio.to_thread(get_answer_chain)
+        with trace.span("generation"):
+            async for token in answer_chain.astream(inputs):
+                answer += token
+                yield answer, sources
+        record_llm_call("answer", prompt_tokens, estimate_tokens(answer))
+        if not answer:
+            trace.finish("empty", prompt_tokens=prompt_tokens)
+            yield "No answer found.", sources
+            return
+        await asyncio.to_thread(answer_cache.put, question, generation, answer, sources)
+        trace.finish(prompt_tokens=prompt_tokens, documents=len(used_docs))
 
     except Exception as e:
         print(f"Error during Q&A: {e}")
-        return "An error occurred while generating the answer.", ""
+        trace.finish("error", error=str(e))
+        yield "An error occurred while generating the answer.", ""
+
+def warm_up():
+    """
+    Loads the models, the vector store and the retrievers ahead of the first
+    question. Meant to run in a background thread once the UI is being served.
+    """
+    try:
+        get_answer_chain()
+        get_answer_cache()
+        get_qa_chain()
+        print("Warm-up complete.")
+    except Exception as e:
+        print(f"Warm-up failed, components will be loaded on first use: {e}")
@@ -0,0 +1,236 @@
+import re
+import calendar
+import threading
+from collections import OrderedDict
+from langchain_core.structured_query import Comparator, Comparison, Operation, Operator, StructuredQuery
+from metadata_extractor import normalize_date
+from invoice_index import _GROUP_BY_PATTERN
+from shared.metrics import registry, record_llm_call
+
+_MONTHS = {name.lower(): number for number, name in enumerate(calendar.month_name) if name}
+_MONTHS.update({name.lower(): number for number, name in enumerate(calendar.month_abbr) if name})
+_MONTH_NAMES = "|".join(sorted(_MONTHS, key=len, reverse=True))
+
+_DATE = (r"(\d{4}-\d{1,2}-\d{1,2}|\d{1,2}[/.-]\d{1,2}[/.-]\d{4}"
+         rf"|\d{{1,2}}\s+(?:{_MONTH_NAMES})\s+\d{{4}}|(?:{_MONTH_NAMES})\s+\d{{1,2}},?\s+\d{{4}})")
+_AMOUNT = r"(?:rs\.?|inr|usd|eur|[$€₹£])?\s*(\d[\d,]*(?:\.\d+)?)\s*(k\b)?"
+_INVOICE_NUMBER = (r"\b(?:(?:for|of|on)\s+)?(?:invoice\s*(?:no\.?|number|num|#)\s*[:#]?\s*([a-z0-9][a-z0-9\-/]*\d[a-z0-9\-/]*)"
+                   r"|(?:invoice\s+)?(inv[-/]?\d[a-z0-9\-/]*))\b")
+
+_DATE_RANGE = rf"\b(?:between|from)\s+{_DATE}\s+(?:and|to|through|until|till|-)\s+{_DATE}"
+_DATE_BOUNDS = [
+    (r"\bafter\s+", Comparator.GT, Comparator.GTE),
+    (r"\b(?:since|from|starting)\s+", Comparator.GTE, Comparator.GTE),
+    (r"\bbefore\s+", Comparator.LT, Comparator.LTE),
+    (r"\b(?:until|till|through|up to|to)\s+", Comparator.LTE, Comparator.LTE),
+    (r"\b(?:on|dated)\s+", Comparator.EQ, Comparator.EQ),
+]
+_AMOUNT_BOUNDS = [
+    (r"\b(?:over|above|more than|greater than|exceeding|higher than)\s+", Comparator.GT),
+    (r"\b(?:at least|minimum of|no less than)\s+", Comparator.GTE),
+    (r"\b(?:under|below|less than|lower than)\s+", Comparator.LT),
+    (r"\b(?:at most|maximum of|no more than)\s+", Comparator.LTE),
+]
+
+# Words that signal a filter the local parser could not read, so the LLM is asked instead
+# ("may" is left out: as a verb it is far more common than the month)
+_UNPARSED_CUES = re.compile(
+    r"\d|\b(?:" + "|".join(name for name in _MONTHS if name != "may") + r")\b"
+    r"|\b(?:last|past|previous|this|next|current)\s+(?:\w+\s+)?(?:year|month|quarter|week|day)s?\b"
+    r"|\b(?:today|yesterday|ago|recent|recently|latest|earliest|newest|oldest|after|before|since|until|between"
+    r"|over|under|above|below|than|not|except|excluding|without|from"
+    # Vendor cues: the vendor named after them is not a known one
+    r"|issued|pay|paid|billed)\b"
+    r"|\b(?:by|for)\s+\w|\b(?:vendor|supplier)\s+(?!(?:has|had|have|is|was|with)\b)\w"
+)
+_VENDOR_PREFIX = r"(?:\b(?:from|by|for|to|vendor|supplier|issued|pay|paid|billed)\s+)*"
+
+def _proper_nouns(question):
+    """Lowercased capitalized words of the question, except its first word (e.g. unknown vendor names)."""
+    words = re.findall(r"\b[A-Z][\w&'-]*", question.strip())
+    first = re.match(r"\W*([\w&'-]*)", question.strip()).group(1)
+    return {word.lower() for word in words if word != first and word != "I"}
+
+def _date(value):
+    value = re.sub(r"(\d),", r"\1", value)
+    month_first = re.fullmatch(r"([a-z]+)\s+(\d{1,2})\s+(\d{4})", value)
+    if month_first:
+        value = f"{month_first.group(2)} {month_first.group(1)} {month_first.group(3)}"
+    return normalize_date(value.title())
+
+def _amount(number, thousands):
+    value = float(number.replace(",", ""))
+    return value * 1000 if thousands else value
+
+def _consume(text, match):
+    return text[:match.start()] + " " + text[match.end():]
+
+def vendor_aliases(vendors):
+    """
+    Maps lowercase names the questions may use to the stored vendor names: the
+    full name and, when no other vendor shares it, its first word (e.g. "acme").
+    """
+    aliases = {vendor.lower(): vendor for vendor in vendors if vendor}
+    first_words = {}
+    for vendor in vendors:
+        words = (vendor or "").lower().split()
+        if len(words) > 1 and len(words[0]) >= 4:
+            first_words.setdefault(words[0], set()).add(vendor)
+    for word, owners in first_words.items():
+        if len(owners) == 1 and word not in aliases:
+            aliases[word] = next(iter(owners))
+    return aliases
+
+def parse_filter(question, aliases):
+    """
+    Parses invoice numbers, dates and date ranges, amount ranges and known vendor
+    names out of a question. Returns a StructuredQuery (with filter None when the
+    question has no filter at all), or None when part of it could not be understood.
+    """
+    text = " " + question.lower() + " "
+    comparisons = []
+
+    match = re.search(_GROUP_BY_PATTERN, text)
+    if match:
+        text = _consume(text, match)
+
+    while match := re.search(_INVOICE_NUMBER, text):
+        comparisons.append(Comparison(comparator=Comparator.EQ, attribute="invoice_number",
+                                      value=(match.group(1) or match.group(2)).upper()))
+        text = _consume(text, match)
+
+    match = re.search(_DATE_RANGE, text)
+    if match:
+        start, end = _date(match.group(1)), _date(match.group(2))
+        if not (start and end):
+            return None
+        comparisons += [Comparison(comparator=Comparator.GTE, attribute="invoice_date", value=start),
+                        Comparison(comparator=Comparator.LTE, attribute="invoice_date", value=end)]
+        text = _consume(text, match)
+    for prefix, exclusive, inclusive in _DATE_BOUNDS:
+        while match := re.search(rf"{prefix}(?:and\s+including\s+)?{_DATE}", text):
+            value = _date(match.group(1))
+            if value is None:
+                return None
+            comparator = inclusive if "including" in match.group(0) else exclusive
+            comparisons.append(Comparison(comparator=comparator, attribute="invoice_date", value=value))
+            text = _consume(text, match)
+    while match := re.search(_DATE, text):
+        value = _date(match.group(1))
+        if value is None:
+            return None
+        comparisons.append(Comparison(comparator=Comparator.EQ, attribute="invoice_date", value=value))
+        text = _consume(text, match)
+    while match := re.search(rf"\b(?:in|during|for|of)?\s*({_MONTH_NAMES})\s+(\d{{4}})\b", text):
+        month, year = _MONTHS[match.group(1)], int(match.group(2))
+        last_day = calendar.monthrange(year, month)[1]
+        comparisons += [
+            Comparison(comparator=Comparator.GTE, attribute="invoice_date", value=f"{year:04d}-{month:02d}-01"),
+            Comparison(comparator=Comparator.LTE, attribute="invoice_date", value=f"{year:04d}-{month:02d}-{last_day:02d}"),
+        ]
+        text = _consume(text, match)
+    while match := re.search(r"\b(?:in|during|for|of)\s+((?:19|20)\d{2})\b", text):
+        year = match.group(1)
+        comparisons += [Comparison(comparator=Comparator.GTE, attribute="invoice_date", value=f"{year}-01-01"),
+                        Comparison(comparator=Comparator.LTE, attribute="invoice_date", value=f"{year}-12-31")]
+        text = _consume(text, match)
+
+    match = re.search(rf"\bbetween\s+{_AMOUNT}\s+and\s+{_AMOUNT}", text)
+    if match:
+        comparisons += [
+            Comparison(comparator=Comparator.GTE, attribute="total_value", value=_amount(match.group(1), match.group(2))),
+            Comparison(comparator=Comparator.LTE, attribute="total_value", value=_amount(match.group(3), match.group(4))),
+        ]
+        text = _consume(text, match)
+    for prefix, comparator in _AMOUNT_BOUNDS:
+        while match := re.search(rf"{prefix}{_AMOUNT}", text):
+            comparisons.append(Comparison(comparator=comparator, attribute="total_value",
+                                          value=_amount(match.group(1), match.group(2))))
+            text = _consume(text, match)
+
+    vendors = []
+    for alias in sorted(aliases, key=len, reverse=True):
+        match = re.search(rf"{_VENDOR_PREFIX}\b{re.escape(alias)}\b", text)
+        if match and aliases[alias] not in vendors:
+            vendors.append(aliases[alias])
+            text = _consume(text, match)
+    if len(vendors) > 1:
+        comparisons.append(Operation(operator=Operator.OR, arguments=[
+            Comparison(comparator=Comparator.EQ, attribute="vendor_name", value=vendor) for vendor in vendors
+        ]))
+    elif vendors:
+        comparisons.append(Comparison(comparator=Comparator.EQ, attribute="vendor_name", value=vendors[0]))
+
+    # Cue words and names left over mean part of the question was not understood
+    if _UNPARSED_CUES.search(text) or any(re.search(rf"\b{re.escape(name)}\b", text) for name in _proper_nouns(question)):
+        return None
+    if not comparisons:
+        query_filter = None
+    elif len(comparisons) == 1:
+        query_filter = comparisons[0]
+    else:
+        query_filter = Operation(operator=Operator.AND, arguments=comparisons)
+    return StructuredQuery(query=question, filter=query_filter, limit=None)
+
+class QueryFilterParser:
+    """
+    Turns questions into self-query StructuredQuery filters, trying a cache
+    of earlier results and the local parser before the LLM query constructor.
+    Results are cached per store generation because the known vendors change
+    with it. stats() reports how often each path was taken.
+    """
+
+    def __init__(self, vendors_fn, max_entries=1024):
+        self.vendors_fn = vendors_fn
+        self.max_entries = max_entries
+        self.counts = {"local": 0, "cache": 0, "llm": 0}
+        self._cache = OrderedDict()
+        self._aliases = {"generation": None, "aliases": {}}
+        self._lock = threading.Lock()
+
+    def _key(self, question, generation):
+        return generation, re.sub(r"\s+", " ", question).strip().lower()
+
+    def _lookup(self, question, generation):
+        """Returns (structured_query, method) from the cache or the local parser, or (None, None)."""
+        key = self._key(question, generation)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key], "cache"
+            if self._aliases["generation"] != generation:
+                self._aliases.update(generation=generation, aliases=vendor_aliases(self.vendors_fn()))
+            aliases = self._aliases["aliases"]
+        structured_query = parse_filter(question, aliases)
+        return structured_query, None if structured_query is None else "local"
+
+    def _store(self, question, generation, structured_query, method):
+        with self._lock:
+            self._cache[self._key(question, generation)] = structured_query
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+            self.counts[method] += 1
+            total = sum(self.counts.values())
+            local_ratio = (self.counts["local"] + self.counts["cache"]) / total
+        registry.inc("query_filters_total", method=method)
+        print(f"Self-query filter via {method}: {structured_query.filter} ({local_ratio:.0%} without the LLM so far).")
+        return structured_query
+
+    def construct(self, question, generation, query_constructor):
+        structured_query, method = self._lookup(question, generation)
+        if structured_query is None:
+            record_llm_call("self_query")
+            structured_query, method = query_constructor.invoke({"query": question}), "llm"
+        return self._store(question, generation, structured_query, method)
+
+    async def aconstruct(self, question, generation, query_constructor):
+        structured_query, method = self._lookup(question, generation)
+        if structured_query is None:
+            record_llm_call("self_query")
+            structured_query, method = await query_constructor.ainvoke({"query": question}), "llm"
+        return self._store(question, generation, structured_query, method)
+
+    def stats(self):
+        with self._lock:
+            total = sum(self.counts.values())
+            return dict(self.counts, local_hit_ratio=(self.counts["local"] + self.counts["cache"]) / total if total else 0.0)
@@ -1,170 +1,621 @@
 import os
+import time
 import shutil
+import asyncio
+import threading
 import gradio as gr
-import chromadb
-from langchain_chroma import Chroma
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from config import PDFS_DIR, VECTOR_STORE_DIR, COLLECTION_NAME
-from llm_utils import embeddings, llm
-from metadata_extractor import extract_metadata_from_document
+from config import (
+    PDFS_DIR, VECTOR_STORE_DIR, COLLECTION_NAME, INVOICE_INDEX_PATH, JOBS_DB_PATH, KEYWORD_INDEX_PATH,
+    CONTENT_INDEX_PATH, INGEST_BATCH_SIZE, INGEST_EMBED_WORKERS, NEAR_DUPLICATE_THRESHOLD, VECTOR_BACKEND,
+    COMPACT_INDEX_DIR, COMPACT_RESCORE_FACTOR, COMPACT_READ_ONLY, SNAPSHOT_DIR, SNAPSHOT_EXPORT_ON_WRITE, SERVE_SNAPSHOT,
+    SNAPSHOT_POLL_SECONDS, SNAPSHOT_KEEP
+)
+from llm_utils import get_embeddings
+from metadata_extractor import get_metadata_service
+from shared.ingestion_pipeline import iter_ingestion_pipeline, describe_progress, load_pdf_pages
+from invoice_index import InvoiceIndex, INVOICE_FIELDS
+from shared.concurrency import ReadWriteLock
+from ingestion_jobs import IngestionJobQueue, FILE_STATES
+from shared.hybrid_retrieval import KeywordIndex, backfill_keyword_index
+from content_index import ContentIndex, TextFingerprint, file_sha256
+from shared.metrics import RequestTrace
+from shared.snapshot import Snapshot, SnapshotVectorStore, export_snapshot, current_snapshot_id
 
 vector_store_instance = None
+invoice_index = None
+keyword_index = None
+content_index = None
+serving_snapshot = None
+store_generation = 0
+
+# Queries hold the read side while they search; mutations take the write side
+# only for the duration of a single batch, delete or clear.
+store_lock = ReadWriteLock()
+_instance_lock = threading.Lock()
+_staging_lock = threading.Lock()
+_snapshot_lock = threading.Lock()
+
+READ_ONLY_STATUS = "Status: This instance serves a read-only snapshot. Make changes on the writer instance."
+COMPACT_READ_ONLY_STATUS = "Status: This worker opens the compact index read-only. Make changes on the writer process."
+
+def read_only_status():
+    """Returns the status line refusing a change on a read-only instance, or None when it may write."""
+    if SERVE_SNAPSHOT:
+        return READ_ONLY_STATUS
+    if VECTOR_BACKEND == "compact" and COMPACT_READ_ONLY:
+        return COMPACT_READ_ONLY_STATUS
+    return None
+
+def get_store_generation():
+    """Returns a counter that changes whenever the knowledge base is modified."""
+    return store_generation
+
+def bump_store_generation():
+    """Marks the knowledge base as changed so cached chains are rebuilt."""
+    global store_generation
+    store_generation += 1
+
+def get_invoice_index():
+    """
+    Returns the structured invoice index, backfilling it from the Chroma
+    metadata the first time it is opened next to an existing collection.
+    """
+    global invoice_index
+    if SERVE_SNAPSHOT:
+        # Built from the served snapshot; empty until one is published
+        if invoice_index is None:
+            invoice_index = InvoiceIndex(":memory:")
+        return invoice_index
+    if invoice_index is None:
+        invoice_index = InvoiceIndex(INVOICE_INDEX_PATH)
+        store = get_vector_store_instance()
+        if invoice_index.count() == 0 and store is not None and store._collection.count() > 0:
+            rows = {}
+            all_docs = store._collection.get(include=["metadatas"])
+            for meta in all_docs["metadatas"]:
+                if meta.get("source") and all(field in meta for field in INVOICE_FIELDS):
+                    rows[meta["source"]] = meta
+            invoice_index.upsert(rows)
+            print(f"Backfilled invoice index with {len(rows)} invoice(s).")
+    return invoice_index
+
+def get_keyword_index():
+    """
+    Returns the BM25 keyword index over the collection's chunks, backfilling it
+    the first time it is opened next to an existing collection.
+    """
+    global keyword_index
+    if SERVE_SNAPSHOT:
+        if keyword_index is None:
+            keyword_index = KeywordIndex(":memory:")
+        return keyword_index
+    if keyword_index is None:
+        keyword_index = KeywordIndex(KEYWORD_INDEX_PATH)
+        store = get_vector_store_instance()
+        if store is not None:
+            backfill_keyword_index(keyword_index, store._collection)
+    return keyword_index
+
+def get_content_index():
+    """
+    Returns the content hash index of the staged PDFs, hashing the bytes of any
+    PDF in the PDFs directory that it does not know yet (e.g. files staged before
+    it existed). Text fingerprints are only computed by the ingestion worker.
+    """
+    global content_index
+    if content_index is None:
+        content_index = ContentIndex(CONTENT_INDEX_PATH)
+        known = content_index.sources()
+        unknown = [os.path.join(PDFS_DIR, name) for name in get_pdf_list() if os.path.join(PDFS_DIR, name) not in known]
+        for pdf_path in unknown:
+            try:
+                content_index.add(pdf_path, file_sha256(pdf_path))
+            except Exception as e:
+                print(f"Could not hash {os.path.basename(pdf_path)}: {e}")
+        if unknown:
+            print(f"Backfilled content hashes for {len(unknown)} PDF(s).")
+    return content_index
 
 def get_vector_store_instance():
     global vector_store_instance
-    if vector_store_instance is None:
-        try:
-            client = chromadb.PersistentClient(path=VECTOR_STORE_DIR)
-            vector_store_instance = Chroma(
-                client=client,
-                collection_name=COLLECTION_NAME,
-                embedding_function=embeddings,
+    if SERVE_SNAPSHOT:
+        if serving_snapshot is None:
+            refresh_serving_snapshot()
+        return vector_store_instance
+    with _instance_lock:
+        if vector_store_instance is None and VECTOR_BACKEND == "compact":
+            try:
+                from compact_index import CompactVectorStore
+                vector_store_instance = CompactVectorStore(
+                    COMPACT_INDEX_DIR, get_embeddings(), rescore_factor=COMPACT_RESCORE_FACTOR,
+                    read_only=COMPACT_READ_ONLY
+                )
+            except Exception as e:
+                print(f"Failed to load the compact vector index: {e}")
+                return None
+        if vector_store_instance is None:
+            try:
+                # Chroma is imported on first use to keep startup fast
+                import chromadb
+                from langchain_chroma import Chroma
+                client = chromadb.PersistentClient(path=VECTOR_STORE_DIR)
+                vector_store_instance = Chroma(
+                    client=client,
+                    collection_name=COLLECTION_NAME,
+                    embedding_function=get_embeddings(),
+                )
+            except Exception as e:
+                print(f"Failed to load vector store from disk: {e}")
+                return None
+        return vector_store_instance
+
+# --- SNAPSHOTS ---
+# A writer instance publishes the knowledge base as a snapshot after every change
+# (SNAPSHOT_EXPORT_ON_WRITE); replica instances (SERVE_SNAPSHOT) serve the latest
+# published snapshot read-only and swap to a new one as soon as it appears.
+
+def export_knowledge_base_snapshot():
+    """
+    Publishes the knowledge base as a new snapshot: every chunk with its vector,
+    the staged PDFs with their content hashes and the invoice index. Queries keep
+    running meanwhile; writers wait. Returns the snapshot ID, or None on failure.
+    """
+    store = get_vector_store_instance()
+    if store is None:
+        return None
+    try:
+        with store_lock.read():
+            hashes = get_content_index().file_hashes()
+            pdfs = {name: {"sha256": hashes.get(os.path.join(PDFS_DIR, name))} for name in sorted(get_pdf_list())}
+            return export_snapshot(
+                store._collection, SNAPSHOT_DIR, extras={"pdfs": pdfs, "invoices": get_invoice_index().rows()},
+                keep=SNAPSHOT_KEEP,
             )
+    except Exception as e:
+        print(f"Could not export a snapshot of the knowledge base: {e}")
+        return None
+
+# Exports run on one background thread; requests made while it exports are merged into one more export
+_export_wanted = threading.Event()
+_export_thread = None
+_export_thread_lock = threading.Lock()
+
+def _export_worker():
+    while True:
+        _export_wanted.wait()
+        _export_wanted.clear()
+        export_knowledge_base_snapshot()
+
+def _publish_snapshot_after_write():
+    """Schedules a snapshot export (SNAPSHOT_EXPORT_ON_WRITE) without waiting for it."""
+    global _export_thread
+    if not SNAPSHOT_EXPORT_ON_WRITE:
+        return
+    with _export_thread_lock:
+        if _export_thread is None:
+            _export_thread = threading.Thread(target=_export_worker, name="snapshot-export", daemon=True)
+            _export_thread.start()
+    _export_wanted.set()
+
+def refresh_serving_snapshot():
+    """
+    Swaps in the snapshot that CURRENT points to if it is not the one being served.
+    It is verified and its in-memory invoice and keyword indexes are built before
+    the swap, so queries only wait for the swap itself. Returns True on a swap.
+    """
+    global vector_store_instance, invoice_index, keyword_index, serving_snapshot
+    with _snapshot_lock:
+        snapshot_id = current_snapshot_id(SNAPSHOT_DIR)
+        if snapshot_id is None or (serving_snapshot is not None and serving_snapshot.snapshot_id == snapshot_id):
+            return False
+        started = time.perf_counter()
+        try:
+            snapshot = Snapshot(os.path.join(SNAPSHOT_DIR, snapshot_id))
+            store = SnapshotVectorStore(snapshot, get_embeddings())
+            invoices = InvoiceIndex(":memory:")
+            invoices.upsert(snapshot.extra("invoices", {}))
+            keywords = KeywordIndex(":memory:")
+            backfill_keyword_index(keywords, store._collection)
         except Exception as e:
-            print(f"Failed to load vector store from disk: {e}")
-            return None
-    return vector_store_instance
+            print(f"Could not open snapshot {snapshot_id}, keeping the current one: {e}")
+            return False
+        with store_lock.write():
+            with _instance_lock:
+                vector_store_instance = store
+            invoice_index, keyword_index, serving_snapshot = invoices, keywords, snapshot
+            bump_store_generation()
+        print(f"Serving snapshot {snapshot_id} ({snapshot.rows} chunk(s), loaded in {time.perf_counter() - started:.2f}s).")
+        return True
 
-def add_to_vector_store(files):
+def start_snapshot_sync():
     """
-    Adds new, non-duplicate PDFs to the vector store.
-    Checks for existing filenames to prevent duplication.
+    On a replica, starts a daemon thread that polls for newly published snapshots.
+    On a writer that exports snapshots, publishes a first one if none exists yet.
     """
-    global vector_store_instance
+    if SERVE_SNAPSHOT:
+        def poll():
+            while True:
+                refresh_serving_snapshot()
+                time.sleep(SNAPSHOT_POLL_SECONDS)
+        threading.Thread(target=poll, name="snapshot-watcher", daemon=True).start()
+    elif SNAPSHOT_EXPORT_ON_WRITE and current_snapshot_id(SNAPSHOT_DIR) is None:
+        _publish_snapshot_after_write()
+
+def _available_path(file_name, file_hash):
+    """
+    Picks the destination for an upload. A different file that already uses the
+    name is kept and the upload is stored as "name (2).pdf"; a leftover copy of
+    the same bytes (e.g. from a failed ingest) is overwritten.
+    """
+    stem, extension = os.path.splitext(file_name)
+    dest_path = os.path.join(PDFS_DIR, file_name)
+    suffix = 2
+    while os.path.exists(dest_path) and file_sha256(dest_path) != file_hash:
+        dest_path = os.path.join(PDFS_DIR, f"{stem} ({suffix}){extension}")
+        suffix += 1
+    return dest_path
+
+def stage_uploads(files):
+    """
+    Copies uploaded files into the PDFs directory unless an exact copy (same SHA-256)
+    is already staged. Only the file bytes are hashed here, so staging stays cheap;
+    copies with the same text are found by the ingestion worker (see _duplicate_text).
+    Returns (new_pdf_paths, skipped_descriptions).
+    """
+    index = get_content_index()
     new_pdf_paths = []
     skipped_files = []
-    for file in files:
-        dest_path = os.path.join(PDFS_DIR, os.path.basename(file.name))
-        if os.path.exists(dest_path):
-            skipped_files.append(os.path.basename(file.name))
-            continue # Skip file if it already exists
-        
-        shutil.copy(file.name, dest_path)
-        new_pdf_paths.append(dest_path)
+    with _staging_lock:
+        for file in files or []:
+            file_name = os.path.basename(file.name)
+            file_hash = file_sha256(file.name)
+            duplicate_of = index.find_file(file_hash)
+            if duplicate_of is not None:
+                skipped_files.append(f"{file_name} (same file as {os.path.basename(duplicate_of)})")
+                continue
 
-    if not new_pdf_paths:
-        status = "Status: All selected files already exist in the knowledge base."
-        if skipped_files:
-            status += f" Skipped: {', '.join(skipped_files)}"
-        return status, gr.update(choices=get_pdf_list())
+            dest_path = _available_path(file_name, file_hash)
+            shutil.copy(file.name, dest_path)
+            index.add(dest_path, file_hash)
+            new_pdf_paths.append(dest_path)
+    return new_pdf_paths, skipped_files
 
-    print(f"Adding {len(new_pdf_paths)} new PDF(s) to the knowledge base...")
-    documents = []
-    failed_files = []
-    for pdf_path in new_pdf_paths:
+def _discard_staged(pdf_paths):
+    """Removes staged PDFs that will not be indexed, so a later upload of the same content is accepted."""
+    get_content_index().delete(pdf_paths)
+    for pdf_path in pdf_paths:
         try:
-            loader = PyPDFLoader(pdf_path)
-            doc_pages = loader.load()
-            # Extract metadata from the first page
-            metadata = extract_metadata_from_document(doc_pages[0].page_content, llm)
-            for page in doc_pages:
-                page.metadata.update(metadata)
-                page.metadata["source"] = pdf_path # Ensure source is correctly set
-            documents.extend(doc_pages)
-        except Exception as e:
-            print(f"Error loading {os.path.basename(pdf_path)}: {e}")
-            failed_files.append(os.path.basename(pdf_path))
+            os.remove(pdf_path)
+        except FileNotFoundError:
+            pass
 
-    if not documents:
-        return "Status: Could not extract text from the new PDFs.", gr.update(choices=get_pdf_list())
+def _duplicate_text(pdf_path, file_hash, text_hash, signature):
+    """
+    Returns why the PDF duplicates another staged PDF (same normalized text or, if
+    NEAR_DUPLICATE_THRESHOLD is set, a similar MinHash signature), or None after
+    recording its text fingerprint in the content index.
+    """
+    index = get_content_index()
+    with _staging_lock:
+        duplicate_of = index.find_text(text_hash, exclude=pdf_path) if text_hash else None
+        if duplicate_of is not None:
+            return f"same text as {os.path.basename(duplicate_of)}"
+        if NEAR_DUPLICATE_THRESHOLD and signature:
+            duplicate_of, similarity = index.find_near_duplicate(signature, NEAR_DUPLICATE_THRESHOLD, exclude=pdf_path)
+            if duplicate_of is not None:
+                return f"{similarity:.0%} similar to {os.path.basename(duplicate_of)}"
+        index.add(pdf_path, file_hash or file_sha256(pdf_path), text_hash, signature)
+    return None
 
-    texts = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200).split_documents(documents)
+def ingest_pdfs(pdf_paths, on_file_state=None, stop_event=None):
+    """
+    Extracts invoice metadata for staged PDFs and streams them into the vector store.
+    on_file_state(pdf_path, state, detail=None) is told as every file moves through
+    extracting_metadata -> parsing -> embedding -> indexed | failed, or to skipped
+    when its text (fingerprinted from the pages the pipeline parses) duplicates
+    another PDF. Staged files that are not indexed are deleted.
+    Setting stop_event makes it stop at the next page window and undo its writes.
+    Yields status lines while batches are indexed; the last one is the summary.
+    """
+    on_file_state = on_file_state or (lambda pdf_path, state, detail=None: None)
 
-    # Load existing vector store or create if it doesn't exist
-    if vector_store_instance is None:
-        try:
-            # Ensure the client and collection exist before trying to add to them
-            client = chromadb.PersistentClient(path=VECTOR_STORE_DIR)
-            vector_store_instance = Chroma(
-                client=client,
-                collection_name=COLLECTION_NAME,
-                embedding_function=embeddings,
-            )
-            # Check if collection is empty, if so, use from_documents to create it
-            if vector_store_instance._collection.count() == 0:
-                 vector_store_instance = Chroma.from_documents(
-                    documents=texts, embedding=embeddings, client=client,
-                    collection_name=COLLECTION_NAME, persist_directory=VECTOR_STORE_DIR
-                )
-            else:
-                vector_store_instance.add_documents(documents=texts)
+    store = get_vector_store_instance()
+    if store is None:
+        for pdf_path in pdf_paths:
+            on_file_state(pdf_path, "failed", "could not open the knowledge base")
+        _discard_staged(pdf_paths)
+        yield "Status: Could not open the knowledge base."
+        return
+
+    trace = RequestTrace("ingest", files=len(pdf_paths))
+    print(f"Adding {len(pdf_paths)} new PDF(s) to the knowledge base...")
+
+    # A file recovered after a restart may have been indexed part-way; start it from scratch
+    with store_lock.write():
+        delete_sources(pdf_paths)
+        get_invoice_index().delete(pdf_paths)
 
+    # Extract invoice metadata from every first page concurrently before streaming the files
+    yield f"Status: Extracting invoice metadata from {len(pdf_paths)} PDF(s)..."
+    first_pages = {}
+    for pdf_path in pdf_paths:
+        on_file_state(pdf_path, "extracting_metadata")
+        try:
+            first_pages[pdf_path] = load_pdf_pages(pdf_path, 0, 1)[0].page_content
         except Exception as e:
-            print(f"Failed to load vector store, creating a new one: {e}")
-            client = chromadb.PersistentClient(path=VECTOR_STORE_DIR)
-            vector_store_instance = Chroma.from_documents(
-                documents=texts, embedding=embeddings, client=client,
-                collection_name=COLLECTION_NAME, persist_directory=VECTOR_STORE_DIR
-            )
-    else:
-        vector_store_instance.add_documents(documents=texts)
-    
-    total_docs_in_chroma = vector_store_instance._collection.count()
-    status = f"Status: Added {len(new_pdf_paths) - len(failed_files)} new PDF(s). Knowledge base now contains {total_docs_in_chroma} document(s) in ChromaDB."
-    if skipped_files:
-        status += f" Skipped {len(skipped_files)} existing file(s)."
+            print(f"Error reading first page of {os.path.basename(pdf_path)}: {e}")
+    with trace.span("metadata_extraction"):
+        file_metadata, _, extraction_stats = get_metadata_service().extract_many(first_pages)
+
+    # Duplicate text is found from the pages as the pipeline parses them, not by extracting them twice
+    file_hashes = get_content_index().file_hashes()
+    fingerprints, skipped = {}, {}
+
+    def attach_invoice_metadata(pdf_path, doc_pages):
+        fingerprint = fingerprints.setdefault(pdf_path, TextFingerprint())
+        for page in doc_pages:
+            fingerprint.update(page.page_content or "")
+            if pdf_path in file_metadata:
+                page.metadata.update(file_metadata[pdf_path])
+            page.metadata["metadata_status"] = "extracted" if pdf_path in file_metadata else "failed"
+            page.metadata["source"] = pdf_path # Ensure source is correctly set
+            page.metadata["source_key"] = source_key(pdf_path)
+        return doc_pages
+
+    def skip_duplicate_text(pdf_path):
+        text_hash, signature = fingerprints.pop(pdf_path, TextFingerprint()).result()
+        duplicate = _duplicate_text(pdf_path, file_hashes.get(pdf_path), text_hash, signature)
+        if duplicate is not None:
+            skipped[pdf_path] = duplicate
+            on_file_state(pdf_path, "skipped", duplicate)
+        return duplicate
+
+    with trace.span("pipeline"):
+        for result in iter_ingestion_pipeline(
+            pdf_paths,
+            store,
+            get_embeddings(),
+            prepare_pages=attach_invoice_metadata,
+            batch_size=INGEST_BATCH_SIZE,
+            embed_workers=INGEST_EMBED_WORKERS,
+            write_lock=store_lock.write,
+            on_file_event=on_file_state,
+            keyword_index=get_keyword_index(),
+            stop_event=stop_event,
+            finish_file=skip_duplicate_text,
+        ):
+            if not result["done"]:
+                yield describe_progress(result)
+    get_invoice_index().upsert(
+        {pdf_path: file_metadata[pdf_path] for pdf_path in result["chunk_ids"] if pdf_path in file_metadata}
+    )
+    bump_store_generation()
+
+    for pdf_path in pdf_paths:
+        if pdf_path in skipped:
+            continue
+        if pdf_path in result["chunk_ids"]:
+            on_file_state(pdf_path, "indexed", None if pdf_path in file_metadata else "invoice details not extracted")
+        else:
+            on_file_state(pdf_path, "failed", result["failed"].get(pdf_path, "no text could be extracted"))
+    # Failed files must not block a later upload of the same content
+    _discard_staged([pdf_path for pdf_path in pdf_paths if pdf_path not in result["chunk_ids"]])
+
+    skipped_files = [f"{os.path.basename(pdf_path)} ({reason})" for pdf_path, reason in skipped.items()]
+    failed = [pdf_path for pdf_path in result["failed"] if pdf_path not in skipped]
+    trace.finish("ok" if result["chunk_ids"] else "failed" if failed else "skipped",
+                 indexed=len(result["chunk_ids"]), failed=len(failed), skipped=len(skipped),
+                 chunks=result["chunks_indexed"])
+    _publish_snapshot_after_write()
+    if not result["chunk_ids"]:
+        if not failed:
+            yield f"Status: All new PDFs are already in the knowledge base. Skipped: {', '.join(skipped_files)}"
+            return
+        yield "Status: Could not extract text from the new PDFs."
+        return
+
+    failed_files = [os.path.basename(pdf_path) for pdf_path in failed]
+    metadata_failed = [os.path.basename(p) for p in result["chunk_ids"] if p not in file_metadata]
+    total_docs_in_chroma = store._collection.count()
+    status = f"Status: Added {len(result['chunk_ids'])} new PDF(s). Knowledge base now contains {total_docs_in_chroma} document(s) in {'the compact index' if VECTOR_BACKEND == 'compact' else 'ChromaDB'}."
     if failed_files:
         status += f" Failed to process: {', '.join(failed_files)}."
-    return status, gr.update(choices=get_pdf_list())
+    if first_pages:
+        status += (
+            f" Invoice details: {extraction_stats['local']} read locally, {extraction_stats['cache']} cached,"
+            f" {extraction_stats['llm']} via LLM ({extraction_stats['local_hit_ratio']:.0%} local)."
+        )
+    if metadata_failed:
+        status += f" Invoice details could not be extracted (excluded from totals): {', '.join(metadata_failed)}."
+    if skipped_files:
+        status += f" Skipped {len(skipped_files)} duplicate(s): {', '.join(skipped_files)}."
+    yield status
 
-def remove_selected_pdf(pdf_to_remove):
-    """Removes a specific PDF file and its embeddings from the vector store."""
-    global vector_store_instance
-    if not pdf_to_remove:
-        return "Status: No PDF selected for removal."
+def add_to_vector_store(files):
+    """
+    Adds new, non-duplicate PDFs to the vector store inline.
+    Uploads whose content is already indexed are skipped (see stage_uploads).
+    Yields status updates as batches are indexed.
+    """
+    if read_only_status():
+        yield read_only_status(), gr.update()
+        return
+    new_pdf_paths, skipped_files = stage_uploads(files)
+    if not new_pdf_paths:
+        status = "Status: All selected files are already in the knowledge base."
+        if skipped_files:
+            status += f" Skipped: {', '.join(skipped_files)}"
+        yield status, gr.update(choices=get_pdf_list())
+        return
 
-    pdf_path = os.path.join(PDFS_DIR, pdf_to_remove)
-    
-    if not os.path.exists(pdf_path):
-        return f"Status: Error - {pdf_to_remove} not found."
+    for status in ingest_pdfs(new_pdf_paths):
+        yield status, gr.update()
+    if skipped_files:
+        status += f" Skipped {len(skipped_files)} duplicate(s): {', '.join(skipped_files)}."
+    yield status, gr.update(choices=get_pdf_list())
 
-    try:
-        # 1. Remove from vector store
-        if vector_store_instance is None and os.path.exists(VECTOR_STORE_DIR) and os.listdir(VECTOR_STORE_DIR):
-             vector_store_instance = Chroma(
-                client=chromadb.PersistentClient(path=VECTOR_STORE_DIR),
-                collection_name=COLLECTION_NAME,
-                embedding_function=embeddings,
-            )
+ingestion_jobs = IngestionJobQueue(
+    JOBS_DB_PATH,
+    process=lambda pdf_paths, on_file_state, stop_event: list(ingest_pdfs(pdf_paths, on_file_state, stop_event)),
+)
 
-        if vector_store_instance is not None:
-            ids_to_delete = []
-            all_docs = vector_store_instance._collection.get(include=["metadatas"])
-            for i, meta in enumerate(all_docs['metadatas']):
-                if meta.get('source') and os.path.basename(meta['source']) == pdf_to_remove:
-                    ids_to_delete.append(all_docs['ids'][i])
+def submit_ingestion_job(files):
+    """
+    Stages the uploaded PDFs and queues them for the background ingestion worker.
+    Returns immediately with the status line, the PDF list update and the job ID.
+    """
+    if read_only_status():
+        return read_only_status(), gr.update(), None
+    new_pdf_paths, skipped_files = stage_uploads(files)
+    if not new_pdf_paths:
+        status = "Status: All selected files are already in the knowledge base."
+        if skipped_files:
+            status += f" Skipped: {', '.join(skipped_files)}"
+        return status, gr.update(choices=get_pdf_list()), None
+
+    job_id = ingestion_jobs.submit(new_pdf_paths)
+    status = f"Status: Queued {len(new_pdf_paths)} PDF(s) as job {job_id}. Progress is shown below."
+    if skipped_files:
+        status += f" Skipped {len(skipped_files)} duplicate(s): {', '.join(skipped_files)}."
+    return status, gr.update(choices=get_pdf_list()), job_id
 
-            if ids_to_delete:
-                vector_store_instance._collection.delete(ids=ids_to_delete)
-                print(f"Removed {len(ids_to_delete)} vectors for {pdf_to_remove}.")
+def render_job_status(job_id):
+    """Returns a Markdown table with the state of every file in the job."""
+    if not job_id:
+        return ""
+    files = ingestion_jobs.status(job_id)
+    if not files:
+        return f"Job {job_id} not found."
+    counts = {state: sum(1 for f in files if f["state"] == state) for state in FILE_STATES}
+    lines = [
+        f"**Job {job_id}:** {counts['indexed']}/{len(files)} indexed, {counts['skipped']} duplicate(s) skipped, "
+        f"{counts['failed']} failed, {len(files) - counts['indexed'] - counts['skipped'] - counts['failed']} in progress.",
+        "",
+        "| File | State | Detail |",
+        "|---|---|---|",
+    ]
+    for f in files:
+        lines.append(f"| {os.path.basename(f['pdf_path'])} | {f['state'].replace('_', ' ')} | {f['detail'] or ''} |")
+    return "\n".join(lines)
+
+def source_key(pdf_path):
+    """Normalized per-file key stored on every chunk so deletes can filter on it."""
+    return os.path.basename(pdf_path)
+
+def delete_sources(pdf_names):
+    """
+    Deletes the chunks of the given PDFs in one batch using a metadata filter,
+    so the cost is proportional to those files' chunks, not to the collection.
+    Returns the number of deleted chunks.
+    """
+    store = get_vector_store_instance()
+    if store is None or not pdf_names:
+        return 0
+    keys = [source_key(name) for name in pdf_names]
+    paths = [os.path.join(PDFS_DIR, key) for key in keys]
+    # Chunks ingested before source_key existed are matched on their stored source path
+    where = {"$or": [{"source_key": {"$in": keys}}, {"source": {"$in": paths}}]}
+    ids_to_delete = store._collection.get(where=where, include=[])["ids"]
+    if ids_to_delete:
+        store._collection.delete(ids=ids_to_delete)
+        get_keyword_index().delete(ids_to_delete)
+    return len(ids_to_delete)
+
+def remove_selected_pdf(pdfs_to_remove):
+    """Removes the selected PDF file(s) and their embeddings from the vector store."""
+    if read_only_status():
+        return read_only_status(), gr.update()
+    if not pdfs_to_remove:
+        return "Status: No PDF selected for removal.", gr.update()
+    if isinstance(pdfs_to_remove, str):
+        pdfs_to_remove = [pdfs_to_remove]
+
+    existing = [name for name in pdfs_to_remove if os.path.exists(os.path.join(PDFS_DIR, name))]
+    missing = [name for name in pdfs_to_remove if name not in existing]
+    if not existing:
+        return f"Status: Error - {', '.join(missing)} not found.", gr.update(choices=get_pdf_list())
+
+    # Queued files are dropped from their jobs; a file the running job has claimed is deleted
+    # only once the job is done writing it, so none of its chunks or invoice rows come back.
+    # (The wait happens before taking the write lock, which the job needs for its writes.)
+    in_flight = ingestion_jobs.cancel_files([os.path.join(PDFS_DIR, name) for name in existing], "removed by the user")
+    if in_flight:
+        print(f"Waiting for the running ingestion job to finish {len(in_flight)} file(s) before removing them.")
+        ingestion_jobs.wait_for_files(in_flight)
+
+    try:
+        # 1. Remove from vector store
+        with store_lock.write():
+            removed_vectors = delete_sources(existing)
+            get_invoice_index().delete([os.path.join(PDFS_DIR, name) for name in existing])
+            get_content_index().delete([os.path.join(PDFS_DIR, name) for name in existing])
+            bump_store_generation()
+        print(f"Removed {removed_vectors} vectors for {len(existing)} PDF(s).")
 
-        # 2. Delete the file
-        os.remove(pdf_path)
+        # 2. Delete the files
+        for name in existing:
+            # A file the job skipped or failed was already discarded
+            if os.path.exists(os.path.join(PDFS_DIR, name)):
+                os.remove(os.path.join(PDFS_DIR, name))
+        _publish_snapshot_after_write()
         
-        return f"Status: Removed {pdf_to_remove}. Knowledge base updated.", gr.update(choices=get_pdf_list(), value=None)
+        status = f"Status: Removed {', '.join(existing)}. Knowledge base updated."
+        if missing:
+            status += f" Not found: {', '.join(missing)}."
+        return status, gr.update(choices=get_pdf_list(), value=None)
 
     except Exception as e:
-        print(f"Error removing {pdf_to_remove}: {e}")
-        return f"Status: An error occurred while removing the file.", gr.update(choices=get_pdf_list())
+        print(f"Error removing {', '.join(existing)}: {e}")
+        return f"Status: An error occurred while removing the file(s).", gr.update(choices=get_pdf_list())
 
 def clear_all_data():
     """Clears the vector store collection and all PDFs."""
     global vector_store_instance
-    vector_store_instance = None
-    
-    try:
-        client = chromadb.PersistentClient(path=VECTOR_STORE_DIR)
-        client.delete_collection(name=COLLECTION_NAME)
-    except Exception as e:
-        print(f"Could not clear collection (it might not exist): {e}")
+    if read_only_status():
+        return read_only_status(), gr.update()
+    # The running job must stop (and undo its writes) before the collection is deleted
+    ingestion_jobs.cancel_all("knowledge base cleared")
+    with store_lock.write():
+        with _instance_lock:
+            vector_store_instance = None
+        bump_store_generation()
+
+        try:
+            if VECTOR_BACKEND == "compact":
+                from compact_index import drop_compact_index
+                drop_compact_index(COMPACT_INDEX_DIR)
+            else:
+                import chromadb
+                client = chromadb.PersistentClient(path=VECTOR_STORE_DIR)
+                client.delete_collection(name=COLLECTION_NAME)
+        except Exception as e:
+            print(f"Could not clear collection (it might not exist): {e}")
+
+        get_invoice_index().clear()
+        get_keyword_index().clear()
+        get_content_index().clear()
 
     if os.path.exists(PDFS_DIR):
         shutil.rmtree(PDFS_DIR)
     os.makedirs(PDFS_DIR)
+    _publish_snapshot_after_write()
     
     return "Status: All documents and knowledge base have been cleared.", gr.update(choices=[], value=None)
 
 def get_pdf_list():
-    """Returns a list of PDF filenames in the PDFs directory."""
+    """Returns a list of PDF filenames in the PDFs directory (on a replica, those of the served snapshot)."""
+    if SERVE_SNAPSHOT:
+        return list(serving_snapshot.extra("pdfs", {})) if serving_snapshot is not None else []
     return [f for f in os.listdir(PDFS_DIR) if f.endswith(".pdf")]
+
+# --- ASYNC HANDLERS ---
+# Blocking work runs in worker threads so the Gradio event loop stays free to serve queries.
+
+async def submit_ingestion_job_async(files):
+    return await asyncio.to_thread(submit_ingestion_job, files)
+
+async def remove_selected_pdf_async(pdfs_to_remove):
+    return await asyncio.to_thread(remove_selected_pdf, pdfs_to_remove)
+
+async def clear_all_data_async():
+    return await asyncio.to_thread(clear_all_data)